@@ -0,0 +1,127 @@
+import gzip
+import hashlib
+import json
+import zlib
+from functools import wraps
+from flask import Blueprint, Response, current_app, jsonify, request, session
+from database import read_session
+from models import User, MoneyRequest, BankAccount, transaction_page, HISTORY_PAGE_SIZE
+from quotes import QuoteError, quote_engine
+from routes import COUNTRY_CODES
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+REVISION = 1  # Part of every ETag; bump it when a response shape changes so clients drop cached bodies
+
+def conditional(etag, payload):
+    """ 304 when the client already holds etag, otherwise payload() as JSON, gzip-compressed when it is
+    large and the client accepts it. The compressed body is a different representation with its own ETag. """
+    for tag in (etag, etag + "-gzip"):
+        if request.if_none_match.contains(tag):
+            response = Response(status=304)
+            response.set_etag(tag)
+            break
+    else:
+        body = json.dumps(payload(), separators=(",", ":")).encode()
+        response = Response(body, mimetype="application/json")
+        if len(body) >= current_app.config.get("API_COMPRESS_MIN_BYTES", 1024) and "gzip" in request.accept_encodings:
+            response.set_data(gzip.compress(body, 6))
+            response.headers["Content-Encoding"] = "gzip"
+            etag += "-gzip"
+        response.set_etag(etag)
+
+    response.headers["Vary"] = "Accept-Encoding, Cookie"
+    response.headers["Cache-Control"] = "private, no-cache"  # Always revalidate, a 304 costs one primary key read
+    return response
+
+def user_resource(name):
+    """ Serves a per-user resource with an ETag from the user's change counter and the query string,
+    so an unchanged resource is answered without running the view """
+    def decorator(view):
+        @wraps(view)
+        def wrapper():
+            user_id = session.get('user_id')
+            version = read_session().query(User.version).filter(User.id == user_id).scalar() if user_id else None
+            if version is None:
+                return jsonify({"error": "Not logged in"}), 401
+            etag = f"{name}-{REVISION}-{user_id}-{version}-{zlib.crc32(request.query_string):08x}"
+            return conditional(etag, lambda: view(user_id))
+        return wrapper
+    return decorator
+
+# ✅ Balance
+@api.route('/balance')
+@user_resource("balance")
+def balance(user_id):
+    user = read_session().get(User, user_id)
+    return {
+        "username": user.username,
+        "email": user.email,
+        "country": user.country,
+        "balance": user.balance,
+        "balance_cents": user.balance_cents
+    }
+
+# ✅ Transactions, newest first: ?cursor=...&limit=20
+@api.route('/transactions')
+@user_resource("transactions")
+def transactions(user_id):
+    limit = min(max(request.args.get('limit', HISTORY_PAGE_SIZE, type=int), 1), 100)
+    page, next_cursor = transaction_page(user_id, request.args.get('cursor'), limit, session=read_session())
+    return {
+        "transactions": [{
+            "id": tx.id,
+            "direction": "sent" if tx.sender_id == user_id else "received",
+            "counterparty": tx.recipient.email if tx.sender_id == user_id else tx.sender.email,
+            "amount": tx.amount,
+            "fee": (tx.fee or 0.0) if tx.sender_id == user_id else 0.0,
+            "timestamp": tx.timestamp.isoformat()
+        } for tx in page],
+        "next_cursor": next_cursor
+    }
+
+# ✅ Pending money requests this user has been asked to pay
+@api.route('/requests')
+@user_resource("requests")
+def pending_requests(user_id):
+    reader = read_session()
+    email = reader.query(User.email).filter(User.id == user_id).scalar()
+    rows = reader.query(MoneyRequest, User.email, User.username).join(User, User.id == MoneyRequest.recipient_id) \
+        .filter(MoneyRequest.sender_email == email, MoneyRequest.status == "Pending").order_by(MoneyRequest.id)
+    return {"requests": [{
+        "id": money_request.id,
+        "from": requester_email,
+        "from_username": requester_username,
+        "amount": money_request.amount,
+        "created_at": money_request.created_at.isoformat() if money_request.created_at else None
+    } for money_request, requester_email, requester_username in rows]}
+
+# ✅ Linked bank accounts, account numbers masked
+@api.route('/bank_accounts')
+@user_resource("bank_accounts")
+def bank_accounts(user_id):
+    accounts = read_session().query(BankAccount).filter_by(user_id=user_id).order_by(BankAccount.id)
+    return {"bank_accounts": [{
+        "id": account.id,
+        "bank_name": account.bank_name,
+        "account_number": "•" * max(len(account.account_number) - 4, 0) + account.account_number[-4:],
+        "ifsc_code": account.ifsc_code,
+        "account_type": account.account_type,
+        "branch_name": account.branch_name
+    } for account in accounts]}
+
+# ✅ Fee percentages from the user's country and the country code table, tagged by content
+@api.route('/fees')
+def fees():
+    user_id = session.get('user_id')
+    country = read_session().query(User.country).filter(User.id == user_id).scalar() if user_id else None
+    if country is None:
+        return jsonify({"error": "Not logged in"}), 401
+    try:
+        payload = {"country": country, "fees": quote_engine().fee_percentages(country, COUNTRY_CODES), "country_codes": COUNTRY_CODES}
+    except QuoteError as e:
+        return jsonify({"error": str(e)}), 503
+
+    # The rate table changes on its own schedule, so the ETag hashes what would be sent
+    etag = f"fees-{REVISION}-" + hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()[:32]
+    return conditional(etag, lambda: payload)
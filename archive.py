@@ -0,0 +1,299 @@
+import hashlib
+import heapq
+import json
+import os
+import secrets
+import zlib
+from collections import namedtuple
+from datetime import datetime, timedelta
+from itertools import groupby, islice
+from flask import current_app
+from sqlalchemy.exc import SQLAlchemyError
+from models import db, User, Transaction, Block, ChainCheckpoint, ArchiveSegment, ArchiveIndex, link_hash
+
+# A segment file is MAGIC followed by one zlib-compressed JSON array of rows per user.
+# ArchiveIndex records each frame's offset and length, so reading a user's history decompresses only their frames.
+MAGIC = b"PAYOSEG1\n"
+CHUNK_SIZE = 1000  # Rows fetched per round trip while archiving, users per email lookup while reading
+COMPRESS_LEVEL = 6
+MIN_AGE = timedelta(days=2)  # Risk counters replay the last day from the hot tables
+
+ArchivedTransaction = namedtuple("ArchivedTransaction", "id timestamp sender_id recipient_id amount fee sender recipient")
+
+def archive_dir():
+    path = current_app.config.get("ARCHIVE_DIR") or os.path.join(current_app.instance_path, "archive")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def write_segment(kind, frames):
+    """ Writes (user_id, rows, index fields) frames to a new read-only file.
+    Returns (file name, index entries, sha256, size), or None when there were no frames. """
+    name = f"{kind}-{datetime.utcnow():%Y%m%dT%H%M%S}-{secrets.token_hex(4)}.seg"
+    path = os.path.join(archive_dir(), name)
+    digest = hashlib.sha256(MAGIC)
+    entries = []
+    with open(path + ".tmp", "wb") as f:
+        f.write(MAGIC)
+        offset = len(MAGIC)
+        for user_id, rows, fields in frames:
+            data = zlib.compress(json.dumps(rows, separators=(",", ":")).encode(), COMPRESS_LEVEL)
+            f.write(data)
+            digest.update(data)
+            entries.append(dict(fields, user_id=user_id, offset=offset, length=len(data), rows=len(rows)))
+            offset += len(data)
+        f.flush()
+        os.fsync(f.fileno())
+
+    if not entries:
+        os.remove(path + ".tmp")
+        return None
+    os.chmod(path + ".tmp", 0o444)
+    os.replace(path + ".tmp", path)
+    return name, entries, digest.hexdigest(), offset
+
+def _commit_segment(kind, cutoff, written, delete_rows):
+    """ Indexes a written segment and deletes the rows it holds from the hot table, in one transaction.
+    delete_rows returns how many table rows it removed. """
+    name, entries, sha256, size = written
+    segment = ArchiveSegment(
+        kind=kind, path=name, cutoff=cutoff, sha256=sha256, bytes=size,
+        first_at=min(entry["first_at"] for entry in entries),
+        last_at=max(entry["last_at"] for entry in entries)
+    )
+    try:
+        db.session.add(segment)
+        db.session.flush()
+        db.session.execute(db.insert(ArchiveIndex), [dict(entry, segment_id=segment.id) for entry in entries])
+        segment.rows = delete_rows()
+        db.session.commit()
+    except SQLAlchemyError:
+        db.session.rollback()
+        os.remove(os.path.join(archive_dir(), name))
+        raise
+    return segment
+
+def _transaction_frames(cutoff, max_id):
+    """ Every user's archivable transfers, sent and received, as one frame per user in (timestamp, id) order """
+    streams = []
+    for own in (Transaction.sender_id, Transaction.recipient_id):
+        query = db.session.query(
+            own, Transaction.timestamp, Transaction.id, Transaction.sender_id, Transaction.recipient_id,
+            Transaction.amount, Transaction.fee
+        ).filter(Transaction.timestamp < cutoff, Transaction.id <= max_id).order_by(own, Transaction.timestamp, Transaction.id)
+        streams.append(query.execution_options(stream_results=True).yield_per(CHUNK_SIZE))
+
+    merged = heapq.merge(*streams, key=lambda row: (row[0], row[1], row[2]))
+    for user_id, group in groupby(merged, key=lambda row: row[0]):
+        rows, timestamps = [], []
+        for _, timestamp, transaction_id, sender_id, recipient_id, amount, fee in group:
+            if rows and rows[-1][0] == transaction_id:
+                continue  # A self-transfer comes from both streams
+            rows.append([transaction_id, timestamp.isoformat(), sender_id, recipient_id, amount, fee or 0.0])
+            timestamps.append(timestamp)
+        yield user_id, rows, {"first_at": timestamps[0], "last_at": timestamps[-1], "net_cents": _net_cents(user_id, rows)}
+
+def _block_frames(cutoff):
+    """ The verified, old prefix of every chain: blocks before the user's checkpoint and the cutoff,
+    contiguous from the first block still in the table. The checkpoint block itself stays hot as the anchor. """
+    first_hot = dict(db.session.query(Block.user_id, db.func.min(Block.index)).group_by(Block.user_id))
+    query = db.session.query(Block.user_id, Block.index, Block.timestamp, Block.data, Block.previous_hash, Block.amount_cents) \
+        .join(ChainCheckpoint, ChainCheckpoint.user_id == Block.user_id) \
+        .filter(Block.timestamp < cutoff, Block.index < ChainCheckpoint.last_index) \
+        .order_by(Block.user_id, Block.index)
+
+    for user_id, group in groupby(query.execution_options(stream_results=True).yield_per(CHUNK_SIZE), key=lambda row: row[0]):
+        rows, timestamps = [], []
+        for _, index, timestamp, data, previous_hash, amount in group:
+            if index != (rows[-1][0] + 1 if rows else first_hot[user_id]):
+                break
+            rows.append([index, timestamp.isoformat(), data, previous_hash, amount])
+            timestamps.append(timestamp)
+        if rows:
+            last = rows[-1]
+            yield user_id, rows, {
+                "first_at": timestamps[0], "last_at": timestamps[-1], "first_index": rows[0][0], "last_index": last[0],
+                "amount_cents": sum(row[4] for row in rows), "last_hash": link_hash(last[0], last[2], last[3])
+            }
+
+def archive_transactions(cutoff):
+    """ Moves transfers older than cutoff into a new segment. Returns the ArchiveSegment or None. """
+    max_id = db.session.query(db.func.max(Transaction.id)).filter(Transaction.timestamp < cutoff).scalar()
+    if max_id is None:
+        return None
+    written = write_segment("transaction", _transaction_frames(cutoff, max_id))
+    if written is None:
+        return None
+
+    def delete_rows():
+        return db.session.query(Transaction).filter(Transaction.timestamp < cutoff, Transaction.id <= max_id) \
+            .delete(synchronize_session=False)
+    return _commit_segment("transaction", cutoff, written, delete_rows)
+
+def archive_blocks(cutoff):
+    """ Moves verified blocks older than cutoff into a new segment. Returns the ArchiveSegment or None.
+    Chains without a checkpoint are left alone, so run verify-chains first. """
+    written = write_segment("block", _block_frames(cutoff))
+    if written is None:
+        return None
+
+    blocks = Block.__table__
+    def delete_rows():
+        db.session.execute(
+            blocks.delete().where(blocks.c.user_id == db.bindparam("b_user"),
+                                  blocks.c["index"].between(db.bindparam("b_first"), db.bindparam("b_last"))),
+            [{"b_user": entry["user_id"], "b_first": entry["first_index"], "b_last": entry["last_index"]} for entry in written[1]]
+        )
+        return sum(entry["rows"] for entry in written[1])
+    return _commit_segment("block", cutoff, written, delete_rows)
+
+def archive_before(cutoff):
+    """ Archives transfers and blocks older than cutoff. Returns the segments written.
+    Do not run compact-ledger at the same time: it rewrites the blocks being archived. """
+    if cutoff > datetime.utcnow() - MIN_AGE:
+        raise ValueError(f"Cutoff must be at least {MIN_AGE.days} days in the past")
+    return [segment for segment in (archive_transactions(cutoff), archive_blocks(cutoff)) if segment is not None]
+
+def _read(f, offset, length):
+    f.seek(offset)
+    return json.loads(zlib.decompress(f.read(length)))
+
+def _frames(kind, user_id, session, start=None, end=None, newest_first=False):
+    """ A user's rows of one kind, frame by frame, only from frames overlapping [start, end] """
+    query = session.query(ArchiveSegment.path, ArchiveIndex.offset, ArchiveIndex.length) \
+        .join(ArchiveSegment, ArchiveSegment.id == ArchiveIndex.segment_id) \
+        .filter(ArchiveIndex.user_id == user_id, ArchiveSegment.kind == kind)
+    if start is not None:
+        query = query.filter(ArchiveIndex.last_at >= start)
+    if end is not None:
+        query = query.filter(ArchiveIndex.first_at <= end)
+    # Each run archives rows older than everything left behind, so segment order is time order
+    order = ArchiveIndex.segment_id.desc() if newest_first else ArchiveIndex.segment_id
+    for path, offset, length in query.order_by(order).all():
+        with open(os.path.join(archive_dir(), path), "rb") as f:
+            rows = _read(f, offset, length)
+        yield rows[::-1] if newest_first else rows
+
+def _transaction_frames_for(user_id, session, start=None, end=None, before=None, newest_first=False):
+    """ Decoded (timestamp, id, sender_id, recipient_id, amount, fee) lists per frame, filtered to the period """
+    for rows in _frames("transaction", user_id, session, start, before[0] if before else end, newest_first):
+        decoded = []
+        for transaction_id, timestamp, sender_id, recipient_id, amount, fee in rows:
+            timestamp = datetime.fromisoformat(timestamp)
+            if (start and timestamp < start) or (end and timestamp >= end) or (before and (timestamp, transaction_id) >= before):
+                continue
+            decoded.append((timestamp, transaction_id, sender_id, recipient_id, amount, fee))
+        yield decoded
+
+def archived_transactions(user_id, start=None, end=None, before=None, newest_first=False, session=None):
+    """ A user's archived transfers as (timestamp, id, sender_id, recipient_id, amount, fee), oldest first.
+    start and end bound a period (end exclusive), before is a (timestamp, id) keyset as in transaction_page. """
+    for rows in _transaction_frames_for(user_id, session or db.session, start, end, before, newest_first):
+        yield from rows
+
+def _emails(user_ids, known, session):
+    """ Adds the emails of user_ids missing from known, CHUNK_SIZE ids per query """
+    missing = sorted(set(user_ids) - set(known))
+    for start in range(0, len(missing), CHUNK_SIZE):
+        known.update(session.query(User.id, User.email).filter(User.id.in_(missing[start:start + CHUNK_SIZE])))
+    return known
+
+def archived_page(user_id, before, limit, session=None):
+    """ Up to limit archived transfers older than before, newest first, shaped like Transaction rows
+    with sender and recipient loaded so history templates render them unchanged """
+    session = session or db.session
+    rows = list(islice(archived_transactions(user_id, before=before, newest_first=True, session=session), limit))
+    if not rows:
+        return []
+    users = {user.id: user for user in session.query(User).filter(User.id.in_({row[2] for row in rows} | {row[3] for row in rows}))}
+    return [ArchivedTransaction(transaction_id, timestamp, sender_id, recipient_id, amount, fee, users.get(sender_id), users.get(recipient_id))
+            for timestamp, transaction_id, sender_id, recipient_id, amount, fee in rows]
+
+def archived_statement_rows(user_id, start=None, end=None, session=None):
+    """ archived_transactions() with the counterparty's email appended, the row shape statement_rows merges """
+    session = session or db.session
+    emails = {}
+    for rows in _transaction_frames_for(user_id, session, start, end):
+        _emails((recipient_id if sender_id == user_id else sender_id for _, _, sender_id, recipient_id, _, _ in rows), emails, session)
+        for timestamp, transaction_id, sender_id, recipient_id, amount, fee in rows:
+            yield timestamp, transaction_id, sender_id, recipient_id, amount, fee, emails.get(recipient_id if sender_id == user_id else sender_id)
+
+def _net_cents(user_id, rows):
+    """ Received minus sent (with fees) over transaction rows, as stored or decoded """
+    net = 0
+    for row in rows:
+        sender_id, recipient_id, amount, fee = row[2:6]
+        if recipient_id == user_id:
+            net += round(amount * 100)
+        if sender_id == user_id:
+            net -= round((amount + fee) * 100)
+    return net
+
+def archived_net_cents(user_id, before, session=None):
+    """ _net_cents() over a user's archived transfers older than before. Frames entirely before it
+    use the total stored in the index; only a frame straddling before is decompressed. """
+    session = session or db.session
+    frames = session.query(ArchiveIndex.last_at, ArchiveIndex.net_cents) \
+        .join(ArchiveSegment, ArchiveSegment.id == ArchiveIndex.segment_id) \
+        .filter(ArchiveIndex.user_id == user_id, ArchiveSegment.kind == "transaction", ArchiveIndex.first_at < before)
+    net, straddling = 0, False
+    for last_at, net_cents in frames:
+        if last_at < before:
+            net += net_cents
+        else:
+            straddling = True
+    if straddling:
+        for rows in _frames("transaction", user_id, session, start=before, end=before):
+            net += _net_cents(user_id, [row for row in rows if datetime.fromisoformat(row[1]) < before])
+    return net
+
+def _segment_transfers(segment_id, path, session):
+    """ Every transfer in a segment once, taken from its sender's frame """
+    frames = session.query(ArchiveIndex.user_id, ArchiveIndex.offset, ArchiveIndex.length) \
+        .filter(ArchiveIndex.segment_id == segment_id).order_by(ArchiveIndex.offset)
+    with open(os.path.join(archive_dir(), path), "rb") as f:
+        for user_id, offset, length in frames:
+            for row in _read(f, offset, length):
+                if row[2] == user_id:
+                    yield row
+
+def archived_ledger_rows(start=None, end=None, session=None):
+    """ Every archived transfer in a period oldest first, as ledger_rows dicts.
+    Segments are read one at a time and each is sorted in memory. """
+    session = session or db.session
+    segments = session.query(ArchiveSegment.id, ArchiveSegment.path).filter(ArchiveSegment.kind == "transaction")
+    if start:
+        segments = segments.filter(ArchiveSegment.last_at >= start)
+    if end:
+        segments = segments.filter(ArchiveSegment.first_at < end)
+
+    emails = {}
+    for segment_id, path in segments.order_by(ArchiveSegment.id).all():
+        rows = []
+        for transaction_id, timestamp, sender_id, recipient_id, amount, fee in _segment_transfers(segment_id, path, session):
+            timestamp = datetime.fromisoformat(timestamp)
+            if (start is None or timestamp >= start) and (end is None or timestamp < end):
+                rows.append((timestamp, transaction_id, sender_id, recipient_id, amount, fee))
+        rows.sort()
+        _emails((user_id for row in rows for user_id in row[2:4]), emails, session)
+        for timestamp, transaction_id, sender_id, recipient_id, amount, fee in rows:
+            yield {"id": transaction_id, "timestamp": timestamp.isoformat(), "sender": emails.get(sender_id),
+                   "recipient": emails.get(recipient_id), "amount": amount, "fee": fee}
+
+def archived_contact_pairs(session=None):
+    """ (sender_id, recipient_id, last transfer time, transfers) for archived transfers between two users """
+    session = session or db.session
+    pairs = {}
+    for segment_id, path in session.query(ArchiveSegment.id, ArchiveSegment.path).filter(ArchiveSegment.kind == "transaction").all():
+        for _, timestamp, sender_id, recipient_id, _, _ in _segment_transfers(segment_id, path, session):
+            if sender_id == recipient_id:
+                continue
+            timestamp = datetime.fromisoformat(timestamp)
+            last_at, count = pairs.get((sender_id, recipient_id), (timestamp, 0))
+            pairs[sender_id, recipient_id] = (max(last_at, timestamp), count + 1)
+    return [(sender_id, recipient_id, last_at, count) for (sender_id, recipient_id), (last_at, count) in pairs.items()]
+
+def archived_blocks(user_id, session=None):
+    """ (index, data, previous_hash, amount_cents) of a user's archived chain prefix in index order, for full verification """
+    for rows in _frames("block", user_id, session or db.session):
+        for index, _, data, previous_hash, amount_cents in rows:
+            yield index, data, previous_hash, amount_cents
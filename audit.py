@@ -0,0 +1,110 @@
+import hashlib
+import hmac
+import multiprocessing
+from functools import partial
+from itertools import chain
+from flask import current_app
+from archive import archived_blocks
+from database import dispose_engines
+from models import db, Block, ChainCheckpoint, link_hash, data_cents
+
+BATCH_SIZE = 1000  # Blocks fetched per round trip while re-hashing a chain
+
+_worker_app = None
+
+def sign_checkpoint(user_id, index, block_hash):
+    """ HMAC over a checkpoint so a tampered row forces a full re-verification """
+    message = f"{user_id}:{index}:{block_hash}".encode()
+    return hmac.new(current_app.config["SECRET_KEY"].encode(), message, hashlib.sha256).hexdigest()
+
+def resume_point(user_id, full=False):
+    """ Returns (index, hash) to continue verification from, (None, "0") for the start of the chain """
+    checkpoint = db.session.get(ChainCheckpoint, user_id)
+    if full or checkpoint is None:
+        return None, "0"
+
+    expected = sign_checkpoint(user_id, checkpoint.last_index, checkpoint.last_hash)
+    if not hmac.compare_digest(checkpoint.signature, expected):
+        print(f"⚠️ Bad checkpoint signature for user {user_id}, re-verifying full chain")
+        return None, "0"
+
+    # The chain may have been truncated or compacted since the checkpoint was taken
+    anchor = Block.query.filter_by(user_id=user_id, index=checkpoint.last_index).first()
+    if anchor is None or anchor.compute_hash() != checkpoint.last_hash:
+        return None, "0"
+
+    return checkpoint.last_index, checkpoint.last_hash
+
+def check_chain(user_id, full=False):
+    """ Re-hashes a user's blocks added since the last checkpoint without writing anything.
+    A block whose amount disagrees with its hashed data fails like a broken link. """
+    prev_index, prev_hash = resume_point(user_id, full)
+    result = {"user_id": user_id, "ok": True, "checked": 0, "bad_index": None,
+              "last_index": prev_index, "last_hash": prev_hash}
+
+    query = db.session.query(Block.index, Block.data, Block.previous_hash, Block.amount_cents).filter(Block.user_id == user_id)
+    if prev_index is not None:
+        query = query.filter(Block.index > prev_index)
+
+    blocks = query.order_by(Block.index).yield_per(BATCH_SIZE)
+    if prev_index is None:
+        blocks = chain(archived_blocks(user_id), blocks)  # A full pass starts from the archived prefix
+
+    for index, data, stored_hash, amount_cents in blocks:
+        linked = prev_index is None or index == prev_index + 1
+        if not linked or stored_hash != link_hash(index, data, prev_hash) or amount_cents != data_cents(data):
+            result["ok"] = False
+            result["bad_index"] = index
+            break
+        prev_index, prev_hash = index, link_hash(index, data, stored_hash)
+        result["checked"] += 1
+        result["last_index"], result["last_hash"] = prev_index, prev_hash
+
+    return result
+
+def save_checkpoints(results):
+    """ Records a signed checkpoint for every chain that verified cleanly """
+    for result in results:
+        if not result["ok"] or not result["checked"]:
+            continue
+        checkpoint = db.session.get(ChainCheckpoint, result["user_id"]) or ChainCheckpoint(user_id=result["user_id"])
+        checkpoint.last_index = result["last_index"]
+        checkpoint.last_hash = result["last_hash"]
+        checkpoint.signature = sign_checkpoint(result["user_id"], result["last_index"], result["last_hash"])
+        db.session.add(checkpoint)
+    db.session.commit()
+
+def verify_chain(user_id, full=False):
+    """ Verifies one user's chain and advances its checkpoint """
+    result = check_chain(user_id, full)
+    save_checkpoints([result])
+    return result
+
+def _init_worker(app):
+    global _worker_app
+    _worker_app = app
+    with app.app_context():
+        dispose_engines()  # Never share the parent's pooled connections
+
+def _check_in_worker(user_id, full):
+    with _worker_app.app_context():
+        return check_chain(user_id, full)
+
+def verify_all(user_ids=None, workers=None, full=False):
+    """ Verifies many chains, spreading users over worker processes.
+    Workers only read; checkpoints are written once by the calling process. """
+    if user_ids is None:
+        user_ids = [row[0] for row in db.session.query(Block.user_id).distinct()]
+    workers = workers or multiprocessing.cpu_count()
+
+    if workers == 1 or len(user_ids) < 2:
+        results = [check_chain(user_id, full) for user_id in user_ids]
+    else:
+        app = current_app._get_current_object()
+        db.session.close()
+        chunksize = max(1, len(user_ids) // (workers * 4))
+        with multiprocessing.get_context("fork").Pool(workers, initializer=_init_worker, initargs=(app,)) as pool:
+            results = list(pool.imap_unordered(partial(_check_in_worker, full=full), user_ids, chunksize=chunksize))
+
+    save_checkpoints(results)
+    return results
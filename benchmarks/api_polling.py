@@ -0,0 +1,71 @@
+""" What a polling client costs: server-rendered pages against /api/v1 with and without a cached ETag.
+
+Seeds the same data as suite.py, then for each target reports p50/p99 latency, bytes sent and SQL
+queries for a full response and for a revalidation that comes back 304.
+
+    python benchmarks/api_polling.py --users 1000 --transactions 100000 --polls 300
+"""
+import argparse
+import contextlib
+import os
+import random
+import tempfile
+import time
+
+from suite import _local, count_query, percentile, seed
+
+TARGETS = ["/", "/user", "/api/v1/balance", "/api/v1/transactions", "/api/v1/requests", "/api/v1/bank_accounts", "/api/v1/fees"]
+
+def poll(client, path, polls, etag=None):
+    """ (latency_ms, bytes, queries, status) per request, sending If-None-Match when etag is given """
+    headers = {"Accept-Encoding": "gzip"}
+    if etag:
+        headers["If-None-Match"] = etag
+    rows = []
+    for _ in range(polls):
+        started = time.perf_counter()
+        response = client.get(path, headers=headers)
+        rows.append(((time.perf_counter() - started) * 1000, len(response.data), int(response.headers["X-Query-Count"]), response.status_code))
+    return rows
+
+def report(name, rows):
+    latencies = [row[0] for row in rows]
+    print(f"{name:<38} {rows[0][3]:>4}  p50 {percentile(latencies, 50):7.2f}ms  p99 {percentile(latencies, 99):7.2f}ms  "
+          f"{sum(row[1] for row in rows) / len(rows):8.0f} B  {sum(row[2] for row in rows) / len(rows):4.1f} queries")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--transactions", type=int, default=100000)
+    parser.add_argument("--polls", type=int, default=300, help="Requests per target and mode")
+    args = parser.parse_args()
+
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    os.environ.pop("DATABASE_READ_URL", None)
+    from sqlalchemy import event
+    with contextlib.redirect_stdout(open(os.devnull, "w")):
+        from main import app
+    from models import db
+
+    @app.before_request
+    def reset_query_count():
+        _local.queries = 0
+
+    @app.after_request
+    def report_query_count(response):
+        response.headers["X-Query-Count"] = str(getattr(_local, "queries", 0))
+        return response
+
+    with app.app_context():
+        for engine in db.engines.values():
+            event.listen(engine, "before_cursor_execute", count_query)
+    user_ids, _ = seed(app, args.users, args.transactions, 1, args.users)
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["user_id"] = random.Random(1).choice(user_ids)
+    for path in TARGETS:
+        report(path, poll(client, path, args.polls))
+        etag = client.get(path, headers={"Accept-Encoding": "gzip"}).headers.get("ETag")
+        if etag:
+            report(f"{path} (If-None-Match)", poll(client, path, args.polls, etag))
@@ -0,0 +1,131 @@
+""" Hot-table size and query latency before and after archiving old transfers and blocks.
+
+Seeds three years of transfers and per-dollar block chains, measures table sizes (SQLite dbstat)
+and query latency, runs archive_before() with a one-year cutoff plus VACUUM, and measures again.
+History pages past the cutoff read through to the archive, so they are timed as well.
+
+    python benchmarks/archive_latency.py --users 2000 --transactions 500000 --blocks-per-user 200
+"""
+import argparse
+import io
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from flask import Flask  # noqa: E402
+from database import init_db, vacuum  # noqa: E402
+from models import db, User, Transaction, Block, ChainCheckpoint, encode_cursor, transaction_page, upgrade_schema  # noqa: E402
+from statements import export  # noqa: E402
+from reconcile import reconcile  # noqa: E402
+from archive import archive_before, archive_dir  # noqa: E402
+
+DAYS = 3 * 365
+TABLES = ("transaction", "block")
+
+def make_app(path):
+    app = Flask(__name__)
+    app.config.from_object("config")
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{path}"
+    app.config["ARCHIVE_DIR"] = os.path.join(os.path.dirname(path), "archive")
+    init_db(app)
+    return app
+
+def seed(users, transactions, blocks_per_user):
+    rng = random.Random(1)
+    now = datetime.utcnow()
+    db.session.execute(db.insert(User), [
+        {"username": f"user{i}", "email": f"user{i}@example.com", "password": "x", "country": "Qatar"} for i in range(users)
+    ])
+    for start in range(0, transactions, 50000):
+        db.session.execute(db.insert(Transaction), [{
+            "sender_id": rng.randint(1, users), "recipient_id": rng.randint(1, users), "amount": rng.randint(1, 300),
+            "fee": 0.0, "timestamp": now - timedelta(seconds=rng.randint(0, DAYS * 86400))
+        } for _ in range(min(50000, transactions - start))])
+
+    # One "Added 1 USD" block per dollar spread over the same three years; hashes are not linked here,
+    # the checkpoint only marks how much of each chain archiving may take
+    rows = []
+    for user_id in range(1, users + 1):
+        for index in range(blocks_per_user):
+            at = now - timedelta(days=DAYS * (1 - index / blocks_per_user))
+            rows.append({"user_id": user_id, "index": index, "data": "Added 1 USD", "previous_hash": f"{index:064x}", "amount_cents": 100, "timestamp": at})
+        if len(rows) >= 50000:
+            db.session.execute(db.insert(Block), rows)
+            rows = []
+    if rows:
+        db.session.execute(db.insert(Block), rows)
+    db.session.execute(db.insert(ChainCheckpoint), [
+        {"user_id": user_id, "last_index": blocks_per_user - 1, "last_hash": "x", "signature": "x"} for user_id in range(1, users + 1)
+    ])
+    db.session.commit()
+
+def table_sizes():
+    """ Bytes per table including its indexes, from SQLite's dbstat """
+    sizes = {}
+    for table in TABLES:
+        names = [table] + [index.name for index in db.metadata.tables[table].indexes]
+        sizes[table] = db.session.execute(
+            db.text(f"SELECT SUM(pgsize) FROM dbstat WHERE name IN ({', '.join(repr(name) for name in names)})")
+        ).scalar()
+    return sizes
+
+def timed(function, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+def measure(users, repeat):
+    rng = random.Random(2)
+    now = datetime.utcnow()
+    old_cursor = encode_cursor(now - timedelta(days=2 * 365), 10 ** 9)
+    results = {
+        "history first page": timed(lambda: transaction_page(rng.randint(1, users)), repeat),
+        "history page 2y back": timed(lambda: transaction_page(rng.randint(1, users), old_cursor), repeat),
+        "statement last 30 days": timed(lambda: b"".join(export(rng.randint(1, users), now - timedelta(days=30))), repeat),
+        "statement 3 years": timed(lambda: b"".join(export(rng.randint(1, users))), max(1, repeat // 10)),
+        "reconcile --full": timed(lambda: reconcile(io.StringIO(), full=True), 1),
+    }
+    db.session.remove()
+    return results
+
+def report(label, sizes, results, file_bytes):
+    print(f"{label}: database file {file_bytes / 1e6:.1f} MB, " + ", ".join(f"{table} {size / 1e6:.1f} MB" for table, size in sizes.items()))
+    for name, ms in results.items():
+        print(f"    {name:<24} {ms:9.2f} ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--transactions", type=int, default=500000)
+    parser.add_argument("--blocks-per-user", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "archive.db")
+    app = make_app(path)
+    with app.app_context():
+        db.create_all()
+        upgrade_schema()
+        seed(args.users, args.transactions, args.blocks_per_user)
+        vacuum()
+
+        report("before", table_sizes(), measure(args.users, args.repeat), os.path.getsize(path))
+
+        started = time.perf_counter()
+        segments = archive_before(datetime.utcnow() - timedelta(days=365))
+        vacuum()
+        print(f"archived in {time.perf_counter() - started:.1f}s: " + ", ".join(
+            f"{segment.rows} {segment.kind} rows into {segment.bytes / 1e6:.1f} MB" for segment in segments))
+        print(f"archive directory {sum(entry.stat().st_size for entry in os.scandir(archive_dir())) / 1e6:.1f} MB")
+
+        report("after", table_sizes(), measure(args.users, args.repeat), os.path.getsize(path))
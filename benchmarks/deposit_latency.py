@@ -0,0 +1,74 @@
+""" /add_money latency with the Stripe call on the request path versus queued in the outbox.
+
+    python benchmarks/deposit_latency.py --requests 50 --stripe-delay 0.3
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from flask import Flask  # noqa: E402
+import deposits  # noqa: E402
+import stripe_mock  # noqa: E402
+from models import db, User, Deposit, upgrade_schema  # noqa: E402
+from routes import app as app_routes  # noqa: E402
+
+def make_app(api_base, inline):
+    app = Flask("main", root_path=ROOT)
+    app.config.from_object("config")
+    app.config.update(
+        SQLALCHEMY_DATABASE_URI=f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'deposits.db')}",
+        SECRET_KEY="bench", STRIPE_API_BASE=api_base, STRIPE_CHECKOUT_INLINE=inline
+    )
+    db.init_app(app)
+    app.register_blueprint(app_routes)
+    with app.app_context():
+        db.create_all()
+        upgrade_schema()
+        db.session.add(User(username="bench", email="bench@example.com", password="x", country="Qatar"))
+        db.session.commit()
+    return app
+
+def measure(app, requests):
+    client = app.test_client()
+    with client.session_transaction() as flask_session:
+        flask_session["user_id"] = 1
+    latencies = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        response = client.post("/add_money", data={"amount": "25"})
+        latencies.append((time.perf_counter() - started) * 1000)
+        assert response.status_code == 303, response.status_code
+    latencies.sort()
+    return statistics.median(latencies), latencies[int(len(latencies) * 0.95) - 1]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--stripe-delay", type=float, default=0.3, help="Simulated Stripe latency in seconds")
+    args = parser.parse_args()
+
+    server, api_base = stripe_mock.start(delay=args.stripe_delay)
+    print(f"{'mode':>8} {'p50 ms':>8} {'p95 ms':>8}")
+    for inline in (True, False):
+        deposits._client = None
+        app = make_app(api_base, inline)
+        p50, p95 = measure(app, args.requests)
+        print(f"{'inline' if inline else 'outbox':>8} {p50:>8.1f} {p95:>8.1f}")
+
+    # Drain the outbox to show the sessions still get created, just off the request path
+    started = time.perf_counter()
+    with ThreadPoolExecutor(app.config["OUTBOX_WORKER_THREADS"]) as executor:
+        while deposits.process_outbox(app, executor):
+            pass
+    with app.app_context():
+        opened = Deposit.query.filter_by(status="open").count()
+    print(f"outbox worker opened {opened} sessions in {time.perf_counter() - started:.2f}s")
+    server.shutdown()
@@ -0,0 +1,87 @@
+""" Ledger reconciliation: chunked GROUP BY queries against one query per user, and incremental runs.
+
+Seeds users with a few blocks each, then times a full reconcile(), the same comparison done with
+chain_total() per user, and an incremental run after a small share of users were touched.
+
+    python benchmarks/reconcile_throughput.py --users 100000 --blocks-per-user 5 --touched 0.01
+"""
+import argparse
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from flask import Flask  # noqa: E402
+from database import init_db  # noqa: E402
+from models import db, User, Block, chain_total, upgrade_schema, usd_text  # noqa: E402
+import reconcile  # noqa: E402
+
+def make_app(path):
+    app = Flask(__name__)
+    app.config.from_object("config")
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{path}"
+    init_db(app)
+    return app
+
+def seed(users, blocks_per_user):
+    rng = random.Random(1)
+    balances = {user_id: 0 for user_id in range(1, users + 1)}
+    rows = []
+    for user_id in balances:
+        for index in range(1, blocks_per_user + 1):
+            cents = rng.randint(1, 20000)
+            balances[user_id] += cents
+            rows.append({"index": index, "data": f"Added {usd_text(cents)} USD", "previous_hash": "0", "user_id": user_id, "amount_cents": cents})
+    db.session.execute(db.insert(User), [{
+        "id": user_id, "username": f"user{user_id}", "email": f"user{user_id}@example.com", "password": "x",
+        "country": "Qatar", "balance_cents": total + (37 if rng.random() < 0.001 else 0)
+    } for user_id, total in balances.items()])
+    for start in range(0, len(rows), 50000):
+        db.session.execute(db.insert(Block), rows[start:start + 50000])
+    db.session.commit()
+
+def per_user():
+    """ The loop reconciliation replaces: one balance read and one SUM per user """
+    mismatched = 0
+    for user_id, balance_cents in db.session.query(User.id, User.balance_cents).all():
+        mismatched += balance_cents != chain_total(user_id)
+    return mismatched
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--blocks-per-user", type=int, default=5)
+    parser.add_argument("--touched", type=float, default=0.01, help="Share of users changed before the incremental run")
+    args = parser.parse_args()
+
+    app = make_app(os.path.join(tempfile.mkdtemp(), "reconcile.db"))
+    reconcile.WATERMARK_OVERLAP = reconcile.timedelta(0)  # Everything here was just written
+    with app.app_context():
+        db.create_all()
+        upgrade_schema()
+        seed(args.users, args.blocks_per_user)
+
+        started = time.perf_counter()
+        run = reconcile.reconcile(io.StringIO(), full=True)
+        full_seconds = time.perf_counter() - started
+        print(f"reconcile --full    {full_seconds:8.2f}s  {run.users_checked / full_seconds:10.0f} users/s  {run.discrepancies} discrepancies")
+
+        started = time.perf_counter()
+        mismatched = per_user()
+        loop_seconds = time.perf_counter() - started
+        print(f"per-user queries    {loop_seconds:8.2f}s  {args.users / loop_seconds:10.0f} users/s  {mismatched} discrepancies")
+
+        time.sleep(0.01)  # Touched rows must be stamped after the full run started
+        touched = random.Random(2).sample(range(1, args.users + 1), int(args.users * args.touched))
+        db.session.execute(db.update(User).where(User.id.in_(touched)).values(balance_cents=User.balance_cents + 100))
+        db.session.commit()
+
+        started = time.perf_counter()
+        run = reconcile.reconcile(io.StringIO())
+        seconds = time.perf_counter() - started
+        print(f"reconcile (incr.)   {seconds:8.2f}s  {run.users_checked} users touched, {run.discrepancies} discrepancies")
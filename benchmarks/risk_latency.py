@@ -0,0 +1,109 @@
+""" Latency the risk engine adds to each transfer, compared with checking limits by querying history.
+
+Seeds a day of transfers, rebuilds the counters from it the way startup does, then times
+check_transfer + record_transfer per transfer against the same limits computed with SQL aggregates.
+
+    python benchmarks/risk_latency.py --users 20000 --transfers 200000 --checks 20000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from flask import Flask  # noqa: E402
+from database import init_db  # noqa: E402
+from models import db, User, Transaction, upgrade_schema  # noqa: E402
+from risk import WINDOWS, risk_engine  # noqa: E402
+
+COUNTRIES = ["Qatar", "Philippines", "Saudi Arabia", "United Arab Emirates", "Bangladesh", "Sri Lanka"]
+
+def make_app(path):
+    app = Flask(__name__)
+    app.config.from_object("config")
+    app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{path}"
+    init_db(app)
+    return app
+
+def seed(app, users, transfers):
+    rng = random.Random(1)
+    now = datetime.utcnow()
+    with app.app_context():
+        db.create_all()
+        upgrade_schema()
+        db.session.execute(db.insert(User), [
+            {"username": f"user{i}", "email": f"user{i}@example.com", "password": "x", "country": rng.choice(COUNTRIES)}
+            for i in range(users)
+        ])
+        for start in range(0, transfers, 50000):
+            db.session.execute(db.insert(Transaction), [{
+                "sender_id": rng.randint(1, users), "recipient_id": rng.randint(1, users),
+                "amount": rng.randint(1, 300), "fee": 0.0, "timestamp": now - timedelta(seconds=rng.randint(0, 86400))
+            } for _ in range(min(50000, transfers - start))])
+        db.session.commit()
+
+def report(name, samples_us):
+    samples_us.sort()
+    print(f"{name:<28} p50 {statistics.median(samples_us):>9.1f}us  p99 {samples_us[int(len(samples_us) * 0.99)]:>9.1f}us")
+
+def sql_limits(user_id, recipient_id, now):
+    """ The same sender and recipient windows as the rules, answered by aggregates over Transaction """
+    results = []
+    for name, (size, width) in WINDOWS.items():
+        since = now - timedelta(seconds=size * width)
+        results.append(db.session.query(db.func.count(), db.func.sum(Transaction.amount))
+                       .filter(Transaction.sender_id == user_id, Transaction.timestamp >= since).one())
+        results.append(db.session.query(db.func.count())
+                       .filter(Transaction.recipient_id == recipient_id, Transaction.timestamp >= since).scalar())
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--transfers", type=int, default=200000, help="Transfers in the last 24h")
+    parser.add_argument("--checks", type=int, default=20000)
+    args = parser.parse_args()
+
+    app = make_app(os.path.join(tempfile.mkdtemp(), "risk.db"))
+    seed(app, args.users, args.transfers)
+    rng = random.Random(2)
+
+    with app.app_context():
+        engine = risk_engine()
+        started = time.perf_counter()
+        replayed = engine.rebuild()
+        seconds = time.perf_counter() - started
+        tracemalloc.start()  # A second pass for memory, tracing slows the replay down several times
+        engine.rebuild()
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print(f"rebuild: {replayed} events in {seconds:.2f}s, "
+              f"{len(engine.counters)} counter keys, {memory / 1e6:.1f} MB")
+
+        countries = dict(db.session.query(User.id, User.country))
+        engine_us, sql_us, blocked = [], [], 0
+        for _ in range(args.checks):
+            sender_id, recipient_id = rng.randint(1, args.users), rng.randint(1, args.users)
+            corridor, cents = (countries[sender_id], countries[recipient_id]), rng.randint(100, 30000)
+            began = time.perf_counter()
+            risk = engine.check_transfer(sender_id, recipient_id, corridor, cents)
+            if risk.action != "block":
+                engine.record_transfer(sender_id, recipient_id, corridor, cents)
+            engine_us.append((time.perf_counter() - began) * 1e6)
+            blocked += risk.action == "block"
+
+        for _ in range(min(args.checks, 2000)):
+            began = time.perf_counter()
+            sql_limits(rng.randint(1, args.users), rng.randint(1, args.users), datetime.utcnow())
+            sql_us.append((time.perf_counter() - began) * 1e6)
+
+    report("risk engine check+record", engine_us)
+    report("SQL history aggregates", sql_us)
+    print(f"{blocked} of {args.checks} synthetic transfers blocked by the default rules")
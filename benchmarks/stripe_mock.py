@@ -0,0 +1,54 @@
+""" Tiny stand-in for the Stripe API, enough for checkout sessions.
+
+Point STRIPE_API_BASE at it, or at a real stripe-mock (https://github.com/stripe/stripe-mock),
+to exercise deposits without network access. --delay simulates a slow Stripe round trip.
+
+    python benchmarks/stripe_mock.py --port 12111 --delay 0.3
+"""
+import argparse
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class StripeMockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, so pooled clients can reuse connections
+    delay = 0.0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path != "/v1/checkout/sessions":
+            return self.respond(404, {"error": {"type": "invalid_request_error", "message": "Unrecognized request URL"}})
+        time.sleep(self.delay)
+        session_id = f"cs_test_{uuid.uuid4().hex}"
+        self.respond(200, {"id": session_id, "object": "checkout.session", "payment_status": "unpaid",
+                           "url": f"https://checkout.stripe.com/c/pay/{session_id}"})
+
+    def respond(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Request-Id", f"req_{uuid.uuid4().hex[:14]}")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+def start(port=0, delay=0.0):
+    """ Serves in a daemon thread; returns (server, base_url) """
+    handler = type("Handler", (StripeMockHandler,), {"delay": delay})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=12111)
+    parser.add_argument("--delay", type=float, default=0.0)
+    args = parser.parse_args()
+    server, url = start(args.port, args.delay)
+    print(f"Stripe mock on {url}")
+    threading.Event().wait()
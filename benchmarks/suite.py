@@ -0,0 +1,327 @@
+""" Load test and microbenchmarks for the payment routes.
+
+Seeds a throwaway SQLite database, times add_block/remove_block directly, then drives the real
+main.app with concurrent synthetic traffic, first through the Flask test client and then through
+a pre-forked multi-worker HTTP server. Reports p50/p95/p99 latency, requests/s and SQL queries
+per request for each route, and writes everything to a JSON file for comparison across commits.
+
+    python benchmarks/suite.py --users 1000 --transactions 100000 --blocks 20 --out bench.json
+    python benchmarks/suite.py --compare bench.json   # Prints p95 changes against an earlier run
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PASSWORD = "bench"
+OPENING_USD = 1_000_000
+ROUTES = {  # Share of the synthetic traffic
+    "home": 30,
+    "payments": 15,
+    "history": 10,
+    "send_money": 25,
+    "request_money": 10,
+    "accept_request": 10,
+}
+
+_local = threading.local()
+
+def count_query(*args):
+    _local.queries = getattr(_local, "queries", 0) + 1
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+def summarize(samples, elapsed):
+    """ samples maps route to [(latency_ms, queries)], returns the per-route report """
+    report = {}
+    for route, rows in sorted(samples.items()):
+        latencies = [latency for latency, _ in rows]
+        queries = [count for _, count in rows if count is not None]
+        report[route] = {
+            "requests": len(rows),
+            "requests_per_second": round(len(rows) / elapsed, 1) if elapsed else None,
+            "p50_ms": round(percentile(latencies, 50), 2),
+            "p95_ms": round(percentile(latencies, 95), 2),
+            "p99_ms": round(percentile(latencies, 99), 2),
+            "queries_per_request": round(sum(queries) / len(queries), 1) if queries else None,
+        }
+    return report
+
+def seed(app, users, transactions, blocks, money_requests):
+    """ Bulk-loads users, ledger blocks, transaction history, contacts and pending requests """
+    from models import db, User, Transaction, MoneyRequest, add_blocks, rebuild_contacts
+    rng = random.Random(42)
+    with app.app_context():
+        db.session.execute(db.insert(User), [
+            {"username": f"user{i}", "email": f"user{i}@example.com", "password": PASSWORD,
+             "country": "Qatar", "balance_cents": OPENING_USD * 100}
+            for i in range(users)
+        ])
+        user_ids = [row[0] for row in db.session.query(User.id).order_by(User.id)]
+
+        # First block carries most of the balance, the rest are 1 USD so chains reach the requested length
+        for round_number in range(max(blocks, 1)):
+            amount = OPENING_USD - (blocks - 1) if round_number == 0 else 1
+            add_blocks({user_id: amount * 100 for user_id in user_ids})
+            db.session.commit()
+
+        now = datetime.utcnow()
+        for start in range(0, transactions, 10000):
+            rows = []
+            for _ in range(min(10000, transactions - start)):
+                sender_id, recipient_id = rng.sample(user_ids, 2)
+                rows.append({"sender_id": sender_id, "recipient_id": recipient_id, "amount": rng.randint(1, 500),
+                             "fee": 0.0, "timestamp": now - timedelta(seconds=rng.randint(0, 365 * 86400))})
+            db.session.execute(db.insert(Transaction), rows)
+            db.session.commit()
+        rebuild_contacts()
+
+        db.session.execute(db.insert(MoneyRequest), [
+            {"sender_email": f"user{payer - user_ids[0]}@example.com", "recipient_id": requester,
+             "amount": rng.randint(1, 50), "status": "Pending"}
+            for payer, requester in (rng.sample(user_ids, 2) for _ in range(money_requests))
+        ])
+        db.session.commit()
+
+        pending = {}
+        for request_id, email in db.session.query(MoneyRequest.id, MoneyRequest.sender_email):
+            pending.setdefault(email, []).append(request_id)
+        return user_ids, pending
+
+def microbenchmarks(app, user_ids, iterations):
+    """ Direct add_block/remove_block calls, each committing like the routes do """
+    from models import add_block, remove_block
+    samples = {"add_block": [], "remove_block": []}
+    rng = random.Random(7)
+    started = time.perf_counter()
+    with app.app_context():
+        for _ in range(iterations):
+            user_id = rng.choice(user_ids)
+            for name, function in (("add_block", add_block), ("remove_block", remove_block)):
+                _local.queries = 0
+                began = time.perf_counter()
+                function(user_id, 500)
+                samples[name].append(((time.perf_counter() - began) * 1000, _local.queries))
+    return summarize(samples, time.perf_counter() - started)
+
+class Client:
+    """ One simulated user, over the test client or HTTP. Returns (status, queries) per request. """
+
+    def __init__(self, app, base_url, email):
+        self.base_url = base_url
+        if base_url:
+            import requests
+            self.http = requests.Session()
+        else:
+            self.http = app.test_client()
+        self.post("/login", {"email": email, "password": PASSWORD})
+
+    def get(self, path):
+        return self.send("GET", path)
+
+    def post(self, path, data):
+        return self.send("POST", path, data)
+
+    def send(self, method, path, data=None):
+        if self.base_url:
+            response = self.http.request(method, self.base_url + path, data=data, allow_redirects=False)
+            return response.status_code, response.headers.get("X-Query-Count")
+        response = self.http.open(path, method=method, data=data)
+        return response.status_code, response.headers.get("X-Query-Count")
+
+def traffic(app, base_url, user_ids, pending, requests_per_client, seed_value, samples, lock):
+    """ Sends a weighted random mix of route calls as one logged-in user """
+    rng = random.Random(seed_value)
+    index = rng.randrange(len(user_ids))
+    email = f"user{index}@example.com"
+    client = Client(app, base_url, email)
+    routes, weights = list(ROUTES), list(ROUTES.values())
+    mine = pending.get(email, [])
+    results = []
+
+    for _ in range(requests_per_client):
+        route = rng.choices(routes, weights)[0]
+        if route == "accept_request":
+            try:
+                request_id = mine.pop()  # Clients that share a user share its pending requests
+            except IndexError:
+                route = "home"
+        other = f"user{rng.randrange(len(user_ids))}@example.com"
+        began = time.perf_counter()
+        if route == "home":
+            status, queries = client.get("/")
+        elif route == "payments":
+            status, queries = client.get("/payments")
+        elif route == "history":
+            status, queries = client.get("/history?format=json")
+        elif route == "send_money":
+            status, queries = client.post("/send_money", {"email": other, "amount": str(rng.randint(1, 20))})
+        elif route == "request_money":
+            status, queries = client.post("/request_money", {"email": other, "amount": str(rng.randint(1, 20))})
+        else:
+            status, queries = client.get(f"/accept_request/{request_id}")
+        latency = (time.perf_counter() - began) * 1000
+        if status >= 500:
+            route += " (error)"
+        results.append((route, latency, int(queries) if queries is not None else None))
+
+    with lock:
+        for route, latency, queries in results:
+            samples.setdefault(route, []).append((latency, queries))
+
+def drive(app, base_url, user_ids, pending, clients, requests_per_client):
+    samples, lock = {}, threading.Lock()
+    threads = [
+        threading.Thread(target=traffic, args=(app, base_url, user_ids, pending, requests_per_client, i, samples, lock))
+        for i in range(clients)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    total = sum(len(rows) for rows in samples.values())
+    return {"requests_per_second": round(total / elapsed, 1), "routes": summarize(samples, elapsed)}
+
+def serve(app, workers):
+    """ Pre-forks workers accepting on one shared socket, like gunicorn's sync workers """
+    from werkzeug.serving import make_server
+    from database import dispose_engines
+
+    listener = socket.socket()
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(128)
+    port = listener.getsockname()[1]
+
+    pids = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            logging.getLogger("werkzeug").setLevel(logging.ERROR)
+            with app.app_context():
+                dispose_engines()
+            make_server("127.0.0.1", port, app, threaded=True, fd=listener.fileno()).serve_forever()
+            os._exit(0)
+        pids.append(pid)
+    listener.close()
+    return f"http://127.0.0.1:{port}", pids
+
+def stop(pids):
+    for pid in pids:
+        os.kill(pid, signal.SIGTERM)
+    for pid in pids:
+        os.waitpid(pid, 0)
+
+def compare(previous, current):
+    """ Prints how each route's p95 moved since an earlier results file """
+    for mode in ("micro", "test_client", "server"):
+        before, after = previous.get(mode) or {}, current.get(mode) or {}
+        before, after = before.get("routes", before), after.get("routes", after)
+        for route in sorted(set(before) & set(after)):
+            old, new = before[route]["p95_ms"], after[route]["p95_ms"]
+            change = (new - old) / old * 100 if old else 0
+            print(f"{mode:>11} {route:<16} p95 {old:>8.2f} -> {new:>8.2f} ms ({change:+.0f}%)")
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--transactions", type=int, default=50000, help="Transaction history rows")
+    parser.add_argument("--blocks", type=int, default=10, help="Ledger blocks per user")
+    parser.add_argument("--money-requests", type=int, default=2000, help="Pending money requests")
+    parser.add_argument("--clients", type=int, default=8, help="Concurrent simulated users")
+    parser.add_argument("--requests", type=int, default=100, help="Requests per simulated user")
+    parser.add_argument("--micro", type=int, default=200, help="add_block/remove_block calls each")
+    parser.add_argument("--workers", type=int, default=4, help="Server worker processes, 0 skips the server run")
+    parser.add_argument("--out", default="bench-results.json")
+    parser.add_argument("--compare", help="Earlier results file to diff against")
+    args = parser.parse_args()
+
+    # main.py reads the database location from the environment when it is imported
+    workdir = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ.pop("DATABASE_READ_URL", None)
+    from sqlalchemy import event
+    from main import app
+    from models import db
+
+    app.config["STRIPE_CHECKOUT_INLINE"] = False
+
+    @app.before_request
+    def reset_query_count():
+        _local.queries = 0
+
+    @app.after_request
+    def report_query_count(response):
+        response.headers["X-Query-Count"] = str(getattr(_local, "queries", 0))
+        return response
+
+    with app.app_context():
+        for engine in db.engines.values():
+            event.listen(engine, "before_cursor_execute", count_query)
+
+    started = time.perf_counter()
+    user_ids, pending = seed(app, args.users, args.transactions, args.blocks, args.money_requests)
+    results = {
+        "commit": git_commit(),
+        "timestamp": datetime.utcnow().isoformat(timespec="seconds"),
+        "params": vars(args),
+        "seed_seconds": round(time.perf_counter() - started, 1),
+    }
+    print(f"Seeded {args.users} users, {args.transactions} transactions in {results['seed_seconds']}s")
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):  # Routes print their flash messages
+        results["micro"] = microbenchmarks(app, user_ids, args.micro)
+        results["test_client"] = drive(app, None, user_ids, pending, args.clients, args.requests)
+        if args.workers:
+            with app.app_context():
+                db.session.remove()
+                for engine in db.engines.values():
+                    engine.dispose()
+            base_url, pids = serve(app, args.workers)
+            try:
+                time.sleep(0.5)
+                results["server"] = drive(app, base_url, user_ids, pending, args.clients, args.requests)
+            finally:
+                stop(pids)
+
+    for mode in ("micro", "test_client", "server"):
+        if mode not in results:
+            continue
+        report = results[mode].get("routes", results[mode])
+        total = f", {results[mode]['requests_per_second']} req/s" if "requests_per_second" in results[mode] else ""
+        print(f"\n{mode}{total}")
+        print(f"  {'route':<24} {'count':>6} {'p50':>8} {'p95':>8} {'p99':>8} {'queries':>8}")
+        for route, row in report.items():
+            print(f"  {route:<24} {row['requests']:>6} {row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} "
+                  f"{row['p99_ms']:>8.2f} {row['queries_per_request'] if row['queries_per_request'] is not None else '-':>8}")
+
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {args.out}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
@@ -0,0 +1,92 @@
+""" Concurrency stress test for transfers.transfer.
+
+Several worker processes, like gunicorn workers, fire random transfers at a shared SQLite
+database. Afterwards every balance is checked against the committed Transaction rows:
+opening balance - (amount + fee) sent + amount received must match to the cent.
+
+    python benchmarks/transfer_stress.py --workers 4 --users 50 --seconds 10
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+from models import db, User, Transaction, upgrade_schema  # noqa: E402
+from transfers import TransferError, transfer  # noqa: E402
+
+OPENING_CENTS = 1_000_000
+
+def make_app(path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'connect_args': {'timeout': 30}}
+    app.config['LEDGER_MODE'] = 'segment'
+    db.init_app(app)
+    return app
+
+def seed(app, users):
+    with app.app_context():
+        db.create_all()
+        upgrade_schema()
+        db.session.bulk_insert_mappings(User, [
+            {'username': f'user{i}', 'email': f'user{i}@example.com', 'password': 'x',
+             'country': 'Qatar', 'balance_cents': OPENING_CENTS}
+            for i in range(users)
+        ])
+        db.session.commit()
+        return [user.id for user in User.query.all()]
+
+def worker(path, user_ids, seconds, seed_value):
+    app = make_app(path)
+    rng = random.Random(seed_value)
+    done = refused = 0
+    deadline = time.monotonic() + seconds
+    with app.app_context():
+        while time.monotonic() < deadline:
+            sender_id, recipient_id = rng.sample(user_ids, 2)
+            amount_cents = rng.randint(100, 50_000)
+            try:
+                transfer(sender_id, recipient_id, amount_cents, round(amount_cents * 0.005))
+                done += 1
+            except TransferError:
+                refused += 1
+    return done, refused
+
+def drift(app):
+    """ Users whose balance differs from opening balance plus their committed transfers """
+    with app.app_context():
+        expected = {user.id: OPENING_CENTS for user in User.query.all()}
+        for tx in Transaction.query.all():
+            expected[tx.sender_id] -= round(tx.amount * 100) + round(tx.fee * 100)
+            expected[tx.recipient_id] += round(tx.amount * 100)
+        return [(user.id, user.balance_cents, expected[user.id]) for user in User.query.all()
+                if user.balance_cents != expected[user.id] or user.balance_cents < 0]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), 'stress.db')
+    app = make_app(path)
+    user_ids = seed(app, args.users)
+
+    started = time.perf_counter()
+    with multiprocessing.get_context('spawn').Pool(args.workers) as pool:
+        results = pool.starmap(worker, [(path, user_ids, args.seconds, i) for i in range(args.workers)])
+    elapsed = time.perf_counter() - started
+
+    done = sum(result[0] for result in results)
+    refused = sum(result[1] for result in results)
+    drifted = drift(app)
+    print(f"{done} transfers committed, {refused} refused, {done / elapsed:.0f} transfers/s with {args.workers} workers")
+    print(f"balance drift: {len(drifted)} users" + ("" if not drifted else f" e.g. {drifted[:3]}"))
+    sys.exit(1 if drifted else 0)
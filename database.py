@@ -0,0 +1,90 @@
+from flask import g
+from sqlalchemy import event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
+from models import db
+
+READ_BIND = "reader"  # Bind key of the read-only engine behind read_session()
+
+def is_sqlite(uri):
+    return make_url(uri).get_backend_name() == "sqlite"
+
+def normalize_uri(uri):
+    """ Accepts the postgres:// scheme many hosts hand out, which SQLAlchemy no longer does """
+    if uri.startswith("postgres://"):
+        return "postgresql://" + uri[len("postgres://"):]
+    return uri
+
+def engine_options(config, uri, read_only=False):
+    """ Pool sizing from config plus per-dialect connection settings """
+    options = dict(config.get("SQLALCHEMY_ENGINE_OPTIONS", {}))
+    options["connect_args"] = dict(options.get("connect_args", {}))
+    url = make_url(uri)
+
+    if is_sqlite(uri):
+        if url.database in (None, "", ":memory:"):
+            return options  # Flask-SQLAlchemy pins in-memory databases to one connection
+    else:
+        options.setdefault("pool_pre_ping", True)
+        options.setdefault("pool_recycle", config["DB_POOL_RECYCLE"])
+        if read_only and url.get_backend_name() == "postgresql":
+            options["connect_args"].setdefault("options", "-c default_transaction_read_only=on")
+
+    options.setdefault("pool_size", config["DB_POOL_SIZE"])
+    options.setdefault("max_overflow", config["DB_MAX_OVERFLOW"])
+    options.setdefault("pool_timeout", config["DB_POOL_TIMEOUT"])
+    return options
+
+def sqlite_pragmas(pragmas, read_only=False):
+    """ Connect hook applying the configured pragmas to every new pooled connection """
+    statements = [f"PRAGMA {name}={value}" for name, value in pragmas.items()]
+    if read_only:
+        statements.append("PRAGMA query_only=ON")
+
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for statement in statements:
+            cursor.execute(statement)
+        cursor.close()
+    return on_connect
+
+def init_db(app):
+    """ Configures the primary and read-only engines from app.config, then binds db to the app """
+    config = app.config
+    uri = config["SQLALCHEMY_DATABASE_URI"] = normalize_uri(config["SQLALCHEMY_DATABASE_URI"])
+    read_uri = normalize_uri(config.get("SQLALCHEMY_READ_URI") or uri)
+
+    binds = dict(config.get("SQLALCHEMY_BINDS") or {})
+    binds[READ_BIND] = {"url": read_uri, **engine_options(config, read_uri, read_only=True)}
+    config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(config, uri)
+    config["SQLALCHEMY_BINDS"] = binds
+
+    db.init_app(app)
+    with app.app_context():
+        for bind_key, engine in db.engines.items():
+            if is_sqlite(str(engine.url)):
+                event.listen(engine, "connect", sqlite_pragmas(config["SQLITE_PRAGMAS"], read_only=bind_key == READ_BIND))
+
+    app.teardown_appcontext(close_read_session)
+
+def read_session():
+    """ Session on the read-only engine for pages that only display data, one per app context.
+    Nothing written through it is ever committed; with a replica it may trail the primary slightly. """
+    if "read_session" not in g:
+        g.read_session = Session(db.engines[READ_BIND], autoflush=False)
+    return g.read_session
+
+def close_read_session(exception=None):
+    reader = g.pop("read_session", None)
+    if reader is not None:
+        reader.close()
+
+def dispose_engines():
+    """ Drops inherited pooled connections, for processes forked after the engines were used """
+    for engine in db.engines.values():
+        engine.dispose(close=False)
+
+def vacuum():
+    """ Rewrites the primary database so space freed by large deletes goes back to the filesystem """
+    with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("VACUUM"))
@@ -0,0 +1,173 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import requests
+import stripe
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+from metrics import timer
+from models import db, Deposit, OutboxMessage, StripeEvent, add_block
+from transfers import credit
+
+CREATE_SESSION = "deposit.create_session"
+LEASE = timedelta(seconds=60)  # How long a claimed message is hidden from other workers
+MAX_ATTEMPTS = 5
+
+_client = None
+_client_lock = threading.Lock()
+
+def stripe_client():
+    """ One StripeClient per process whose requests.Session keeps connections to Stripe alive """
+    global _client
+    with _client_lock:
+        if _client is None:
+            config = current_app.config
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=config.get("STRIPE_POOL_SIZE", 10))
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+
+            options = {"http_client": stripe.RequestsClient(session=session, timeout=config.get("STRIPE_TIMEOUT", 20))}
+            if config.get("STRIPE_API_BASE"):
+                options["base_addresses"] = {"api": config["STRIPE_API_BASE"]}  # e.g. a local stripe-mock
+            _client = stripe.StripeClient(config["STRIPE_SECRET_KEY"], **options)
+        return _client
+
+def create_checkout_session(deposit, success_url, cancel_url):
+    """ Opens the Stripe Checkout session for a deposit, safe to retry thanks to the idempotency key """
+    with timer("stripe", histogram=True):
+        checkout = stripe_client().v1.checkout.sessions.create(
+            params={
+                "payment_method_types": ["card"],
+                "line_items": [{
+                    "price_data": {
+                        "currency": "usd",
+                        "product_data": {"name": "Wallet Deposit"},
+                        "unit_amount": deposit.amount_cents
+                    },
+                    "quantity": 1
+                }],
+                "mode": "payment",
+                "client_reference_id": str(deposit.id),
+                "metadata": {"deposit_id": str(deposit.id)},
+                "success_url": success_url,
+                "cancel_url": cancel_url
+            },
+            options={"idempotency_key": f"deposit-{deposit.id}"}
+        )
+    deposit.stripe_session_id = checkout.id
+    deposit.checkout_url = checkout.url
+    deposit.status = "open"
+
+def open_deposit(user_id, amount_cents):
+    """ Adds a pending Deposit to the caller's transaction and assigns its id """
+    deposit = Deposit(user_id=user_id, amount_cents=amount_cents)
+    db.session.add(deposit)
+    db.session.flush()
+    return deposit
+
+def enqueue_checkout(deposit, success_url, cancel_url):
+    """ Queues checkout session creation in the same transaction as the deposit itself """
+    db.session.add(OutboxMessage(topic=CREATE_SESSION, payload=json.dumps({
+        "deposit_id": deposit.id,
+        "success_url": success_url,
+        "cancel_url": cancel_url
+    })))
+
+def claim_messages(limit=50):
+    """ Leases up to limit due messages to this worker. A conditional UPDATE per message keeps
+    two workers from taking the same one. """
+    now = datetime.utcnow()
+    candidates = db.session.scalars(
+        db.select(OutboxMessage.id)
+        .where(OutboxMessage.processed_at.is_(None), OutboxMessage.available_at <= now)
+        .order_by(OutboxMessage.id).limit(limit)
+    ).all()
+    claimed = []
+    for message_id in candidates:
+        result = db.session.execute(
+            db.update(OutboxMessage)
+            .where(OutboxMessage.id == message_id, OutboxMessage.processed_at.is_(None), OutboxMessage.available_at <= now)
+            .values(available_at=now + LEASE, attempts=OutboxMessage.attempts + 1)
+        )
+        if result.rowcount == 1:
+            claimed.append(message_id)
+    db.session.commit()
+    return claimed
+
+def deliver(message_id):
+    """ Handles one claimed message; failures are retried with backoff until MAX_ATTEMPTS """
+    message = db.session.get(OutboxMessage, message_id)
+    payload = json.loads(message.payload)
+    deposit = db.session.get(Deposit, payload["deposit_id"])
+    try:
+        if message.topic == CREATE_SESSION and deposit.status == "pending":
+            create_checkout_session(deposit, payload["success_url"], payload["cancel_url"])
+        message.processed_at = datetime.utcnow()
+    except stripe.StripeError as e:
+        message.last_error = str(e)
+        if message.attempts >= MAX_ATTEMPTS:
+            message.processed_at = datetime.utcnow()
+            deposit.status = "failed"
+        else:
+            message.available_at = datetime.utcnow() + timedelta(seconds=2 ** message.attempts)
+    db.session.commit()
+
+def process_outbox(app, executor, limit=50):
+    """ Claims a batch and delivers it on the executor's threads. Returns how many were claimed. """
+    with app.app_context():
+        message_ids = claim_messages(limit)
+
+    def run(message_id):
+        with app.app_context():
+            deliver(message_id)
+
+    list(executor.map(run, message_ids))
+    return len(message_ids)
+
+def run_worker(app, poll_interval=1.0):
+    """ Delivers outbox messages until interrupted """
+    with ThreadPoolExecutor(app.config.get("OUTBOX_WORKER_THREADS", 4)) as executor:
+        while True:
+            if not process_outbox(app, executor):
+                time.sleep(poll_interval)
+
+def checkout_object(event):
+    """ The object a webhook event carries. Raises ValueError when the event is not shaped like one. """
+    try:
+        event_id, event_type, checkout = event["id"], event["type"], event["data"]["object"]
+    except (KeyError, TypeError):
+        raise ValueError("Malformed event")
+    if not isinstance(event_id, str) or not isinstance(event_type, str) or not isinstance(checkout, dict):
+        raise ValueError("Malformed event")
+    return checkout
+
+def handle_stripe_event(event):
+    """ Applies a webhook event exactly once. Returns False for an event id seen before.
+    Raises ValueError for a malformed event, before anything is recorded. """
+    checkout = checkout_object(event)
+    db.session.add(StripeEvent(id=event["id"], type=event["type"]))
+    try:
+        db.session.flush()
+    except IntegrityError:
+        db.session.rollback()
+        return False
+
+    deposit = Deposit.query.filter_by(stripe_session_id=checkout.get("id")).first()
+    # Completed sessions for delayed payment methods arrive "unpaid", so only an explicit "paid" credits
+    if deposit and event["type"] == "checkout.session.completed" and checkout.get("payment_status") == "paid":
+        paid = db.session.execute(
+            db.update(Deposit).where(Deposit.id == deposit.id, Deposit.status != "paid")
+            .values(status="paid", paid_at=datetime.utcnow())
+        )
+        if paid.rowcount == 1:
+            # The amount is the one we asked Stripe to charge, never anything from the client
+            credit(deposit.user_id, deposit.amount_cents)
+            add_block(deposit.user_id, deposit.amount_cents, commit=False)
+    elif deposit and event["type"] == "checkout.session.expired" and deposit.status != "paid":
+        deposit.status = "expired"
+
+    db.session.commit()
+    return True
@@ -1,24 +1,114 @@
+import click
+from datetime import datetime, timedelta
 from flask import Flask
 from flask_migrate import Migrate
 from routes import app as app_routes
-from models import db
+from api import api as api_routes
+from database import init_db, vacuum
+from metrics import init_metrics
+from models import db, compact_blocks, rebuild_contacts, upgrade_schema
+from audit import verify_all
+from reconcile import reconcile
+from archive import archive_before
+from deposits import run_worker
+from statements import statement_period, export
 import stripe
 
 app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///users.db'
 app.config['SECRET_KEY'] = 'secretkey'
 app.config.from_object('config')
 stripe.api_key = app.config["STRIPE_SECRET_KEY"]
 
-db.init_app(app)
+init_db(app)
+init_metrics(app)
 migrate = Migrate(app, db)
 
 # Register routes
 app.register_blueprint(app_routes)
+app.register_blueprint(api_routes)
 
 # Ensure tables are created
 with app.app_context():
     db.create_all()
+    upgrade_schema()
+
+@app.cli.command("compact-ledger")
+def compact_ledger():
+    """ Collapses per-dollar block chains into amount-carrying segments """
+    removed = compact_blocks()
+    print(f"✅ Ledger compacted, {removed} blocks removed")
+
+@app.cli.command("export-statement")
+@click.option("--user", "user_id", type=int, help="Only this user's transfers, with a running balance")
+@click.option("--month", help="Calendar month as YYYY-MM")
+@click.option("--start", help="ISO date or datetime, inclusive")
+@click.option("--end", help="ISO date or datetime, exclusive")
+@click.option("--format", "fmt", type=click.Choice(["csv", "jsonl"]), default="csv")
+@click.option("--gzip", "compress", is_flag=True, help="Compress the output while writing it")
+@click.option("--output", "-o", default="-", type=click.Path(dir_okay=False, allow_dash=True))
+def export_statement(user_id, month, start, end, fmt, compress, output):
+    """ Streams a statement for one user, or every transfer in a period, to a file or stdout """
+    start, end = statement_period(month, start, end)
+    written = 0
+    with click.open_file(output, "wb") as f:
+        for chunk in export(user_id, start, end, fmt, compress):
+            f.write(chunk)
+            written += len(chunk)
+    click.echo(f"✅ Statement written, {written} bytes", err=True)
+
+@app.cli.command("outbox-worker")
+@click.option("--poll-interval", type=float, default=1.0, help="Seconds to sleep when no messages are due")
+def outbox_worker(poll_interval):
+    """ Opens Stripe checkout sessions queued by /add_money """
+    print("✅ Outbox worker started")
+    run_worker(app, poll_interval)
+
+@app.cli.command("rebuild-contacts")
+def rebuild_contacts_command():
+    """ Recomputes recent contacts from the full transaction history """
+    print(f"✅ Rebuilt {rebuild_contacts()} contact rows")
+
+@app.cli.command("verify-chains")
+@click.option("--user", "user_id", type=int, help="Only verify this user's chain")
+@click.option("--workers", type=int, default=None, help="Worker processes (defaults to the CPU count)")
+@click.option("--full", is_flag=True, help="Ignore checkpoints and re-hash every block")
+def verify_chains(user_id, workers, full):
+    """ Checks Block hash links, resuming each chain from its last checkpoint """
+    results = verify_all([user_id] if user_id else None, workers=workers, full=full)
+    broken = [result for result in results if not result["ok"]]
+    checked = sum(result["checked"] for result in results)
+
+    for result in broken:
+        print(f"❌ User {result['user_id']}: chain broken at block {result['bad_index']}")
+    print(f"✅ Verified {len(results) - len(broken)}/{len(results)} chains, {checked} new blocks hashed")
+
+@app.cli.command("archive-ledger")
+@click.option("--before", help="ISO date; older transfers and verified blocks are archived (default ARCHIVE_AFTER_DAYS ago)")
+@click.option("--vacuum", "compact", is_flag=True, help="Rewrite the database afterwards so the file shrinks")
+def archive_ledger(before, compact):
+    """ Moves old transfers and blocks into compressed, read-only segment files """
+    cutoff = datetime.fromisoformat(before) if before else datetime.utcnow() - timedelta(days=app.config["ARCHIVE_AFTER_DAYS"])
+    try:
+        segments = archive_before(cutoff)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    for segment in segments:
+        print(f"✅ Archived {segment.rows} {segment.kind} rows to {segment.path} ({segment.bytes / 1e6:.1f} MB)")
+    if not segments:
+        print(f"✅ Nothing older than {cutoff:%Y-%m-%d} to archive")
+    if compact:
+        vacuum()
+
+@app.cli.command("reconcile-ledger")
+@click.option("--full", is_flag=True, help="Check every user, not only those touched since the last run")
+@click.option("--output", "-o", default="-", type=click.Path(dir_okay=False, allow_dash=True), help="Discrepancy report (CSV)")
+def reconcile_ledger(full, output):
+    """ Compares every touched user's balance with their block chain and reports the ones that disagree """
+    with click.open_file(output, "w") as f:
+        run = reconcile(f, full=full)
+    status = "⚠️" if run.discrepancies else "✅"
+    scope = f"since {run.since:%Y-%m-%d %H:%M}" if run.since else "full run"
+    click.echo(f"{status} Reconciled {run.users_checked} users ({scope}), {run.discrepancies} discrepancies", err=True)
 
 if __name__ == '__main__':
     app.run(host="127.0.0.1", port=5000, debug=True)
\ No newline at end of file
@@ -0,0 +1,198 @@
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from flask import Response, current_app, g, has_request_context, request, before_render_template, template_rendered
+from sqlalchemy import event
+
+# Counters and histograms live in this process only; with several workers scrape each one
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 250)
+PHASES = ("sql", "ledger_hash", "stripe", "template")  # Where a request's time can go
+MAX_LOGGED_QUERIES = 200  # Statements kept per request for the slow-request log
+
+HELP = {
+    "payo_requests_total": ("counter", "Requests handled, by route, method and status"),
+    "payo_request_duration_seconds": ("histogram", "Request latency by route"),
+    "payo_request_phase_seconds": ("histogram", "Time per request spent in SQL, ledger hashing, Stripe and templates"),
+    "payo_request_queries": ("histogram", "SQL statements executed per request"),
+    "payo_call_duration_seconds": ("histogram", "Latency of individual external calls"),
+    "payo_risk_decisions_total": ("counter", "Risk engine decisions on transfers and money requests, by action"),
+    "payo_phase_calls_total": ("counter", "Instrumented calls in every context, including CLI commands and workers"),
+    "payo_phase_seconds_total": ("counter", "Seconds spent in instrumented calls in every context"),
+}
+
+_lock = threading.Lock()
+_counters = {}  # (name, labels) -> value
+_histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+_buckets = {}  # name -> bucket bounds
+
+def inc(name, labels=(), value=1):
+    with _lock:
+        _counters[name, labels] = _counters.get((name, labels), 0) + value
+
+def observe(name, labels, value, buckets=LATENCY_BUCKETS):
+    with _lock:
+        _buckets.setdefault(name, buckets)
+        series = _histograms.get((name, labels))
+        if series is None:
+            series = _histograms[name, labels] = [0] * (len(buckets) + 2)
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+def record(phase, seconds, histogram=False, calls=1):
+    """ Adds instrumented calls to the process totals and to the current request, if any """
+    inc("payo_phase_calls_total", (("phase", phase),), calls)
+    inc("payo_phase_seconds_total", (("phase", phase),), seconds)
+    if histogram:
+        observe("payo_call_duration_seconds", (("phase", phase),), seconds)
+    if has_request_context() and "metrics" in g:
+        g.metrics["phases"][phase] = g.metrics["phases"].get(phase, 0) + seconds
+
+@contextmanager
+def timer(phase, histogram=False):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(phase, time.perf_counter() - started, histogram)
+
+def timed(phase, histogram=False, sample=1):
+    """ Decorator form of timer(). With sample=N only every Nth call is timed, and counted as N calls
+    taking N times as long, so hot functions skip the clock and the metrics lock on the other calls. """
+    def decorator(function):
+        calls = itertools.count()
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if next(calls) % sample:
+                return function(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                seconds = time.perf_counter() - started
+                record(phase, seconds * sample, calls=sample)
+                if histogram:
+                    observe("payo_call_duration_seconds", (("phase", phase),), seconds)  # A sample of real latencies
+        return wrapper
+    return decorator
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+def render():
+    """ All series in the Prometheus text exposition format """
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: list(series) for key, series in _histograms.items()}
+        buckets = dict(_buckets)
+
+    lines = []
+    for name, (kind, description) in HELP.items():
+        lines += [f"# HELP {name} {description}", f"# TYPE {name} {kind}"]
+        if kind == "counter":
+            for (series_name, labels), value in sorted(counters.items()):
+                if series_name == name:
+                    lines.append(f"{name}{_format_labels(labels)} {value:g}")
+            continue
+        for (series_name, labels), series in sorted(histograms.items()):
+            if series_name != name:
+                continue
+            for bound, count in zip(buckets[name], series):
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', f'{bound:g}')])} {count}")
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {series[-1]}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {series[-2]:g}")
+            lines.append(f"{name}_count{_format_labels(labels)} {series[-1]}")
+    return "\n".join(lines) + "\n"
+
+def metrics_view():
+    return Response(render(), mimetype="text/plain; version=0.0.4")
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["query_started"] = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info.pop("query_started")
+    record("sql", seconds)
+    if has_request_context() and "metrics" in g:
+        stats = g.metrics
+        stats["queries"] += 1
+        if stats["log_queries"] and len(stats["statements"]) < MAX_LOGGED_QUERIES:
+            stats["statements"].append((seconds, " ".join(statement.split())))
+
+def _handle_error(context):
+    """ A failed statement never reaches after_cursor_execute; its time still counts and its start is cleared """
+    started = context.connection.info.pop("query_started", None) if context.connection is not None else None
+    if started is not None:
+        record("sql", time.perf_counter() - started)
+
+def _start_template(sender, template, context, **extra):
+    if "metrics" in g:
+        g.metrics["template_started"] = time.perf_counter()
+
+def _finish_template(sender, template, context, **extra):
+    started = g.metrics.pop("template_started", None) if "metrics" in g else None
+    if started is not None:
+        record("template", time.perf_counter() - started)
+
+def _start_request():
+    g.metrics = {
+        "started": time.perf_counter(), "queries": 0, "phases": {}, "statements": [],
+        "log_queries": current_app.config.get("SLOW_REQUEST_MS") is not None, "status": 500,
+    }
+
+def _response_status(response):
+    if "metrics" in g:
+        g.metrics["status"] = response.status_code
+    return response
+
+def _finish_request(exception=None):
+    stats = g.pop("metrics", None)
+    if stats is None:
+        return
+    seconds = time.perf_counter() - stats["started"]
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+
+    inc("payo_requests_total", (("route", route), ("method", request.method), ("status", str(stats["status"]))))
+    observe("payo_request_duration_seconds", (("route", route), ("method", request.method)), seconds)
+    observe("payo_request_queries", (("route", route),), stats["queries"], QUERY_BUCKETS)
+    for phase in PHASES:
+        if phase == "sql" or phase in stats["phases"]:
+            observe("payo_request_phase_seconds", (("route", route), ("phase", phase)), stats["phases"].get(phase, 0))
+
+    threshold = current_app.config.get("SLOW_REQUEST_MS")
+    if threshold is not None and seconds * 1000 >= threshold:
+        phases = ", ".join(f"{phase} {value * 1000:.1f}ms" for phase, value in sorted(stats["phases"].items()))
+        lines = [f"🐢 Slow request {request.method} {request.full_path.rstrip('?')} -> {stats['status']} "
+                 f"in {seconds * 1000:.1f}ms, {stats['queries']} queries ({phases})"]
+        lines += [f"    {query_seconds * 1000:8.2f}ms  {statement}" for query_seconds, statement in stats["statements"]]
+        if stats["queries"] > len(stats["statements"]):
+            lines.append(f"    ... {stats['queries'] - len(stats['statements'])} more")
+        current_app.logger.warning("\n".join(lines))
+
+def init_metrics(app):
+    """ Hooks request timing, SQL events and template signals into the app and serves /metrics """
+    from models import db
+
+    with app.app_context():
+        for engine in db.engines.values():
+            event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+            event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+            event.listen(engine, "handle_error", _handle_error)
+
+    app.before_request(_start_request)
+    app.after_request(_response_status)
+    app.teardown_request(_finish_request)
+    before_render_template.connect(_start_template, app)
+    template_rendered.connect(_finish_template, app)
+    if app.config.get("METRICS_ENABLED", True):
+        app.add_url_rule("/metrics", "metrics", metrics_view)
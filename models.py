@@ -1,6 +1,10 @@
+from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
-import json, hashlib
+from sqlalchemy.ext.hybrid import hybrid_property
+import base64, json, hashlib, itertools, re
 from datetime import datetime
+from decimal import Decimal
+from metrics import timed
 
 db = SQLAlchemy()
 
@@ -9,9 +13,14 @@ class User(db.Model):
     username = db.Column(db.String(100), nullable=False)
     email = db.Column(db.String(100), unique=True, nullable=False)
     password = db.Column(db.String(255), nullable=False)
-    balance = db.Column(db.Float, default=0.0)
+    balance_cents = db.Column(db.BigInteger, nullable=False, default=0)  # Source of truth, always whole cents
     language = db.Column(db.String(10), default="en")
     country = db.Column(db.String(100), nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # Reconciliation watermark
+    # Bumped in SQL by every UPDATE of the row, ORM or Core, so API ETags change whenever a balance does
+    version = db.Column(db.BigInteger, nullable=False, default=0, onupdate=db.literal_column("version") + 1)
+
+    __table_args__ = (db.Index('ix_user_updated_at', 'updated_at'),)
 
     sent_transactions = db.relationship('Transaction', 
                                         foreign_keys='Transaction.sender_id', 
@@ -30,19 +39,201 @@ class User(db.Model):
 
     bank_accounts = db.relationship('BankAccount', backref='user', lazy=True)
 
+    @hybrid_property
+    def balance(self):
+        """ Balance in dollars, for display """
+        return self.balance_cents / 100
+
+    @balance.setter
+    def balance(self, value):
+        self.balance_cents = round(value * 100)
+
+    @balance.expression
+    def balance(cls):
+        return cls.balance_cents / 100.0
+
+def bump_version(user_id):
+    """ Invalidates a user's API ETags for changes that do not touch their row, like a new money request """
+    db.session.execute(db.update(User).where(User.id == user_id).values(version=User.version + 1))
+
 class Transaction(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     sender_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     recipient_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    amount = db.Column(db.Float, nullable=False)
+    amount = db.Column(db.Float, nullable=False)  # Amount credited to the recipient
+    fee = db.Column(db.Float, default=0.0)  # Charged to the sender on top of amount
+    bulk = db.Column(db.Boolean, nullable=False, default=False)  # Part of a bulk payout, which has its own risk limits
     timestamp = db.Column(db.DateTime, default=db.func.current_timestamp())
 
+    # Cover every column so a history page is read from the index alone, newest first
+    __table_args__ = (
+        db.Index('ix_transaction_sender_history', 'sender_id', 'timestamp', 'id', 'recipient_id', 'amount'),
+        db.Index('ix_transaction_recipient_history', 'recipient_id', 'timestamp', 'id', 'sender_id', 'amount'),
+        db.Index('ix_transaction_timestamp', 'timestamp', 'id'),  # Recent-window scans and period exports
+    )
+
+HISTORY_PAGE_SIZE = 20
+
+def encode_cursor(timestamp, transaction_id):
+    """ Opaque keyset cursor pointing just past a transaction. timestamp is the value as stored,
+    or a datetime, which is written the way the ORM stores one """
+    if isinstance(timestamp, datetime):
+        timestamp = timestamp.strftime("%Y-%m-%d %H:%M:%S.%f")
+    key = f"{timestamp}|{transaction_id}"
+    return base64.urlsafe_b64encode(key.encode()).decode()
+
+def decode_cursor(cursor):
+    """ Returns (stored timestamp, timestamp as a datetime, id) from a cursor, or None if it is missing or malformed """
+    try:
+        stored, transaction_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return stored, datetime.fromisoformat(stored), int(transaction_id)
+    except (AttributeError, ValueError):
+        return None
+
+def transaction_page(user_id, cursor=None, limit=HISTORY_PAGE_SIZE, session=None):
+    """ One page of a user's transactions, newest first, and the cursor for the next page.
+    Sent and received rows are read as two index range scans and merged, never the whole history.
+    Past the oldest row still in the table the page continues from the archive. """
+    after = decode_cursor(cursor) if cursor else None
+    session = session or db.session
+    # SQLite keeps timestamps as text: "YYYY-MM-DD HH:MM:SS" from the CURRENT_TIMESTAMP default, with microseconds
+    # from the ORM. A bound datetime never equals the first form, so rows sharing a second would repeat forever;
+    # the cursor carries the stored text and is compared as text instead.
+    stored = db.type_coerce(Transaction.timestamp, db.String)
+    by_text = session.get_bind().dialect.name == "sqlite"
+    rows = {}
+
+    for column in (Transaction.sender_id, Transaction.recipient_id):
+        query = session.query(Transaction, stored).options(db.joinedload(Transaction.sender), db.joinedload(Transaction.recipient)) \
+            .filter(column == user_id)
+        if after:
+            text, timestamp, transaction_id = after
+            compared, key = (stored, text) if by_text else (Transaction.timestamp, timestamp)
+            query = query.filter(db.or_(compared < key, db.and_(compared == key, Transaction.id < transaction_id)))
+        for transaction, stamp in query.order_by(Transaction.timestamp.desc(), Transaction.id.desc()).limit(limit + 1):
+            rows[transaction.id] = (stamp, transaction)  # A self-transfer shows up in both scans
+
+    page = sorted(rows.values(), key=lambda row: (row[0], row[1].id), reverse=True)
+    if len(page) <= limit:
+        from archive import archived_page  # Older rows may have moved to the archive, which imports this module
+        oldest = (page[-1][1].timestamp, page[-1][1].id) if page else after[1:] if after else None
+        page += [(transaction.timestamp, transaction) for transaction in archived_page(user_id, oldest, limit + 1 - len(page), session)]
+    next_cursor = encode_cursor(page[limit - 1][0], page[limit - 1][1].id) if len(page) > limit else None
+    return [transaction for _, transaction in page[:limit]], next_cursor
+
+class Contact(db.Model):
+    """ Precomputed recent contacts, one row per direction of each pair of users who exchanged money """
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    contact_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    last_transaction_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    transfers = db.Column(db.Integer, default=0, nullable=False)
+
+RECENT_CONTACTS = 20  # Contacts shown on the payments page
+
+def record_contact(sender_id, recipient_id):
+    """ Updates both users' contact rows, call alongside adding a Transaction """
+    if sender_id == recipient_id:
+        return
+    now = datetime.utcnow()
+    for user_id, contact_id in ((sender_id, recipient_id), (recipient_id, sender_id)):
+        contact = db.session.get(Contact, (user_id, contact_id)) or Contact(user_id=user_id, contact_id=contact_id, transfers=0)
+        contact.last_transaction_at = now
+        contact.transfers += 1
+        db.session.add(contact)
+
+def record_contacts(sender_id, recipient_ids):
+    """ record_contact for one sender paying many recipients, loading existing rows in two queries """
+    recipient_ids = set(recipient_ids) - {sender_id}
+    if not recipient_ids:
+        return
+    now = datetime.utcnow()
+    existing = {
+        (contact.user_id, contact.contact_id): contact
+        for contact in Contact.query.filter(db.or_(
+            db.and_(Contact.user_id == sender_id, Contact.contact_id.in_(recipient_ids)),
+            db.and_(Contact.user_id.in_(recipient_ids), Contact.contact_id == sender_id)
+        ))
+    }
+    for recipient_id in recipient_ids:
+        for key in ((sender_id, recipient_id), (recipient_id, sender_id)):
+            contact = existing.get(key) or Contact(user_id=key[0], contact_id=key[1], transfers=0)
+            contact.last_transaction_at = now
+            contact.transfers += 1
+            db.session.add(contact)
+
+def recent_contacts(user_id, limit=RECENT_CONTACTS, session=None):
+    """ Most recent counterparties of a user in a single query """
+    return ((session or db.session).query(User).join(Contact, Contact.contact_id == User.id)
+            .filter(Contact.user_id == user_id)
+            .order_by(Contact.last_transaction_at.desc())
+            .limit(limit).all())
+
+def rebuild_contacts():
+    """ Recomputes every Contact row from the Transaction table and the archive """
+    from archive import archived_contact_pairs  # Imports this module
+    pairs = {}
+    rows = db.session.query(
+        Transaction.sender_id, Transaction.recipient_id, db.func.max(Transaction.timestamp), db.func.count()
+    ).filter(Transaction.sender_id != Transaction.recipient_id).group_by(Transaction.sender_id, Transaction.recipient_id)
+
+    for sender_id, recipient_id, last_at, count in itertools.chain(rows, archived_contact_pairs()):
+        for key in ((sender_id, recipient_id), (recipient_id, sender_id)):
+            previous_at, previous_count = pairs.get(key, (last_at, 0))
+            pairs[key] = (max(previous_at, last_at), previous_count + count)
+
+    Contact.query.delete()
+    db.session.bulk_insert_mappings(Contact, [
+        {"user_id": user_id, "contact_id": contact_id, "last_transaction_at": last_at, "transfers": count}
+        for (user_id, contact_id), (last_at, count) in pairs.items()
+    ])
+    db.session.commit()
+    return len(pairs)
+
 class MoneyRequest(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     sender_email = db.Column(db.String(100), nullable=False)
     recipient_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     amount = db.Column(db.Float, nullable=False)
     status = db.Column(db.String(20), default="Pending")  # Pending, Accepted, Rejected
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class Deposit(db.Model):
+    """ A wallet top-up through Stripe Checkout, credited only by the completed-session webhook """
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    amount_cents = db.Column(db.BigInteger, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default="pending")  # pending, open, paid, expired, failed
+    stripe_session_id = db.Column(db.String(255), unique=True)
+    checkout_url = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    paid_at = db.Column(db.DateTime)
+
+class Withdrawal(db.Model):
+    """ Money taken out of a wallet, kept so statements can account for it """
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    amount_cents = db.Column(db.BigInteger, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (db.Index('ix_withdrawal_user_created', 'user_id', 'created_at', 'id'),)
+
+class OutboxMessage(db.Model):
+    """ Work committed together with the change that caused it, delivered later by the outbox worker """
+    id = db.Column(db.Integer, primary_key=True)
+    topic = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False)  # JSON
+    available_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)  # Not claimable before this
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    last_error = db.Column(db.Text)
+    processed_at = db.Column(db.DateTime)
+
+    __table_args__ = (db.Index('ix_outbox_due', 'processed_at', 'available_at'),)
+
+class StripeEvent(db.Model):
+    """ Webhook event ids already applied, so Stripe's retries are no-ops """
+    id = db.Column(db.String(255), primary_key=True)
+    type = db.Column(db.String(100), nullable=False)
+    received_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 class Block(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -51,59 +242,297 @@ class Block(db.Model):
     data = db.Column(db.Text, nullable=False)
     previous_hash = db.Column(db.String(64), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    amount_cents = db.Column(db.BigInteger, nullable=False, default=0)  # Cents carried by the block, negative for debits
+
+    __table_args__ = (db.Index('ix_block_user_index', 'user_id', 'index'),)
     
     def compute_hash(self):
         """ Compute hash for the block """
-        block_data = json.dumps({
-            'index': self.index,
-            'data': self.data,
-            'previous_hash': self.previous_hash
-        }, sort_keys=True)
-        return hashlib.sha256(block_data.encode()).hexdigest()
+        return link_hash(self.index, self.data, self.previous_hash)
+
+@timed("ledger_hash", sample=16)  # Called once per block, so only a sample is timed
+def link_hash(index, data, previous_hash):
+    """ SHA-256 over a block's index, data and previous hash """
+    block_data = json.dumps({
+        'index': index,
+        'data': data,
+        'previous_hash': previous_hash
+    }, sort_keys=True)
+    return hashlib.sha256(block_data.encode()).hexdigest()
+
+class ChainHead(db.Model):
+    """ Cached tip of a user's chain so ledger writes skip the ORDER BY index scan """
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    last_index = db.Column(db.Integer, nullable=False, default=0)
+    last_hash = db.Column(db.String(64))  # compute_hash() of the last block, None for an empty chain
+    total_cents = db.Column(db.BigInteger, nullable=False, default=0)  # Sum of block amounts
+
+class ChainCheckpoint(db.Model):
+    """ Last block of a user's chain that passed verification, signed with the app secret """
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    last_index = db.Column(db.Integer, nullable=False)
+    last_hash = db.Column(db.String(64), nullable=False)
+    signature = db.Column(db.String(64), nullable=False)
+    verified_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class ReconciliationRun(db.Model):
+    """ One reconcile-ledger pass; the next incremental run checks users touched after it started """
+    id = db.Column(db.Integer, primary_key=True)
+    started_at = db.Column(db.DateTime, nullable=False)
+    finished_at = db.Column(db.DateTime)  # None while running or if the run failed
+    since = db.Column(db.DateTime)  # Watermark this run started from, None for a full run
+    last_block_id = db.Column(db.Integer, nullable=False, default=0)  # Highest Block.id when it started
+    users_checked = db.Column(db.Integer, nullable=False, default=0)
+    discrepancies = db.Column(db.Integer, nullable=False, default=0)
+
+class ArchiveSegment(db.Model):
+    """ An immutable compressed file of rows moved out of the transaction or block table, see archive.py """
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # "transaction" or "block"
+    path = db.Column(db.String(255), unique=True, nullable=False)  # File name inside ARCHIVE_DIR
+    cutoff = db.Column(db.DateTime, nullable=False)  # Rows older than this were archived
+    first_at = db.Column(db.DateTime)
+    last_at = db.Column(db.DateTime)
+    rows = db.Column(db.Integer, nullable=False, default=0)
+    bytes = db.Column(db.BigInteger, nullable=False, default=0)
+    sha256 = db.Column(db.String(64), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class ArchiveIndex(db.Model):
+    """ Where one user's rows sit in a segment: a single compressed frame at offset """
+    segment_id = db.Column(db.Integer, db.ForeignKey('archive_segment.id'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    offset = db.Column(db.BigInteger, nullable=False)
+    length = db.Column(db.Integer, nullable=False)
+    rows = db.Column(db.Integer, nullable=False)
+    first_at = db.Column(db.DateTime, nullable=False)
+    last_at = db.Column(db.DateTime, nullable=False)
+    net_cents = db.Column(db.BigInteger)  # Transaction frames only: received minus sent with fees, for opening balances
+    # Block frames only: the archived index range, cents carried and compute_hash() of the last block
+    first_index = db.Column(db.Integer)
+    last_index = db.Column(db.Integer)
+    amount_cents = db.Column(db.BigInteger)
+    last_hash = db.Column(db.String(64))
+
+    __table_args__ = (db.Index('ix_archive_index_user', 'user_id', 'first_at'),)
+
+def archived_block_totals(user_ids):
+    """ Cents in each user's archived blocks, one GROUP BY for all of them """
+    if not user_ids:
+        return {}
+    return dict(db.session.query(ArchiveIndex.user_id, db.func.sum(ArchiveIndex.amount_cents))
+                .join(ArchiveSegment, ArchiveSegment.id == ArchiveIndex.segment_id)
+                .filter(ArchiveSegment.kind == "block", ArchiveIndex.user_id.in_(list(user_ids)))
+                .group_by(ArchiveIndex.user_id))
+
+def archived_tail(user_id):
+    """ (last index, compute_hash() of the last block) of a user's archived chain prefix, (-1, None) without one """
+    row = db.session.query(ArchiveIndex.last_index, ArchiveIndex.last_hash) \
+        .join(ArchiveSegment, ArchiveSegment.id == ArchiveIndex.segment_id) \
+        .filter(ArchiveSegment.kind == "block", ArchiveIndex.user_id == user_id) \
+        .order_by(ArchiveIndex.last_index.desc()).first()
+    return (row[0], row[1]) if row else (-1, None)
 
 def create_genesis_block(user_id):
     """ Creates the first block in the blockchain """
+    head = chain_head(user_id)
     genesis_block = Block(
         index=0,
         data="Genesis Block",
         previous_hash="0",
-        user_id=user_id
+        user_id=user_id,
+        amount_cents=0
     )
     genesis_block.previous_hash = genesis_block.compute_hash()
     db.session.add(genesis_block)
+    advance_head(head, genesis_block)
     db.session.commit()
 
-def add_block(user_id, amount):
-    """ Adds multiple blocks, one for each unit of amount added """
-    last_block = Block.query.filter_by(user_id=user_id).order_by(Block.index.desc()).first()
-    new_index = last_block.index + 1 if last_block else 1  # Genesis block check
-
-    for _ in range(int(amount)):  # Create a block for each unit of amount
-        new_block = Block(
-            index=new_index,
-            data=f"Added 1 USD",  # Each block represents 1 USD
-            previous_hash=last_block.compute_hash() if last_block else "0",
-            user_id=user_id
+def ledger_mode():
+    """ Returns "segment" (one block per credit/debit) or "unit" (one block per USD) """
+    return current_app.config.get("LEDGER_MODE", "segment")
+
+def usd_text(cents):
+    """ Cents as the dollar figure written into block data: 12 for 1200, 10.75 for 1075 """
+    return str(Decimal(cents) / 100)
+
+BLOCK_DATA = re.compile(r"(Added|Removed) (\d+(?:\.\d{1,2})?) USD")
+
+def data_cents(data):
+    """ Cents a block's hashed data says it carries, None when the data names no amount.
+    Verification checks Block.amount_cents against it, since the amount itself is not hashed. """
+    if data == "Genesis Block":
+        return 0
+    match = BLOCK_DATA.fullmatch(data)
+    if match is None:
+        return None
+    cents = int(Decimal(match[2]) * 100)
+    return cents if match[1] == "Added" else -cents
+
+def chain_block(prev_hash, index, data, amount_cents, user_id, timestamp=None):
+    """ Builds a block linked to the block whose compute_hash() is prev_hash ("0" for none) """
+    new_block = Block(
+        index=index,
+        data=data,
+        previous_hash=link_hash(index, data, prev_hash),
+        user_id=user_id,
+        amount_cents=amount_cents
+    )
+    if timestamp is not None:
+        new_block.timestamp = timestamp
+    return new_block
+
+def chain_total(user_id):
+    """ Cents currently held in a user's chain, summed from the blocks themselves and their archived prefix """
+    hot = db.session.query(db.func.coalesce(db.func.sum(Block.amount_cents), 0)).filter(Block.user_id == user_id).scalar()
+    return hot + archived_block_totals([user_id]).get(user_id, 0)
+
+def chain_head(user_id):
+    """ Returns the cached ChainHead for a user, building it from the blocks on first use """
+    head = db.session.get(ChainHead, user_id, with_for_update=True)
+    if head is None:
+        last_block = Block.query.filter_by(user_id=user_id).order_by(Block.index.desc()).first()
+        head = ChainHead(
+            user_id=user_id,
+            last_index=last_block.index if last_block else 0,
+            last_hash=last_block.compute_hash() if last_block else None,
+            total_cents=chain_total(user_id)
         )
-        new_block.previous_hash = new_block.compute_hash()
+        db.session.add(head)
+    return head
+
+def chain_heads(user_ids):
+    """ ChainHeads for many users at once, missing heads are built with one aggregate query """
+    heads = {head.user_id: head for head in ChainHead.query.filter(ChainHead.user_id.in_(user_ids)).with_for_update()}
+    missing = set(user_ids) - set(heads)
+    if missing:
+        tips = db.session.query(
+            Block.user_id, db.func.max(Block.index).label("last_index"), db.func.sum(Block.amount_cents).label("total")
+        ).filter(Block.user_id.in_(missing)).group_by(Block.user_id).subquery()
+        rows = db.session.query(tips.c.user_id, tips.c.last_index, tips.c.total, Block) \
+            .join(Block, db.and_(Block.user_id == tips.c.user_id, Block.index == tips.c.last_index))
+        archived = archived_block_totals(missing)
+        for user_id, last_index, total, last_block in rows:
+            total += archived.get(user_id, 0)
+            heads[user_id] = ChainHead(user_id=user_id, last_index=last_index, last_hash=last_block.compute_hash(), total_cents=total)
+        for user_id in missing - set(heads):
+            heads[user_id] = ChainHead(user_id=user_id, last_index=0, last_hash=None, total_cents=0)
+        db.session.add_all(heads[user_id] for user_id in missing)
+    return heads
+
+def advance_head(head, block):
+    """ Moves a chain head onto a newly appended block """
+    head.last_index = block.index
+    head.last_hash = block.compute_hash()
+    head.total_cents += block.amount_cents
+
+TAIL_BATCH = 1000  # Blocks fetched per round trip while walking a chain's tail
+
+def truncate_chain(head, index):
+    """ Deletes every block after index in one statement and rewinds the head """
+    tail = Block.query.filter(Block.user_id == head.user_id, Block.index > index)
+    removed = tail.with_entities(db.func.coalesce(db.func.sum(Block.amount_cents), 0)).scalar()
+    tail.delete(synchronize_session=False)
+
+    new_last = Block.query.filter_by(user_id=head.user_id, index=index).first()
+    if new_last is None:
+        # Truncating down to the archived prefix leaves its last block, which only the archive index still hashes
+        archived_index, archived_hash = archived_tail(head.user_id)
+        head.last_hash = archived_hash if archived_index == index else None
+    else:
+        head.last_hash = new_last.compute_hash()
+    head.last_index = index
+    head.total_cents -= removed
+
+def truncate_amount(head, amount):
+    """ Debits amount cents in unit mode by deleting blocks from the tail, newest first, until they hold at least amount.
+    Blocks count for what they carry, so compacted segments and earlier debits are handled; anything deleted
+    beyond amount is credited back. Returns False, changing nothing, when the hot tail cannot cover amount. """
+    floor = archived_tail(head.user_id)[0]
+    tail = db.session.execute(
+        db.select(Block.index, Block.amount_cents).where(Block.user_id == head.user_id, Block.index > floor)
+        .order_by(Block.index.desc()).execution_options(yield_per=TAIL_BATCH)
+    )
+    removed, cut = 0, None
+    for index, block_amount in tail:
+        removed += block_amount
+        if removed >= amount:
+            cut = index
+            break
+    tail.close()
+    if cut is None:
+        return False
+
+    truncate_chain(head, cut - 1)
+    append_blocks(head, credit_blocks(removed - amount))
+    return True
+
+def credit_blocks(cents):
+    """ (data, cents) of the blocks recording a credit: one segment block, or in unit mode one block
+    per whole USD and one more for any cents left over """
+    if cents <= 0:
+        return []
+    if ledger_mode() == "segment":
+        return [(f"Added {usd_text(cents)} USD", cents)]
+    dollars, rest = divmod(cents, 100)
+    return [("Added 1 USD", 100)] * dollars + ([(f"Added {usd_text(rest)} USD", rest)] if rest else [])
+
+def append_blocks(head, blocks):
+    """ Links (data, cents) blocks onto the end of a chain and moves its head """
+    for data, cents in blocks:
+        new_block = chain_block(head.last_hash or "0", head.last_index + 1, data, cents, head.user_id)
         db.session.add(new_block)
-        last_block = new_block  # Update last_block for the next iteration
-        new_index += 1  # Increment index for the next block
-    
-    db.session.commit()
+        advance_head(head, new_block)
 
-def remove_block(user_id, amount):
-    """ Removes blocks when funds are withdrawn """
-    blocks_to_remove = round(amount)  # Ensuring decimal amounts are handled
-    user_blocks = Block.query.filter_by(user_id=user_id).order_by(Block.index.desc()).all()
+def add_block(user_id, amount_cents, commit=True):
+    """ Records a credit of amount_cents: one segment block, or one block per USD in unit mode.
+    Pass commit=False to leave the blocks in the caller's transaction. """
+    head = chain_head(user_id)
+    append_blocks(head, credit_blocks(amount_cents))
 
-    if len(user_blocks) < blocks_to_remove:
+    if commit:
+        db.session.commit()
+
+def add_blocks(amounts):
+    """ Credits many users in the caller's transaction, amounts maps user_id to cents.
+    In segment mode heads are loaded together and every block goes in one executemany INSERT. """
+    if ledger_mode() != "segment":
+        for user_id, amount in amounts.items():
+            add_block(user_id, amount, commit=False)
+        return
+
+    heads = chain_heads(list(amounts))
+    now = datetime.utcnow()
+    rows = []
+    for user_id, cents in amounts.items():
+        if cents <= 0:
+            continue
+        head = heads[user_id]
+        index, data = head.last_index + 1, f"Added {usd_text(cents)} USD"
+        block_hash = link_hash(index, data, head.last_hash or "0")
+        rows.append({"index": index, "data": data, "previous_hash": block_hash, "user_id": user_id, "amount_cents": cents, "timestamp": now})
+        head.last_index = index
+        head.last_hash = link_hash(index, data, block_hash)  # Same as compute_hash() on the stored block
+        head.total_cents += cents
+    if rows:
+        db.session.execute(db.insert(Block), rows)
+
+def remove_block(user_id, amount_cents, commit=True):
+    """ Records a debit of amount_cents when funds are withdrawn """
+    head = chain_head(user_id)
+
+    if head.total_cents < amount_cents:
         print("❌ Insufficient blocks to remove")
         return False  # Not enough blocks to remove
 
-    # Remove blocks safely
-    for _ in range(min(blocks_to_remove, len(user_blocks))):
-        db.session.delete(user_blocks.pop(0))  # Remove from latest to oldest
+    if amount_cents > 0 and ledger_mode() == "segment":
+        append_blocks(head, [(f"Removed {usd_text(amount_cents)} USD", -amount_cents)])
+    elif amount_cents > 0 and not truncate_amount(head, amount_cents):
+        print("❌ Cannot remove archived blocks")
+        return False
+
+    if not commit:
+        return True
 
     try:
         db.session.commit()
@@ -113,6 +542,85 @@ def remove_block(user_id, amount):
         print(f"⚠️ Error removing blocks: {e}")
         return False
 
+def compact_blocks(user_id=None):
+    """ Collapses runs of per-dollar blocks into equivalent segments and re-links the chain.
+    Returns the number of rows removed. """
+    user_ids = [user_id] if user_id is not None else [
+        row[0] for row in db.session.query(Block.user_id).filter(Block.data == "Added 1 USD").distinct()
+    ]
+    removed = 0
+
+    for uid in user_ids:
+        blocks = Block.query.filter_by(user_id=uid).order_by(Block.index).all()
+        segments = []  # [data, amount, timestamp]
+        for block in blocks:
+            if block.data == "Added 1 USD" and segments and segments[-1][0] is None:
+                segments[-1][1] += block.amount_cents
+                segments[-1][2] = block.timestamp
+            elif block.data == "Added 1 USD":
+                segments.append([None, block.amount_cents, block.timestamp])
+            else:
+                segments.append([block.data, block.amount_cents, block.timestamp])
+
+        if len(segments) == len(blocks):
+            continue
+
+        for block in blocks:
+            db.session.delete(block)
+        db.session.flush()
+
+        last_block, previous = None, archived_tail(uid)[1] or "0"  # An archived prefix keeps its link
+        for offset, (data, amount, timestamp) in enumerate(segments):
+            index = blocks[0].index + offset
+            if data is None:
+                data = f"Added {usd_text(amount)} USD"
+            last_block = chain_block(last_block.compute_hash() if last_block else previous, index, data, amount, uid, timestamp)
+            db.session.add(last_block)
+
+        head = chain_head(uid)
+        head.last_index = last_block.index
+        head.last_hash = last_block.compute_hash()
+
+        removed += len(blocks) - len(segments)
+        db.session.commit()
+
+    return removed
+
+# Columns added after the first release: (table, column, definition, backfill statement)
+ADDED_COLUMNS = [
+    # Blocks written before amounts were stored are "Added 1 USD" units, apart from genesis blocks
+    ("block", "amount_cents", "BIGINT NOT NULL DEFAULT 100", "UPDATE block SET amount_cents = 0 WHERE data = 'Genesis Block'"),
+    ("user", "balance_cents", "BIGINT NOT NULL DEFAULT 0",
+     'UPDATE "user" SET balance_cents = CAST(ROUND(COALESCE(balance, 0) * 100) AS INTEGER)'),
+    ("transaction", "fee", "FLOAT DEFAULT 0", None),
+    ("transaction", "bulk", "BOOLEAN NOT NULL DEFAULT FALSE", None),
+    ("money_request", "created_at", "DATETIME", None),
+    ("user", "updated_at", "DATETIME", None),
+    ("user", "version", "BIGINT NOT NULL DEFAULT 0", None),
+]
+
+def upgrade_schema():
+    """ Applies additive schema changes that db.create_all() does not make on existing tables """
+    inspector = db.inspect(db.engine)
+    added = set()
+    for table, column, definition, backfill in ADDED_COLUMNS:
+        if column in {existing["name"] for existing in inspector.get_columns(table)}:
+            continue
+        added.add((table, column))
+        with db.engine.begin() as conn:
+            conn.execute(db.text(f'ALTER TABLE "{table}" ADD COLUMN {column} {definition}'))
+            if backfill:
+                conn.execute(db.text(backfill))
+
+    for table in (User.__table__, Block.__table__, Transaction.__table__):
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
+    # Ledger debits must be covered by blocks now, and older credits changed balances without writing any
+    if ("block", "amount_cents") in added:
+        from reconcile import open_ledgers  # Imports this module
+        print(f"✅ Opened {open_ledgers()} ledgers at their users' balances")
+
 class BankAccount(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -121,11 +629,3 @@ class BankAccount(db.Model):
     ifsc_code = db.Column(db.String(20), nullable=False)
     account_type = db.Column(db.String(20), nullable=False)  # Savings, Current, etc.
     branch_name = db.Column(db.String(100), nullable=False)
-
-REMITTANCE_FEES = {
-    "Bahrain": 0.5, "Kuwait": 0.5, "Oman": 0.5, "Qatar": 0.5, "Saudi Arabia": 0.5, "United Arab Emirates": 0.5,
-    "Jordan": 0.5, "Lebanon": 0.5, "Maldives": 0.5, "Sri Lanka": 0.5, "Bangladesh": 0.5, "Philippines": 0.5,
-    "Malaysia": 0.5, "Thailand": 0.5, "Vietnam": 0.5, "Indonesia": 0.5, "Cambodia": 0.5, "Myanmar": 0.5,
-    "Laos": 0.5, "Taiwan": 0.5, "Brunei": 0.5, "Mongolia": 0.5, "Afghanistan": 0.5, "Kazakhstan": 0.5,
-    "Cyprus": 0.5, "Hong Kong": 0.5, "Singapore": 0.5, "Switzerland": 0.5, "Monaco": 0.5
-}
\ No newline at end of file
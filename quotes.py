@@ -0,0 +1,145 @@
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from flask import current_app
+
+ANY = "*"  # Wildcard country in fee schedules
+CENT = Decimal("0.01")
+
+Quote = namedtuple("Quote", "amount_cents fee_cents net_cents source destination currency fx_rate receive_amount")
+
+class QuoteError(Exception):
+    """ No usable rate table, or a quote that cannot be priced """
+
+class FileRateSource:
+    """ Fee schedules and FX rates from a JSON file, see rates.json """
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        with open(self.path) as f:
+            return json.load(f)
+
+class StaticRateSource:
+    """ A fixed table, for tests and local runs """
+
+    def __init__(self, data):
+        self.data = data
+
+    def load(self):
+        return self.data
+
+def build_table(data):
+    """ Indexes raw source data: fees by (from, to) corridor, USD rates by currency, currency by country """
+    fees = {}
+    for entry in data.get("fees", []):
+        max_cents = entry.get("max_cents")
+        fees[entry.get("from", ANY), entry.get("to", ANY)] = (
+            Decimal(str(entry.get("rate", 0))),
+            int(entry.get("fixed_cents", 0)),
+            int(entry.get("min_cents", 0)),
+            int(max_cents) if max_cents is not None else None
+        )
+    if (ANY, ANY) not in fees:
+        raise QuoteError("Rate table has no default */* fee")
+
+    rates = {code: Decimal(str(rate)) for code, rate in data.get("rates", {}).items()}
+    rates["USD"] = Decimal(1)
+    return {"fees": fees, "rates": rates, "currencies": dict(data.get("currencies", {}))}
+
+class QuoteEngine:
+    """ Prices transfers from an in-memory rate table that is reloaded from its source every ttl seconds.
+    A failed reload keeps serving the previous table and tries again after retry seconds. """
+
+    def __init__(self, source, ttl=300, retry=30):
+        self.source = source
+        self.ttl = ttl
+        self.retry = retry
+        self._table = None
+        self._expires = 0
+        self._lock = threading.Lock()
+
+    def table(self):
+        if self._table is not None and time.monotonic() < self._expires:
+            return self._table
+        with self._lock:
+            if self._table is None or time.monotonic() >= self._expires:
+                try:
+                    self._table = build_table(self.source.load())
+                    self._expires = time.monotonic() + self.ttl
+                except (OSError, ValueError, TypeError, InvalidOperation, QuoteError) as e:
+                    if self._table is None:
+                        raise QuoteError(f"No rate table available: {e}")
+                    print(f"⚠️ Rate refresh failed, keeping the previous table: {e}")
+                    self._expires = time.monotonic() + self.retry
+            return self._table
+
+    def refresh(self):
+        """ Forces a reload on the next quote """
+        self._expires = 0
+
+    def schedule(self, source, destination):
+        """ (rate, fixed_cents, min_cents, max_cents) for a corridor, most specific entry first """
+        fees = self.table()["fees"]
+        for key in ((source, destination), (source, ANY), (ANY, destination), (ANY, ANY)):
+            if key in fees:
+                return fees[key]
+
+    def quote_batch(self, amounts_cents, corridors):
+        """ Quotes many amounts against one table snapshot. corridors is a list of (from, to)
+        country pairs parallel to amounts_cents, or a single pair applied to every amount. """
+        table = self.table()
+        if isinstance(corridors, tuple):
+            corridors = [corridors] * len(amounts_cents)
+        if len(corridors) != len(amounts_cents):
+            raise QuoteError("Need one corridor per amount")
+
+        priced = {}  # Corridor -> (schedule, currency, rate), looked up once per distinct corridor
+        quotes = []
+        for amount_cents, corridor in zip(amounts_cents, corridors):
+            if corridor not in priced:
+                currency = table["currencies"].get(corridor[1], "USD")
+                if currency not in table["rates"]:
+                    raise QuoteError(f"No FX rate for {currency}")
+                priced[corridor] = (self.schedule(*corridor), currency, table["rates"][currency])
+            (rate, fixed_cents, min_cents, max_cents), currency, fx_rate = priced[corridor]
+
+            fee_cents = max(int((amount_cents * rate).to_integral_value(ROUND_HALF_UP)) + fixed_cents, min_cents)
+            if max_cents is not None:
+                fee_cents = min(fee_cents, max_cents)
+            net_cents = amount_cents - fee_cents
+            receive_amount = (Decimal(net_cents) / 100 * fx_rate).quantize(CENT, ROUND_HALF_UP)
+            quotes.append(Quote(amount_cents, fee_cents, net_cents, corridor[0], corridor[1], currency, fx_rate, receive_amount))
+        return quotes
+
+    def quote(self, amount_cents, source, destination):
+        return self.quote_batch([amount_cents], [(source, destination)])[0]
+
+    def fee_percentages(self, source, destinations):
+        """ Percentage fee from one country to each destination, for display """
+        return {destination: float(self.schedule(source, destination)[0] * 100) for destination in destinations}
+
+def quote_engine():
+    """ The app's QuoteEngine, created from config on first use """
+    engine = current_app.extensions.get("quotes")
+    if engine is None:
+        config = current_app.config
+        source = config.get("QUOTE_RATE_SOURCE") or FileRateSource(os.path.join(current_app.root_path, config.get("QUOTE_RATES_FILE", "rates.json")))
+        engine = current_app.extensions.setdefault("quotes", QuoteEngine(source, ttl=config.get("QUOTE_TTL", 300)))
+    return engine
+
+def quote_json(quote):
+    return {
+        "amount": quote.amount_cents / 100,
+        "fee": quote.fee_cents / 100,
+        "net_amount": quote.net_cents / 100,
+        "from": quote.source,
+        "to": quote.destination,
+        "currency": quote.currency,
+        "fx_rate": float(quote.fx_rate),
+        "receive_amount": float(quote.receive_amount)
+    }
@@ -0,0 +1,103 @@
+import csv
+from datetime import datetime, timedelta
+from models import db, User, Block, ChainHead, ReconciliationRun, archived_block_totals, append_blocks, chain_head, usd_text
+
+CHUNK_SIZE = 1000  # Users compared per round of GROUP BY queries
+WATERMARK_OVERLAP = timedelta(minutes=5)  # Re-checks writes stamped before the last run but committed after it started
+REPORT_COLUMNS = ["user_id", "email", "balance_cents", "chain_cents", "head_cents", "difference_cents", "issue"]
+
+def last_run():
+    """ The most recent reconciliation that finished, or None """
+    return ReconciliationRun.query.filter(ReconciliationRun.finished_at.isnot(None)) \
+        .order_by(ReconciliationRun.id.desc()).first()
+
+def user_chunks(since=None, after_block_id=0):
+    """ Lists of at most CHUNK_SIZE user ids in id order. Every user when since is None, otherwise only
+    users whose balance changed since then or who got blocks after after_block_id. """
+    if since is not None:
+        touched = db.session.query(User.id).filter(User.updated_at >= since) \
+            .union(db.session.query(Block.user_id).filter(Block.id > after_block_id))
+        user_ids = sorted(row[0] for row in touched)
+        for start in range(0, len(user_ids), CHUNK_SIZE):
+            yield user_ids[start:start + CHUNK_SIZE]
+        return
+
+    last_id = 0
+    while True:
+        user_ids = db.session.scalars(
+            db.select(User.id).where(User.id > last_id).order_by(User.id).limit(CHUNK_SIZE)
+        ).all()
+        if not user_ids:
+            return
+        yield user_ids
+        last_id = user_ids[-1]
+
+def compare_chunk(user_ids):
+    """ Report rows for the users in one chunk whose balance, block total and cached head disagree.
+    Four aggregate queries per chunk however many users it holds. """
+    totals = dict(db.session.query(Block.user_id, db.func.sum(Block.amount_cents))
+                  .filter(Block.user_id.in_(user_ids)).group_by(Block.user_id))
+    for user_id, amount in archived_block_totals(user_ids).items():
+        totals[user_id] = (totals.get(user_id) or 0) + amount
+    heads = dict(db.session.query(ChainHead.user_id, ChainHead.total_cents).filter(ChainHead.user_id.in_(user_ids)))
+    balances = db.session.query(User.id, User.email, User.balance_cents).filter(User.id.in_(user_ids)).order_by(User.id)
+
+    rows = []
+    for user_id, email, balance_cents in balances:
+        chain_cents = totals.get(user_id) or 0
+        head_cents = heads.get(user_id)
+        issues = []
+        if balance_cents != chain_cents:
+            issues.append("balance_mismatch")
+        if head_cents is not None and head_cents != chain_cents:
+            issues.append("stale_head")
+        if issues:
+            rows.append({
+                "user_id": user_id, "email": email, "balance_cents": balance_cents, "chain_cents": chain_cents,
+                "head_cents": head_cents, "difference_cents": balance_cents - chain_cents, "issue": "+".join(issues)
+            })
+    return rows
+
+def open_ledgers():
+    """ Appends one opening block to every chain whose total differs from its user's balance, so the
+    ledger starts from the balance. Balances credited before credits wrote blocks are carried over this way.
+    Meant to run once, when the ledger is upgraded: after that a mismatch is a discrepancy to report, not to
+    paper over. Returns how many chains were opened. """
+    opened = 0
+    for user_ids in user_chunks():
+        for row in compare_chunk(user_ids):
+            if "balance_mismatch" not in row["issue"]:
+                continue
+            cents = row["difference_cents"]
+            data = f"{'Added' if cents > 0 else 'Removed'} {usd_text(abs(cents))} USD"
+            append_blocks(chain_head(row["user_id"]), [(data, cents)])
+            opened += 1
+        db.session.commit()
+    return opened
+
+def reconcile(out, full=False):
+    """ Compares balances with block chains for every user touched since the last run (all users with
+    full=True or on the first run), writing discrepancies as CSV to out. Returns the ReconciliationRun. """
+    previous = None if full else last_run()
+    run = ReconciliationRun(
+        started_at=datetime.utcnow(),
+        since=previous.started_at - WATERMARK_OVERLAP if previous else None,
+        last_block_id=db.session.query(db.func.max(Block.id)).scalar() or 0
+    )
+    db.session.add(run)
+    db.session.commit()
+
+    writer = csv.DictWriter(out, fieldnames=REPORT_COLUMNS)
+    writer.writeheader()
+    checked = discrepancies = 0
+    for user_ids in user_chunks(run.since, previous.last_block_id if previous else 0):
+        rows = compare_chunk(user_ids)
+        writer.writerows(rows)
+        checked += len(user_ids)
+        discrepancies += len(rows)
+
+    run.finished_at = datetime.utcnow()
+    run.users_checked = checked
+    run.discrepancies = discrepancies
+    db.session.commit()
+    return run
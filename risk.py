@@ -0,0 +1,259 @@
+import array
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from flask import current_app
+from metrics import inc
+from models import db, User, Transaction, MoneyRequest
+from transfers import TransferError
+
+# Window name -> (buckets, seconds per bucket). Totals are exact to one bucket's width.
+WINDOWS = {"1m": (12, 5), "1h": (12, 300), "24h": (24, 3600)}
+SCOPES = ("sender", "recipient", "corridor", "requester", "payout_sender")
+PRUNE_EVERY = 10000  # Recorded events between sweeps that drop keys idle for a whole day
+HORIZON = max(size * width for size, width in WINDOWS.values())
+
+# Every counter key owns one flat array: [last seen] then per window [bucket, count, total, counts..., sums...].
+# One untracked array per key keeps memory small and out of the garbage collector's way.
+LAYOUT = {}
+_offset = 1
+for _name, (_size, _width) in WINDOWS.items():
+    LAYOUT[_name] = (_offset, _size, _width)
+    _offset += 3 + 2 * _size
+STATE_SIZE = _offset
+ZEROS = array.array("q", bytes(8 * STATE_SIZE))
+
+Risk = namedtuple("Risk", "action score reasons")
+
+def new_state():
+    return array.array("q", ZEROS)
+
+def _advance(state, base, size, bucket):
+    """ Moves a window's ring forward to bucket, clearing the buckets that fell out of it """
+    head = state[base]
+    if bucket <= head:
+        return
+    if bucket - head >= size:  # Idle for the whole window, nothing left in it
+        state[base + 1:base + 3 + 2 * size] = ZEROS[:2 + 2 * size]
+        state[base] = bucket
+        return
+    for step in range(head + 1, bucket + 1):
+        slot = base + 3 + step % size
+        state[base + 1] -= state[slot]
+        state[base + 2] -= state[slot + size]
+        state[slot] = state[slot + size] = 0
+    state[base] = bucket
+
+def _add(state, base, size, width, at, cents):
+    bucket = int(at // width)
+    _advance(state, base, size, bucket)
+    if bucket <= state[base] - size:
+        return  # Older than the window
+    slot = base + 3 + bucket % size
+    state[slot] += 1
+    state[slot + size] += cents
+    state[base + 1] += 1
+    state[base + 2] += cents
+
+def window_add(state, window, at, cents):
+    _add(state, *LAYOUT[window], at, cents)
+
+def window_totals(state, window, at):
+    """ (count, sum of cents) in the window ending at at, touching at most one ring's worth of buckets """
+    base, size, width = LAYOUT[window]
+    _advance(state, base, size, int(at // width))
+    return state[base + 1], state[base + 2]
+
+class RiskEngine:
+    """ Velocity counters per sender, recipient, corridor and requester, scored against config rules.
+    State is per process: with several workers each one enforces the limits on its own traffic. """
+
+    def __init__(self, rules, block_score=100, review_score=50):
+        for rule in rules:
+            if rule["scope"] not in SCOPES or rule["window"] not in WINDOWS:
+                raise ValueError(f"Risk rule {rule.get('name')} needs a scope in {SCOPES} and a window in {tuple(WINDOWS)}")
+        self.rules = [dict(rule, max_cents=round(rule["max_amount"] * 100) if "max_amount" in rule else None) for rule in rules]
+        self.block_score = block_score
+        self.review_score = review_score
+        self.counters = {}  # (scope, key) -> state array
+        self.recorded = 0
+        self._lock = threading.Lock()
+
+    def _keys(self, sender_id, recipient_id, corridor):
+        return {"sender": sender_id, "recipient": recipient_id, "corridor": corridor}
+
+    def score(self, keys, cents, at=None, pending=None):
+        """ Scores one more event of cents against every rule whose scope is in keys.
+        pending maps (scope, key) to (count, cents) of events about to happen that are not recorded yet. """
+        at = at or time.time()
+        pending = pending or {}
+        score, reasons = 0, []
+        with self._lock:
+            for rule in self.rules:
+                key = keys.get(rule["scope"])
+                if key is None:
+                    continue
+                state = self.counters.get((rule["scope"], key))
+                count, total = window_totals(state, rule["window"], at) if state else (0, 0)
+                pending_count, pending_cents = pending.get((rule["scope"], key), (0, 0))
+                count, total = count + pending_count, total + pending_cents
+                if (rule.get("max_count") is not None and count + 1 > rule["max_count"]) or \
+                        (rule["max_cents"] is not None and total + cents > rule["max_cents"]):
+                    score += rule["score"]
+                    reasons.append(rule["name"])
+
+        action = "block" if score >= self.block_score else "review" if score >= self.review_score else "allow"
+        inc("payo_risk_decisions_total", (("action", action),))
+        return Risk(action, score, reasons)
+
+    def record(self, keys, cents, at=None):
+        """ Counts an event that went through """
+        at = at or time.time()
+        with self._lock:
+            for scope, key in keys.items():
+                if key is None:
+                    continue
+                state = self.counters.get((scope, key))
+                if state is None:
+                    state = self.counters[scope, key] = new_state()
+                for base, size, width in LAYOUT.values():
+                    _add(state, base, size, width, at, cents)
+                state[0] = max(state[0], int(at))
+            self.recorded += 1
+            if self.recorded % PRUNE_EVERY == 0:
+                self._prune(at)
+
+    def _prune(self, now):
+        horizon = now - HORIZON
+        for key in [key for key, state in self.counters.items() if state[0] < horizon]:
+            del self.counters[key]
+
+    def check_transfer(self, sender_id, recipient_id, corridor, cents):
+        return self.score(self._keys(sender_id, recipient_id, corridor), cents)
+
+    def check_payouts(self, sender_id, payouts):
+        """ Scores a bulk payout of (recipient_id, corridor, cents) rows. The batch counts once against the
+        payout_sender rules, with its total, never against the per-transfer sender rules. Each row is scored
+        against the recipient and corridor rules as if the rows before it that were not blocked had gone through.
+        Returns (the batch's Risk, one Risk per row). """
+        batch = self.score({"payout_sender": sender_id}, sum(cents for _, _, cents in payouts))
+        pending, risks = {}, []
+        for recipient_id, corridor, cents in payouts:
+            keys = {"recipient": recipient_id, "corridor": corridor}
+            risk = self.score(keys, cents, pending=pending)
+            if risk.action != "block":
+                for scope, key in keys.items():
+                    count, total = pending.get((scope, key), (0, 0))
+                    pending[scope, key] = (count + 1, total + cents)
+            risks.append(risk)
+        return batch, risks
+
+    def record_payouts(self, sender_id, payouts, at=None):
+        """ Counts the sent rows of a bulk payout: one payout_sender event for their total, one recipient and corridor event each """
+        self.record({"payout_sender": sender_id}, sum(cents for _, _, cents in payouts), at)
+        for recipient_id, corridor, cents in payouts:
+            self.record({"recipient": recipient_id, "corridor": corridor}, cents, at)
+
+    def record_transfer(self, sender_id, recipient_id, corridor, cents, at=None):
+        self.record(self._keys(sender_id, recipient_id, corridor), cents, at)
+
+    def check_request(self, requester_id, cents):
+        return self.score({"requester": requester_id}, cents)
+
+    def record_request(self, requester_id, cents, at=None):
+        self.record({"requester": requester_id}, cents, at)
+
+    def rebuild(self, now=None):
+        """ Replays the last day of transfers and money requests into fresh counters. Returns events replayed. """
+        now = now or datetime.utcnow()
+        since = now - timedelta(seconds=HORIZON)
+        with self._lock:
+            self.counters = {}
+
+        sender, recipient = db.aliased(User), db.aliased(User)
+        transfers = db.session.query(
+            Transaction.timestamp, Transaction.sender_id, Transaction.recipient_id, Transaction.amount, Transaction.fee,
+            Transaction.bulk, sender.country, recipient.country
+        ).join(sender, sender.id == Transaction.sender_id).join(recipient, recipient.id == Transaction.recipient_id) \
+            .filter(Transaction.timestamp >= since).order_by(Transaction.timestamp)
+        replayed = 0
+        batches = {}  # (sender_id, timestamp) -> payout rows; every row of a bulk payout shares one timestamp
+        for timestamp, sender_id, recipient_id, amount, fee, bulk, source, destination in transfers.yield_per(1000):
+            # Live transfers count what the sender paid, fee included, so the replay does too
+            cents = round((amount + (fee or 0)) * 100)
+            if bulk:
+                batches.setdefault((sender_id, timestamp), []).append((recipient_id, (source, destination), cents))
+            else:
+                self.record_transfer(sender_id, recipient_id, (source, destination), cents, _epoch(timestamp))
+            replayed += 1
+        for (sender_id, timestamp), payouts in batches.items():
+            self.record_payouts(sender_id, payouts, _epoch(timestamp))
+
+        requests = db.session.query(MoneyRequest.created_at, MoneyRequest.recipient_id, MoneyRequest.amount) \
+            .filter(MoneyRequest.created_at >= since).order_by(MoneyRequest.created_at)
+        for created_at, requester_id, amount in requests.yield_per(1000):
+            self.record_request(requester_id, round(amount * 100), _epoch(created_at))
+            replayed += 1
+        return replayed
+
+def _epoch(timestamp):
+    """ Stored timestamps are naive UTC """
+    return timestamp.replace(tzinfo=timezone.utc).timestamp()
+
+_engine_lock = threading.Lock()
+
+def risk_engine():
+    """ The app's RiskEngine, created from config and replayed from the last day of history on first use """
+    engine = current_app.extensions.get("risk")
+    if engine is None:
+        with _engine_lock:
+            engine = current_app.extensions.get("risk")
+            if engine is None:
+                config = current_app.config
+                engine = RiskEngine(config.get("RISK_RULES", []), config.get("RISK_BLOCK_SCORE", 100), config.get("RISK_REVIEW_SCORE", 50))
+                started = time.perf_counter()
+                replayed = engine.rebuild()
+                print(f"✅ Risk counters rebuilt from {replayed} recent events in {time.perf_counter() - started:.2f}s")
+                current_app.extensions["risk"] = engine
+    return engine
+
+def screen_transfer(sender, recipient, amount_cents):
+    """ Scores a transfer before it runs: raises TransferError when blocked, logs it when it needs review.
+    Returns the counter keys to pass to record_transfer once the transfer has committed. """
+    if not current_app.config.get("RISK_ENABLED", True):
+        return None
+    keys = (sender.id, recipient.id, (sender.country, recipient.country))
+    risk = risk_engine().check_transfer(*keys, amount_cents)
+    if risk.action != "allow":
+        print(f"🚩 Transfer {sender.id} -> {recipient.id} of {amount_cents} cents scored {risk.score} ({risk.action}): {', '.join(risk.reasons)}")
+    if risk.action == "block":
+        raise TransferError("Transfer blocked by our risk checks, please contact support")
+    return keys
+
+def _payouts(sender_country, rows):
+    return [(row["recipient_id"], (sender_country, row["country"]), row["amount_cents"]) for row in rows]
+
+def screen_payouts(sender_id, sender_country, rows):
+    """ screen_transfer for the rows of a bulk payout, which carry recipient_id, country and amount_cents.
+    Blocked rows are marked as errors, every row when the batch itself is blocked. """
+    if not current_app.config.get("RISK_ENABLED", True):
+        return
+    batch, risks = risk_engine().check_payouts(sender_id, _payouts(sender_country, rows))
+    if batch.action != "allow":
+        print(f"🚩 Bulk payout by {sender_id} of {len(rows)} rows scored {batch.score} ({batch.action}): {', '.join(batch.reasons)}")
+    for row, risk in zip(rows, risks):
+        if risk.action != "allow":
+            print(f"🚩 Payout {sender_id} -> {row['recipient_id']} of {row['amount_cents']} cents scored {risk.score} ({risk.action}): {', '.join(risk.reasons)}")
+        if batch.action == "block" or risk.action == "block":
+            row.update(status="error", error="Blocked by our risk checks")
+
+def record_payouts(sender_id, sender_country, rows):
+    """ Counts the committed rows of a bulk payout towards the payout, recipient and corridor limits """
+    if rows and current_app.config.get("RISK_ENABLED", True):
+        risk_engine().record_payouts(sender_id, _payouts(sender_country, rows))
+
+def record_transfer(keys, amount_cents):
+    """ Counts a committed transfer towards its sender, recipient and corridor limits """
+    if keys is not None:
+        risk_engine().record_transfer(*keys, amount_cents)
@@ -1,7 +1,14 @@
-from flask import Blueprint, render_template, request, redirect, url_for, session, flash
+from flask import Blueprint, render_template, request, redirect, url_for, session, flash, jsonify, current_app
+from flask import Response, stream_with_context
 import stripe
-from models import REMITTANCE_FEES
-from models import db, User, Transaction, MoneyRequest, add_block, remove_block, BankAccount
+from models import db, User, MoneyRequest, Deposit, BankAccount, recent_contacts, bump_version
+from models import transaction_page, HISTORY_PAGE_SIZE
+from database import read_session
+from deposits import open_deposit, enqueue_checkout, create_checkout_session, handle_stripe_event
+from transfers import TransferError, to_cents, transfer, withdraw, bulk_transfer, parse_payouts
+from quotes import QuoteError, quote_engine, quote_json
+from statements import statement_period, export
+from risk import screen_transfer, record_transfer, risk_engine
 
 app = Blueprint('app', __name__)
 
@@ -12,11 +19,59 @@ def home():
     if not user_id:
         return redirect(url_for('app.login'))
     
-    user = User.query.get(user_id)
-    pending_requests = MoneyRequest.query.filter_by(sender_email=user.email, status="Pending").all()
-    transactions = Transaction.query.filter((Transaction.sender_id == user_id) | (Transaction.recipient_id == user_id)).all()
-    print(transactions)
-    return render_template('index.html', user=user, pending_requests=pending_requests, transactions=transactions)
+    reader = read_session()
+    user = reader.get(User, user_id)
+    pending_requests = reader.query(MoneyRequest).filter_by(sender_email=user.email, status="Pending").all()
+    transactions, next_cursor = transaction_page(user_id, session=reader)
+    return render_template('index.html', user=user, pending_requests=pending_requests, transactions=transactions, next_cursor=next_cursor)
+
+# ✅ Transaction History
+@app.route('/history')
+def history():
+    user_id = session.get('user_id')
+    if not user_id:
+        return redirect(url_for('app.login'))
+
+    reader = read_session()
+    limit = min(request.args.get('limit', HISTORY_PAGE_SIZE, type=int), 100)
+    transactions, next_cursor = transaction_page(user_id, request.args.get('cursor'), max(limit, 1), session=reader)
+
+    if request.args.get('format') == 'json':
+        return jsonify({
+            "transactions": [{
+                "id": tx.id,
+                "direction": "sent" if tx.sender_id == user_id else "received",
+                "counterparty": tx.recipient.email if tx.sender_id == user_id else tx.sender.email,
+                "amount": tx.amount,
+                "timestamp": tx.timestamp.isoformat()
+            } for tx in transactions],
+            "next_cursor": next_cursor
+        })
+
+    user = reader.get(User, user_id)
+    return render_template('history.html', user=user, transactions=transactions, next_cursor=next_cursor)
+
+# ✅ Statement download, streamed: ?month=2026-09 or ?start=2026-09-01&end=2026-10-01, format=csv|jsonl, gzip=1
+@app.route('/statement')
+def statement():
+    user_id = session.get('user_id')
+    if not user_id:
+        return redirect(url_for('app.login'))
+
+    fmt = request.args.get('format', 'csv')
+    if fmt not in ("csv", "jsonl"):
+        return jsonify({"error": "format must be csv or jsonl"}), 400
+    try:
+        start, end = statement_period(request.args.get('month'), request.args.get('start'), request.args.get('end'))
+    except ValueError:
+        return jsonify({"error": "Use month=YYYY-MM or ISO start/end dates"}), 400
+
+    compress = request.args.get('gzip') == '1'
+    filename = f"statement-{request.args.get('month') or 'all'}.{fmt}" + (".gz" if compress else "")
+    mimetype = "application/gzip" if compress else ("text/csv" if fmt == "csv" else "application/x-ndjson")
+    body = export(user_id, start, end, fmt, compress, session=read_session())
+    return Response(stream_with_context(body), mimetype=mimetype,
+                    headers={"Content-Disposition": f'attachment; filename="{filename}"'})
 
 @app.route('/add_money', methods=['POST'])
 def add_money():
@@ -24,25 +79,46 @@ def add_money():
     if not user_id:
         return redirect(url_for("app.login"))
 
-    amount = int(request.form.get("amount")) * 100  # Convert to cents for Stripe
+    try:
+        amount_cents = to_cents(request.form.get("amount"))  # Cents for Stripe
+    except TransferError as e:
+        flash(f"{e}!", "danger")
+        return redirect(url_for("app.home"))
+
+    deposit = open_deposit(user_id, amount_cents)
+    success_url = url_for("app.add_money_success", _external=True, deposit_id=deposit.id)
+    cancel_url = url_for("app.home", _external=True)  # Redirect home if canceled
+
+    if current_app.config.get("STRIPE_CHECKOUT_INLINE"):
+        # Old behaviour, the worker waits on Stripe before answering
+        try:
+            create_checkout_session(deposit, success_url, cancel_url)
+        except stripe.StripeError as e:
+            db.session.rollback()
+            print(f"⚠️ Stripe error: {e}")
+            flash("Payment provider unavailable, please try again.", "danger")
+            return redirect(url_for("app.home"))
+        db.session.commit()
+        return redirect(deposit.checkout_url, code=303)
 
-    stripe_session = stripe.checkout.Session.create(
-        payment_method_types=["card"],
-        line_items=[{
-            "price_data": {
-                "currency": "usd",
-                "product_data": {"name": "Wallet Deposit"},
-                "unit_amount": amount
-            },
-            "quantity": 1
-        }],
-        mode="payment",
-        success_url=url_for("app.add_money_success", _external=True, amount=amount),
-        cancel_url=url_for("app.home", _external=True)  # Redirect home if canceled
-    )
+    enqueue_checkout(deposit, success_url, cancel_url)
+    db.session.commit()
+    return redirect(url_for("app.deposit_status", deposit_id=deposit.id), code=303)
 
-    return redirect(stripe_session.url, code=303)
+# ✅ Deposit status, polled until the outbox worker has opened the Stripe session
+@app.route('/deposits/<int:deposit_id>')
+def deposit_status(deposit_id):
+    user_id = session.get("user_id")
+    if not user_id:
+        return redirect(url_for("app.login"))
 
+    deposit = Deposit.query.filter_by(id=deposit_id, user_id=user_id).first_or_404()
+    if request.args.get("format") == "json":
+        return jsonify({"id": deposit.id, "status": deposit.status, "amount": deposit.amount_cents / 100,
+                        "checkout_url": deposit.checkout_url})
+    if deposit.status == "open":
+        return redirect(deposit.checkout_url, code=303)
+    return render_template('deposit.html', deposit=deposit)
 
 @app.route('/add_money_success')
 def add_money_success():
@@ -50,41 +126,42 @@ def add_money_success():
     if not user_id:
         return redirect(url_for("app.login"))
 
-    amount = int(request.args.get("amount", 0)) / 100  # Convert cents to dollars
-
-    user = User.query.get(user_id)
-    user.balance += amount
-    db.session.commit()
-
-    flash(f"Successfully added ${amount} to your wallet!", "success")
+    # The balance is credited by the Stripe webhook, never from this redirect's query string
+    deposit = Deposit.query.filter_by(id=request.args.get("deposit_id", type=int), user_id=user_id).first()
+    if deposit and deposit.status == "paid":
+        flash(f"Successfully added ${deposit.amount_cents / 100} to your wallet!", "success")
+    elif deposit:
+        flash(f"Payment received, ${deposit.amount_cents / 100} will appear once Stripe confirms it.", "success")
     return redirect(url_for("app.home"))
 
-@app.route('/payment_success')
-def payment_success():
-    user_id = session.get("user_id")
-    if not user_id:
-        return redirect(url_for("app.login"))
+# ✅ Stripe webhook, the only place deposits are credited
+@app.route('/stripe/webhook', methods=['POST'])
+def stripe_webhook():
+    secret = current_app.config.get("STRIPE_WEBHOOK_SECRET")
+    if not secret:
+        print("⚠️ STRIPE_WEBHOOK_SECRET is not set, refusing webhook")
+        return jsonify({"error": "Webhook signing secret not configured"}), 403
 
-    amount = request.args.get("amount")  # Store the transaction amount safely
-    add_block(user_id, float(amount))  # Add funds to blockchain
-    flash("Funds added successfully!", "success")
-    return redirect(url_for("app.home"))
+    try:
+        event = stripe.Webhook.construct_event(request.get_data(), request.headers.get("Stripe-Signature"), secret)
+        applied = handle_stripe_event(event.to_dict())
+    except (ValueError, stripe.SignatureVerificationError):
+        return jsonify({"error": "Invalid payload"}), 400
+
+    return jsonify({"received": True, "duplicate": not applied}), 200
 
 @app.route('/withdraw_money', methods=['POST'])
 def withdraw_money():
     if 'user_id' not in session:
         return redirect(url_for('app.login'))
 
-    user = User.query.get(session['user_id'])
-    amount = float(request.form['amount'])
-
-    if amount > user.balance:
-        flash("Insufficient balance!", "danger")
-    else:
-        user.balance -= amount
-        db.session.commit()
-        flash("Money withdrawn successfully!", "success")
+    try:
+        withdraw(session['user_id'], to_cents(request.form['amount']))
+    except TransferError as e:
+        flash(f"{e}!", "danger")
+        return redirect(url_for('app.home'))
 
+    flash("Money withdrawn successfully!", "success")
     return redirect(url_for('app.home'))
 
 # ✅ Send Money
@@ -92,40 +169,86 @@ def withdraw_money():
 def send_money():
     sender_id = session.get('user_id')
     recipient_email = request.form['email']
-    amount = float(request.form['amount'])
 
-    sender = User.query.get(sender_id)
     recipient = User.query.filter_by(email=recipient_email).first()
-
     if not recipient:
         print("Recipient not found!", "danger")
         return redirect(url_for('app.payments'))
 
-    if sender.balance < amount:
-        print("Insufficient Balance!", "danger")
+    try:
+        amount_cents = to_cents(request.form['amount'])
+        sender = db.session.get(User, sender_id)
+        quote = quote_engine().quote(amount_cents, sender.country, recipient.country)
+        screened = screen_transfer(sender, recipient, amount_cents)
+        transfer(sender_id, recipient.id, amount_cents, quote.fee_cents)
+    except (TransferError, QuoteError) as e:
+        print(f"{e}!", "danger")
         return redirect(url_for('app.payments'))
-    
-    fee = round(amount * 0.005, 2)
+    record_transfer(screened, amount_cents)
 
-    # Deduct sender balance & add to recipient
-    sender.balance -= amount
-    recipient.balance += amount-fee
-
-    # Apply 0.5% transaction fee
-    
-    remove_block(sender_id, fee)  # Remove fee blocks
-
-    # Update Blockchain
-    remove_block(sender_id, amount)
-    add_block(recipient.id, amount)
-
-    transaction = Transaction(sender_id=sender.id, recipient_id=recipient.id, amount=amount-fee)
-    db.session.add(transaction)
-    db.session.commit()
-
-    print(f"Transaction Successful! Fee deducted: ${fee}", "success")
+    print(f"Transaction Successful! Fee deducted: ${quote.fee_cents / 100}, "
+          f"recipient gets {quote.receive_amount} {quote.currency}", "success")
     return redirect(url_for('app.payments'))
 
+# ✅ Fee and FX quote for one transfer: ?amount=100&email=... or ?amount=100&country=Philippines
+@app.route('/quote')
+def get_quote():
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({"error": "Please log in first"}), 401
+
+    destination = request.args.get('country')
+    if request.args.get('email'):
+        recipient = User.query.filter_by(email=request.args['email']).first()
+        if not recipient:
+            return jsonify({"error": "Recipient not found"}), 404
+        destination = recipient.country
+
+    try:
+        amount_cents = to_cents(request.args.get('amount'))
+        return jsonify(quote_json(quote_engine().quote(amount_cents, db.session.get(User, user_id).country, destination)))
+    except (TransferError, QuoteError) as e:
+        return jsonify({"error": str(e)}), 400
+
+# ✅ Batch quotes: JSON {"quotes": [{"amount": 100, "to": "Philippines", "from": "Qatar"}, ...]}, "from" defaults to the user's country
+@app.route('/quotes', methods=['POST'])
+def batch_quotes():
+    user_id = session.get('user_id')
+    if not user_id:
+        return jsonify({"error": "Please log in first"}), 401
+
+    items = (request.get_json(silent=True) or {}).get('quotes') or []
+    if not isinstance(items, list) or not 0 < len(items) <= 1000:
+        return jsonify({"error": "Send between 1 and 1000 quotes"}), 400
+
+    country = db.session.get(User, user_id).country
+    try:
+        amounts = [to_cents(item.get('amount')) for item in items]
+        corridors = [(item.get('from') or country, item.get('to')) for item in items]
+        return jsonify({"quotes": [quote_json(q) for q in quote_engine().quote_batch(amounts, corridors)]})
+    except (TransferError, QuoteError, AttributeError) as e:
+        return jsonify({"error": str(e)}), 400
+
+# ✅ Bulk Payout (payroll): CSV upload, CSV text or JSON {"payments": [{"email", "amount"}]}
+@app.route('/bulk_send', methods=['POST'])
+def bulk_send():
+    sender_id = session.get('user_id')
+    if not sender_id:
+        return jsonify({"error": "Please log in first"}), 401
+
+    try:
+        if 'file' in request.files:
+            payouts = parse_payouts(request.files['file'].read().decode('utf-8-sig'))
+        elif request.is_json:
+            payouts = (request.get_json(silent=True) or {}).get('payments') or []
+        else:
+            payouts = parse_payouts(request.form.get('csv', ''))
+        report = bulk_transfer(sender_id, payouts)
+    except (TransferError, QuoteError, UnicodeDecodeError, AttributeError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify(report), 200
+
 # ✅ Request Money
 @app.route('/request_money', methods=['POST'])
 def request_money():
@@ -138,9 +261,20 @@ def request_money():
         print("User not found!", "danger")
         return redirect(url_for('app.payments'))
     
+    # Request floods are a common way to phish payers, so requesters get their own velocity limits
+    amount_cents = round(amount * 100)
+    if current_app.config.get("RISK_ENABLED", True):
+        risk = risk_engine().check_request(sender_id, amount_cents)
+        if risk.action == "block":
+            print(f"🚩 Money request by {sender_id} blocked: {', '.join(risk.reasons)}")
+            return redirect(url_for('app.payments'))
+
     money_request = MoneyRequest(sender_email=recipient_email, recipient_id=sender_id, amount=amount)
     db.session.add(money_request)
+    bump_version(recipient.id)  # The payer's pending requests changed
     db.session.commit()
+    if current_app.config.get("RISK_ENABLED", True):
+        risk_engine().record_request(sender_id, amount_cents)
 
     print("Money request sent successfully!", "success")
     return redirect(url_for('app.payments'))
@@ -149,51 +283,29 @@ def request_money():
 @app.route('/accept_request/<int:request_id>')
 def accept_request(request_id):
     user_id = session.get('user_id')
-    user = User.query.get(user_id)
     if not user_id:
         return redirect(url_for('app.login'))
+    user = User.query.get(user_id)
 
     # Retrieve the money request by its ID
     money_request = MoneyRequest.query.get(request_id)
     if not money_request or money_request.sender_email != user.email:
         print("Invalid request!", "danger")
         return redirect(url_for('app.home'))
-    
-    # Current user (session user) is the payer
-    payer = User.query.get(user_id)
-    # The requester (the person who originally requested money) is identified by the sender_email field
-    requester = User.query.get(money_request.recipient_id)
-
-    if not requester:
-        print("Requester not found!", "danger")
-        return redirect(url_for('app.home'))
 
-    if payer.balance < money_request.amount:
-        print("Insufficient balance to fulfill the request!", "danger")
+    # Current user (session user) is the payer, the requester is the request's recipient_id
+    try:
+        amount_cents = to_cents(money_request.amount)
+        requester = db.session.get(User, money_request.recipient_id)
+        if requester is None:
+            raise TransferError("Recipient not found")
+        quote = quote_engine().quote(amount_cents, user.country, requester.country)
+        screened = screen_transfer(user, requester, amount_cents)
+        transfer(user.id, requester.id, amount_cents, quote.fee_cents, money_request_id=money_request.id)
+    except (TransferError, QuoteError) as e:
+        print(f"{e}!", "danger")
         return redirect(url_for('app.home'))
-
-    # Deduct money from the payer and credit the requester
-    payer.balance -= money_request.amount
-    db.session.commit()
-    requester.balance += money_request.amount
-    db.session.commit()
-
-    # Apply a 0.5% transaction fee (for blockchain fee purposes)
-    fee = round(money_request.amount * 0.005, 2)
-    remove_block(requester.id, fee)  # Remove fee blocks from payer
-
-    # # Update Blockchain: remove blocks equal to the requested amount from payer, and add blocks for requester
-    # remove_block(payer.id, money_request.amount)
-    # add_block(requester.id, money_request.amount)
-
-    # Record the transaction (assuming Transaction model exists)
-    transaction = Transaction(sender_id=payer.id, recipient_id=requester.id, amount=money_request.amount)
-    db.session.add(transaction)
-    db.session.commit()
-
-    # Mark the money request as accepted
-    money_request.status = "Accepted"
-    db.session.commit()
+    record_transfer(screened, amount_cents)
 
     print("Money request accepted!", "success")
     return redirect(url_for('app.home'))
@@ -205,15 +317,11 @@ def payments():
     if not user_id:
         return redirect(url_for('app.login'))
     
-    user = User.query.get(user_id)
-    transactions = Transaction.query.filter((Transaction.sender_id == user.id) | (Transaction.recipient_id == user.id)).all()
-    people = set()
-    
-    for tx in transactions:
-        people.add(User.query.get(tx.sender_id))
-        people.add(User.query.get(tx.recipient_id))
+    reader = read_session()
+    user = reader.get(User, user_id)
+    people = recent_contacts(user.id, session=reader)  # History is paged on /history, the page shows contacts only
 
-    return render_template('payments.html', user=user, transactions=transactions, people=people)
+    return render_template('payments.html', user=user, people=people)
 
 COUNTRY_CODES = {
     "Bahrain": "bh", "Kuwait": "kw", "Oman": "om", "Qatar": "qa", "Saudi Arabia": "sa", "United Arab Emirates": "ae",
@@ -233,7 +341,8 @@ def user_page():
         return redirect(url_for('app.login'))
     
     user = User.query.get(user_id)
-    return render_template('user.html', user=user, linked_accounts=banks, fees=REMITTANCE_FEES, country_codes=COUNTRY_CODES)
+    fees = quote_engine().fee_percentages(user.country, COUNTRY_CODES)
+    return render_template('user.html', user=user, linked_accounts=banks, fees=fees, country_codes=COUNTRY_CODES)
 
 # ✅ Login
 @app.route('/login', methods=['GET', 'POST'])
@@ -307,6 +416,7 @@ def link_bank():
             branch_name=branch_name
         )
         db.session.add(new_account)
+        bump_version(user_id)
         db.session.commit()
 
         flash("Bank account linked successfully!", "success")
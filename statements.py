@@ -0,0 +1,145 @@
+import csv
+import heapq
+import io
+import json
+import zlib
+from datetime import datetime, timedelta
+from itertools import chain
+from models import db, User, Transaction, Deposit, Withdrawal
+from archive import archived_statement_rows, archived_net_cents, archived_ledger_rows
+
+CHUNK_SIZE = 1000  # Rows fetched per round trip
+FLUSH_BYTES = 64 * 1024  # Output buffered before each yield
+USER_COLUMNS = ["id", "timestamp", "direction", "counterparty", "amount", "fee", "balance"]
+ALL_COLUMNS = ["id", "timestamp", "sender", "recipient", "amount", "fee"]
+
+def statement_period(month=None, start=None, end=None):
+    """ (start, end) datetimes from a YYYY-MM month or ISO dates, end exclusive; either side may be None """
+    if month:
+        start = datetime.strptime(month, "%Y-%m")
+        end = (start + timedelta(days=32)).replace(day=1)
+        return start, end
+    return (datetime.fromisoformat(start) if start else None, datetime.fromisoformat(end) if end else None)
+
+def _in_period(query, start, end, column=Transaction.timestamp):
+    if start:
+        query = query.filter(column >= start)
+    if end:
+        query = query.filter(column < end)
+    return query
+
+def opening_balance_cents(user_id, start, session=None):
+    """ Net of every transfer, deposit and withdrawal before start, archived transfers included """
+    if start is None:
+        return 0
+    session = session or db.session
+    sent = session.query(db.func.coalesce(db.func.sum(Transaction.amount + Transaction.fee), 0)) \
+        .filter(Transaction.sender_id == user_id, Transaction.timestamp < start).scalar()
+    received = session.query(db.func.coalesce(db.func.sum(Transaction.amount), 0)) \
+        .filter(Transaction.recipient_id == user_id, Transaction.timestamp < start).scalar()
+    deposited = session.query(db.func.coalesce(db.func.sum(Deposit.amount_cents), 0)) \
+        .filter(Deposit.user_id == user_id, Deposit.status == "paid", Deposit.paid_at < start).scalar()
+    withdrawn = session.query(db.func.coalesce(db.func.sum(Withdrawal.amount_cents), 0)) \
+        .filter(Withdrawal.user_id == user_id, Withdrawal.created_at < start).scalar()
+    return round(received * 100) - round(sent * 100) + deposited - withdrawn + archived_net_cents(user_id, start, session)
+
+def statement_rows(user_id, start=None, end=None, session=None):
+    """ A user's transfers, paid deposits and withdrawals oldest first with a running balance, as dicts.
+    Sent and received rows are streamed from their own index in chunks and merged, so memory stays flat.
+    Archived rows join the merge one user frame at a time. Deposits and withdrawals number their own ids,
+    so theirs are written as d-<id> and w-<id>. """
+    session = session or db.session
+    streams = []
+    for own, other in ((Transaction.sender_id, Transaction.recipient_id), (Transaction.recipient_id, Transaction.sender_id)):
+        query = session.query(
+            Transaction.timestamp, Transaction.id, Transaction.sender_id, Transaction.recipient_id,
+            Transaction.amount, Transaction.fee, User.email
+        ).join(User, User.id == other).filter(own == user_id)
+        if own is Transaction.recipient_id:
+            query = query.filter(Transaction.sender_id != user_id)  # Self-transfers already come from the sent side
+        query = _in_period(query, start, end).order_by(Transaction.timestamp, Transaction.id)
+        streams.append(query.execution_options(stream_results=True).yield_per(CHUNK_SIZE))
+    streams.append(archived_statement_rows(user_id, start, end, session))
+    deposits = session.query(Deposit.paid_at, Deposit.id, Deposit.amount_cents).filter(Deposit.user_id == user_id, Deposit.status == "paid")
+    deposits = _in_period(deposits, start, end, Deposit.paid_at).order_by(Deposit.paid_at, Deposit.id) \
+        .execution_options(stream_results=True).yield_per(CHUNK_SIZE)
+    # No sender marks a deposit and no recipient a withdrawal
+    streams.append((paid_at, deposit_id, None, user_id, cents / 100, 0.0, None) for paid_at, deposit_id, cents in deposits)
+    withdrawals = session.query(Withdrawal.created_at, Withdrawal.id, Withdrawal.amount_cents).filter(Withdrawal.user_id == user_id)
+    withdrawals = _in_period(withdrawals, start, end, Withdrawal.created_at).order_by(Withdrawal.created_at, Withdrawal.id) \
+        .execution_options(stream_results=True).yield_per(CHUNK_SIZE)
+    streams.append((created_at, withdrawal_id, user_id, None, cents / 100, 0.0, None) for created_at, withdrawal_id, cents in withdrawals)
+
+    balance = opening_balance_cents(user_id, start, session)
+    for timestamp, transaction_id, sender_id, recipient_id, amount, fee, counterparty in \
+            heapq.merge(*streams, key=lambda row: (row[0], row[1])):
+        amount_cents, fee_cents = round(amount * 100), round((fee or 0) * 100)
+        row_id = transaction_id
+        if sender_id is None:
+            direction, change, row_id = "deposit", amount_cents, f"d-{transaction_id}"
+        elif recipient_id is None:
+            direction, change, row_id = "withdrawal", -amount_cents, f"w-{transaction_id}"
+        elif sender_id != user_id:
+            direction, change = "received", amount_cents
+        elif recipient_id == user_id:
+            direction, change = "self", -fee_cents
+        else:
+            direction, change = "sent", -(amount_cents + fee_cents)
+        balance += change
+        yield {
+            "id": row_id,
+            "timestamp": timestamp.isoformat(),
+            "direction": direction,
+            "counterparty": counterparty,
+            "amount": change / 100,
+            "fee": fee_cents / 100 if sender_id == user_id else 0.0,
+            "balance": balance / 100
+        }
+
+def ledger_rows(start=None, end=None, session=None):
+    """ Every transfer in a period oldest first, for compliance exports across all users.
+    Archived transfers are all older than the table's, so they come first. """
+    session = session or db.session
+    sender, recipient = db.aliased(User), db.aliased(User)
+    query = session.query(Transaction.id, Transaction.timestamp, sender.email, recipient.email, Transaction.amount, Transaction.fee) \
+        .join(sender, sender.id == Transaction.sender_id).join(recipient, recipient.id == Transaction.recipient_id)
+    query = _in_period(query, start, end).order_by(Transaction.timestamp, Transaction.id)
+    hot = ({"id": transaction_id, "timestamp": timestamp.isoformat(), "sender": sender_email,
+            "recipient": recipient_email, "amount": amount, "fee": fee or 0.0}
+           for transaction_id, timestamp, sender_email, recipient_email, amount, fee in
+           query.execution_options(stream_results=True).yield_per(CHUNK_SIZE))
+    return chain(archived_ledger_rows(start, end, session), hot)
+
+def encode(rows, columns, fmt="csv"):
+    """ Serializes row dicts to CSV or JSON lines, yielding text in roughly FLUSH_BYTES pieces """
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns) if fmt == "csv" else None
+    if writer:
+        writer.writeheader()
+    for row in rows:
+        if writer:
+            writer.writerow(row)
+        else:
+            buffer.write(json.dumps(row) + "\n")
+        if buffer.tell() >= FLUSH_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def gzip_stream(chunks):
+    """ Compresses text chunks into a gzip stream as they are produced """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 writes the gzip header and trailer
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+def export(user_id=None, start=None, end=None, fmt="csv", compress=False, session=None):
+    """ The whole statement as an iterator of bytes, ready to stream to a response or a file """
+    if user_id is None:
+        chunks = encode(ledger_rows(start, end, session), ALL_COLUMNS, fmt)
+    else:
+        chunks = encode(statement_rows(user_id, start, end, session), USER_COLUMNS, fmt)
+    return gzip_stream(chunks) if compress else (chunk.encode() for chunk in chunks)
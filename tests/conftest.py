@@ -0,0 +1,69 @@
+import os
+import sys
+import tempfile
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# config.py reads these when main is imported, so they are set first
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.db')}"
+os.environ.pop("DATABASE_READ_URL", None)
+
+from main import app as payo_app  # noqa: E402
+from models import db, User, add_block, upgrade_schema  # noqa: E402
+
+@pytest.fixture
+def app(tmp_path):
+    """ The Payo app on an empty database, config changes undone after each test """
+    config = dict(payo_app.config)
+    payo_app.config.update(TESTING=True, ARCHIVE_DIR=str(tmp_path / "archive"), STRIPE_WEBHOOK_SECRET="whsec_test")
+    payo_app.extensions.pop("risk", None)
+    with payo_app.app_context():
+        db.drop_all()
+        db.create_all()
+        upgrade_schema()
+        yield payo_app
+        db.session.remove()
+    payo_app.extensions.pop("risk", None)
+    payo_app.config.clear()
+    payo_app.config.update(config)
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture
+def make_user(app):
+    """ Creates a user with a balance in cents, returns its id """
+    count = iter(range(1, 10 ** 6))
+
+    def make(balance_cents=0, country="Qatar", email=None):
+        number = next(count)
+        user = User(username=f"user{number}", email=email or f"user{number}@example.com", password="x",
+                    country=country, balance_cents=balance_cents)
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+    return make
+
+@pytest.fixture
+def funded(make_user):
+    """ Creates a user whose balance and ledger both hold cents, returns its id """
+    def make(cents, **kwargs):
+        user_id = make_user(balance_cents=cents, **kwargs)
+        add_block(user_id, cents)
+        return user_id
+    return make
+
+@pytest.fixture
+def balance(app):
+    """ Reads a user's balance in cents as committed, not as cached in the session """
+    def read(user_id):
+        db.session.expire_all()
+        return db.session.get(User, user_id).balance_cents
+    return read
+
+def login(client, user_id):
+    with client.session_transaction() as session:
+        session["user_id"] = user_id
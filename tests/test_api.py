@@ -0,0 +1,72 @@
+import gzip
+import json
+from models import db, User, Transaction
+from transfers import credit
+from conftest import login
+
+def etag(response):
+    return response.headers["ETag"].strip('"')
+
+def test_unchanged_resource_is_a_304(client, make_user):
+    user_id = make_user(balance_cents=1234)
+    login(client, user_id)
+
+    first = client.get("/api/v1/balance")
+    again = client.get("/api/v1/balance", headers={"If-None-Match": first.headers["ETag"]})
+
+    assert first.status_code == 200 and first.json["balance_cents"] == 1234
+    assert again.status_code == 304 and again.data == b"" and etag(again) == etag(first)
+
+def test_credit_changes_the_etag(client, make_user):
+    user_id = make_user(balance_cents=1000)
+    login(client, user_id)
+    before = client.get("/api/v1/balance")
+
+    credit(user_id, 500)
+    db.session.commit()
+    after = client.get("/api/v1/balance", headers={"If-None-Match": before.headers["ETag"]})
+
+    assert after.status_code == 200 and after.json["balance_cents"] == 1500
+    assert etag(after) != etag(before)
+
+def test_request_money_bumps_the_payers_version(client, make_user):
+    payer_id, requester_id = make_user(), make_user()
+    login(client, payer_id)
+    before = client.get("/api/v1/requests")
+    assert before.json == {"requests": []}
+
+    login(client, requester_id)
+    client.post("/request_money", data={"email": db.session.get(User, payer_id).email, "amount": "12.50"})
+    login(client, payer_id)
+    after = client.get("/api/v1/requests", headers={"If-None-Match": before.headers["ETag"]})
+
+    assert after.status_code == 200 and [row["amount"] for row in after.json["requests"]] == [12.5]
+
+def test_link_bank_bumps_the_version(client, make_user):
+    user_id = make_user()
+    login(client, user_id)
+    before = client.get("/api/v1/bank_accounts")
+
+    client.post("/link_bank", data={"bank_name": "QNB", "account_number": "1234567890", "ifsc_code": "QNB0001",
+                                    "account_type": "Savings", "branch_name": "Doha"})
+    after = client.get("/api/v1/bank_accounts", headers={"If-None-Match": before.headers["ETag"]})
+
+    assert after.status_code == 200
+    assert [account["account_number"] for account in after.json["bank_accounts"]] == ["••••••7890"]
+
+def test_gzip_body_has_its_own_etag(app, client, make_user):
+    app.config["API_COMPRESS_MIN_BYTES"] = 0
+    user_id, other_id = make_user(), make_user()
+    db.session.add(Transaction(sender_id=user_id, recipient_id=other_id, amount=5.0))
+    db.session.commit()
+    login(client, user_id)
+
+    plain = client.get("/api/v1/transactions")
+    packed = client.get("/api/v1/transactions", headers={"Accept-Encoding": "gzip"})
+    revalidated = client.get("/api/v1/transactions", headers={"Accept-Encoding": "gzip", "If-None-Match": packed.headers["ETag"]})
+
+    assert "Content-Encoding" not in plain.headers
+    assert packed.headers["Content-Encoding"] == "gzip" and etag(packed) == etag(plain) + "-gzip"
+    assert json.loads(gzip.decompress(packed.data)) == plain.json
+    assert revalidated.status_code == 304 and etag(revalidated) == etag(packed)
+    assert "Accept-Encoding" in packed.headers["Vary"]
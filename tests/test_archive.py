@@ -0,0 +1,37 @@
+from datetime import datetime, timedelta
+from archive import archive_blocks
+from audit import check_chain, verify_chain
+from models import db, Block, add_block, remove_block, chain_head, chain_total, archived_tail
+
+def archived_unit_chain(app, user_id, cents):
+    """ A unit-mode chain whose blocks below the checkpoint have all moved to the archive """
+    app.config["LEDGER_MODE"] = "unit"
+    add_block(user_id, cents)
+    db.session.execute(db.update(Block).where(Block.user_id == user_id).values(timestamp=datetime.utcnow() - timedelta(days=400)))
+    db.session.commit()
+    verify_chain(user_id)
+    archive_blocks(datetime.utcnow() - timedelta(days=365))
+
+def test_debit_down_to_the_archived_prefix_keeps_the_link(app, make_user):
+    user_id = make_user()
+    archived_unit_chain(app, user_id, 500)
+    last_index = archived_tail(user_id)[0]
+    assert [block.index for block in Block.query.filter_by(user_id=user_id)] == [last_index + 1]
+
+    assert remove_block(user_id, 100)  # Deletes every hot block, the head rests on the archive
+
+    head = chain_head(user_id)
+    assert (head.last_index, head.last_hash) == archived_tail(user_id)
+    add_block(user_id, 250)
+    assert chain_total(user_id) == chain_head(user_id).total_cents == 650
+    assert check_chain(user_id, full=True)["ok"]
+
+def test_debit_past_the_archived_prefix_is_refused(app, make_user):
+    user_id = make_user()
+    archived_unit_chain(app, user_id, 500)
+
+    assert not remove_block(user_id, 200)  # Only the 1 USD checkpoint block is still hot
+    db.session.rollback()
+
+    assert chain_total(user_id) == 500
+    assert check_chain(user_id, full=True)["ok"]
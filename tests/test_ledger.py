@@ -0,0 +1,88 @@
+from audit import check_chain
+from models import db, User, Block, add_block, remove_block, compact_blocks, chain_head, chain_total
+from transfers import transfer
+
+def blocks(user_id):
+    return [(block.data, block.amount_cents) for block in Block.query.filter_by(user_id=user_id).order_by(Block.index)]
+
+def test_transfers_keep_balance_and_ledger_equal_to_the_cent(app, make_user):
+    sender_id, recipient_id = make_user(), make_user()
+    add_block(sender_id, 10000)
+    db.session.get(User, sender_id).balance_cents = 10000
+    db.session.commit()
+
+    for _ in range(9):
+        transfer(sender_id, recipient_id, 1075)
+
+    db.session.expire_all()
+    assert db.session.get(User, sender_id).balance_cents == chain_total(sender_id) == 325
+    assert db.session.get(User, recipient_id).balance_cents == chain_total(recipient_id) == 9675
+    assert chain_head(sender_id).total_cents == 325
+    assert [data for data, _ in blocks(recipient_id)][:1] == ["Added 10.75 USD"]
+
+def test_unit_mode_credits_leftover_cents(app, make_user):
+    app.config["LEDGER_MODE"] = "unit"
+    user_id = make_user()
+    add_block(user_id, 275)
+
+    assert blocks(user_id) == [("Added 1 USD", 100), ("Added 1 USD", 100), ("Added 0.75 USD", 75)]
+    assert remove_block(user_id, 130)
+    assert chain_total(user_id) == chain_head(user_id).total_cents == 145
+    assert check_chain(user_id, full=True)["ok"]
+
+def test_unit_debit_after_compaction_removes_the_amount(app, make_user):
+    app.config["LEDGER_MODE"] = "unit"
+    user_id = make_user()
+    add_block(user_id, 500)
+    add_block(user_id, 300)
+    compact_blocks(user_id)
+    assert blocks(user_id) == [("Added 8 USD", 800)]
+
+    assert remove_block(user_id, 300)  # Used to delete three indices, taking the whole 8 USD segment
+
+    assert chain_total(user_id) == chain_head(user_id).total_cents == 500
+    assert blocks(user_id) == [("Added 1 USD", 100)] * 5
+    assert check_chain(user_id, full=True)["ok"]
+
+def test_unit_debit_gives_change_as_unit_blocks(app, make_user):
+    user_id = make_user()
+    add_block(user_id, 1000)
+    app.config["LEDGER_MODE"] = "unit"
+
+    assert remove_block(user_id, 300)
+
+    assert blocks(user_id) == [("Added 1 USD", 100)] * 7
+    assert chain_total(user_id) == chain_head(user_id).total_cents == 700
+    assert check_chain(user_id, full=True)["ok"]
+
+def test_unit_debit_past_a_segment_debit(app, make_user):
+    user_id = make_user()
+    add_block(user_id, 1000)
+    remove_block(user_id, 400)  # Segment mode appends a -400 block
+    app.config["LEDGER_MODE"] = "unit"
+
+    assert remove_block(user_id, 500)
+
+    assert chain_total(user_id) == chain_head(user_id).total_cents == 100
+    assert check_chain(user_id, full=True)["ok"]
+
+def test_unit_debit_larger_than_the_chain_changes_nothing(app, make_user):
+    app.config["LEDGER_MODE"] = "unit"
+    user_id = make_user()
+    add_block(user_id, 200)
+
+    assert not remove_block(user_id, 300)
+    db.session.rollback()
+    assert chain_total(user_id) == 200
+
+def test_verification_catches_an_edited_amount(app, make_user):
+    user_id = make_user()
+    add_block(user_id, 1075)
+    remove_block(user_id, 75)
+    assert check_chain(user_id, full=True)["ok"]
+
+    db.session.execute(db.update(Block).where(Block.user_id == user_id, Block.index == 1).values(amount_cents=107500))
+    db.session.commit()
+
+    result = check_chain(user_id, full=True)
+    assert not result["ok"] and result["bad_index"] == 1
@@ -0,0 +1,29 @@
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "v1"))
+from merkle import merkle_root, merkle_proof, verify_proof  # noqa: E402
+
+def transactions(count):
+    return [{"sender": "a", "receiver": "b", "amount": amount} for amount in range(count)]
+
+def test_duplicated_trailing_transaction_changes_the_root():
+    a, b, c = transactions(3)
+    assert merkle_root([a, b, c]) != merkle_root([a, b, c, c])
+    assert merkle_root([a, b]) != merkle_root([a, b, b])
+
+def test_every_position_verifies():
+    for count in range(1, 12):
+        block = transactions(count)
+        root = merkle_root(block)
+        for position, transaction in enumerate(block):
+            assert verify_proof(transaction, position, count, merkle_proof(block, position), root)
+
+def test_proofs_do_not_verify_elsewhere():
+    a, b, c = transactions(3)
+    root, proof = merkle_root([a, b, c]), merkle_proof([a, b, c], 2)
+
+    assert not verify_proof(c, 3, 4, proof, merkle_root([a, b, c, c]))  # The duplicated leaf of [a, b, c, c]
+    assert not verify_proof(c, 2, 4, proof, root)  # Wrong count
+    assert not verify_proof(c, 1, 3, proof, root)  # Wrong position
+    assert not verify_proof(c, 2, 3, proof + proof, root)  # Extra hashes
+    assert not verify_proof(c, 2, 3, [], root)
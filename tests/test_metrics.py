@@ -0,0 +1,25 @@
+import pytest
+from sqlalchemy.exc import OperationalError
+import metrics
+from models import db, User
+
+def calls(phase):
+    return metrics._counters.get(("payo_phase_calls_total", (("phase", phase),)), 0)
+
+def test_sampled_calls_are_counted_in_full(app):
+    @metrics.timed("test_sampled", sample=4)
+    def work(value):
+        return value * 2
+
+    assert [work(n) for n in range(8)] == [n * 2 for n in range(8)]
+    assert calls("test_sampled") == 8
+
+def test_failed_statement_clears_its_start_time(app):
+    before = calls("sql")
+    with db.engine.connect() as conn:
+        with pytest.raises(OperationalError):
+            conn.exec_driver_sql("SELECT * FROM no_such_table")
+        assert "query_started" not in conn.info
+        assert conn.exec_driver_sql("SELECT 1").scalar() == 1
+    assert calls("sql") == before + 2
+    assert User.query.count() == 0
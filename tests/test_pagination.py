@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta
+from sqlalchemy import event
+from archive import archive_transactions
+from models import db, Transaction, transaction_page
+from conftest import login
+
+def walk(user_id, limit):
+    """ Ids of every page, following cursors until there is no next one """
+    pages, cursor = [], None
+    while True:
+        transactions, cursor = transaction_page(user_id, cursor, limit)
+        pages.append([transaction.id for transaction in transactions])
+        if not cursor:
+            return pages
+        assert len(pages) < 10, "cursor did not advance"
+
+def test_rows_sharing_a_second_page_through(app, make_user):
+    sender_id, recipient_id = make_user(), make_user()
+    # The server default stores "YYYY-MM-DD HH:MM:SS", so all five share one timestamp
+    db.session.execute(db.insert(Transaction), [{"sender_id": sender_id, "recipient_id": recipient_id, "amount": 1.0, "fee": 0.0}] * 5)
+    db.session.commit()
+
+    assert walk(sender_id, 2) == [[5, 4], [3, 2], [1]]
+
+def test_orm_and_default_timestamps_page_together(app, make_user):
+    sender_id, recipient_id = make_user(), make_user()
+    now = datetime.utcnow().replace(microsecond=0)
+    db.session.add_all([Transaction(sender_id=sender_id, recipient_id=recipient_id, amount=1.0, timestamp=now - timedelta(seconds=1)),
+                        Transaction(sender_id=recipient_id, recipient_id=sender_id, amount=1.0, timestamp=now - timedelta(seconds=1)),
+                        Transaction(sender_id=sender_id, recipient_id=sender_id, amount=1.0, timestamp=now - timedelta(seconds=1))])
+    db.session.commit()
+    db.session.execute(db.insert(Transaction), [{"sender_id": sender_id, "recipient_id": recipient_id, "amount": 1.0, "fee": 0.0}] * 2)
+    db.session.commit()
+
+    assert sum(walk(sender_id, 2), []) == [5, 4, 3, 2, 1]  # The self-transfer is listed once
+
+def test_pages_continue_into_the_archive(app, make_user):
+    sender_id, recipient_id = make_user(), make_user()
+    old = datetime.utcnow() - timedelta(days=400)
+    db.session.add_all([Transaction(sender_id=sender_id, recipient_id=recipient_id, amount=1.0, timestamp=old) for _ in range(3)])
+    db.session.execute(db.insert(Transaction), [{"sender_id": sender_id, "recipient_id": recipient_id, "amount": 1.0, "fee": 0.0}] * 2)
+    db.session.commit()
+    archive_transactions(datetime.utcnow() - timedelta(days=365))
+
+    assert Transaction.query.count() == 2
+    assert walk(sender_id, 2) == [[5, 4], [3, 2], [1]]
+
+def test_history_json_follows_cursors(client, make_user):
+    sender_id, recipient_id = make_user(), make_user()
+    db.session.execute(db.insert(Transaction), [{"sender_id": sender_id, "recipient_id": recipient_id, "amount": 1.0, "fee": 0.0}] * 3)
+    db.session.commit()
+    login(client, sender_id)
+
+    first = client.get("/history?format=json&limit=2").json
+    second = client.get(f"/history?format=json&limit=2&cursor={first['next_cursor']}").json
+
+    assert [tx["id"] for tx in first["transactions"] + second["transactions"]] == [3, 2, 1]
+    assert second["next_cursor"] is None
+
+def test_payments_page_does_not_load_history(client, make_user):
+    sender_id, recipient_id = make_user(), make_user()
+    db.session.execute(db.insert(Transaction), [{"sender_id": sender_id, "recipient_id": recipient_id, "amount": 1.0, "fee": 0.0}] * 3)
+    db.session.commit()
+    login(client, sender_id)
+    statements = []
+
+    @event.listens_for(db.engine, "before_cursor_execute")
+    def seen(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    try:
+        assert client.get("/payments").status_code == 200
+    finally:
+        event.remove(db.engine, "before_cursor_execute", seen)
+    assert not [statement for statement in statements if '"transaction"' in statement]
@@ -0,0 +1,114 @@
+from decimal import Decimal
+import pytest
+import quotes
+from quotes import QuoteEngine, QuoteError, StaticRateSource
+
+TABLE = {
+    "fees": [
+        {"rate": 0.02, "fixed_cents": 0},
+        {"from": "Qatar", "rate": 0.015},
+        {"to": "Philippines", "rate": 0.01},
+        {"from": "Qatar", "to": "Philippines", "rate": 0.005},
+        {"from": "Oman", "to": "Laos", "rate": 0.01, "fixed_cents": 50, "min_cents": 200, "max_cents": 1000},
+    ],
+    "rates": {"PHP": 56.5},
+    "currencies": {"Philippines": "PHP"},
+}
+
+class CountingSource(StaticRateSource):
+    """ A static table that counts loads and can be made to fail """
+
+    def __init__(self, data):
+        super().__init__(data)
+        self.loads = 0
+        self.error = None
+
+    def load(self):
+        self.loads += 1
+        if self.error:
+            raise self.error
+        return self.data
+
+@pytest.fixture
+def clock(monkeypatch):
+    """ A monotonic clock the test moves by hand """
+    now = [1000.0]
+    monkeypatch.setattr(quotes.time, "monotonic", lambda: now[0])
+    return now
+
+def test_corridor_precedence():
+    engine = QuoteEngine(StaticRateSource(TABLE))
+
+    assert engine.quote(10000, "Qatar", "Philippines").fee_cents == 50  # from/to
+    assert engine.quote(10000, "Qatar", "Laos").fee_cents == 150  # from/*
+    assert engine.quote(10000, "Oman", "Philippines").fee_cents == 100  # */to
+    assert engine.quote(10000, "Kuwait", "Laos").fee_cents == 200  # */*
+
+def test_min_max_and_fixed_fees_are_clamped():
+    engine = QuoteEngine(StaticRateSource(TABLE))
+
+    assert engine.quote(1000, "Oman", "Laos").fee_cents == 200  # 10 + 50 fixed, raised to the minimum
+    assert engine.quote(50000, "Oman", "Laos").fee_cents == 550  # 500 + 50 fixed
+    assert engine.quote(1000000, "Oman", "Laos").fee_cents == 1000  # 10000 + 50 fixed, capped at the maximum
+
+def test_quote_converts_the_net_amount():
+    quote = QuoteEngine(StaticRateSource(TABLE)).quote(10000, "Qatar", "Philippines")
+
+    assert (quote.net_cents, quote.currency, quote.receive_amount) == (9950, "PHP", Decimal("5621.75"))
+
+def test_table_needs_a_default_fee():
+    engine = QuoteEngine(StaticRateSource({"fees": [{"from": "Qatar", "rate": 0.01}]}))
+
+    with pytest.raises(QuoteError):
+        engine.quote(100, "Qatar", "Oman")
+
+def test_table_reloads_after_its_ttl(clock):
+    source = CountingSource(TABLE)
+    engine = QuoteEngine(source, ttl=300)
+    engine.quote(100, "Qatar", "Oman")
+    clock[0] += 299
+    engine.quote(100, "Qatar", "Oman")
+    assert source.loads == 1
+
+    source.data = dict(TABLE, fees=[{"rate": 0.1}])
+    clock[0] += 1
+
+    assert engine.quote(10000, "Qatar", "Oman").fee_cents == 1000
+    assert source.loads == 2
+
+def test_failed_reload_keeps_the_previous_table(clock):
+    source = CountingSource(TABLE)
+    engine = QuoteEngine(source, ttl=300, retry=30)
+    engine.quote(100, "Qatar", "Oman")
+    source.error = OSError("rates unavailable")
+    clock[0] += 300
+
+    assert engine.quote(10000, "Kuwait", "Laos").fee_cents == 200
+    clock[0] += 29
+    engine.quote(100, "Qatar", "Oman")
+    assert source.loads == 2  # No retry before the retry interval
+
+    source.error = None
+    source.data = dict(TABLE, fees=[{"rate": 0.1}])
+    clock[0] += 1
+    assert engine.quote(10000, "Kuwait", "Laos").fee_cents == 1000
+
+def test_first_load_failure_is_a_quote_error():
+    source = CountingSource(TABLE)
+    source.error = ValueError("bad json")
+
+    with pytest.raises(QuoteError):
+        QuoteEngine(source).quote(100, "Qatar", "Oman")
+
+def test_quote_batch_with_one_corridor_or_a_list():
+    engine = QuoteEngine(StaticRateSource(TABLE))
+    amounts = [10000, 20000, 30000]
+
+    single = engine.quote_batch(amounts, ("Qatar", "Philippines"))
+    parallel = engine.quote_batch(amounts, [("Qatar", "Philippines"), ("Qatar", "Laos"), ("Kuwait", "Laos")])
+
+    assert [quote.fee_cents for quote in single] == [50, 100, 150]
+    assert [quote.fee_cents for quote in parallel] == [50, 300, 600]
+    assert [quote.currency for quote in parallel] == ["PHP", "USD", "USD"]
+    with pytest.raises(QuoteError):
+        engine.quote_batch(amounts, [("Qatar", "Philippines")])
@@ -0,0 +1,32 @@
+import csv
+import io
+from models import db, User, add_block
+from reconcile import reconcile
+from transfers import transfer, withdraw
+
+def report(full=True):
+    out = io.StringIO()
+    run = reconcile(out, full=full)
+    return run, list(csv.DictReader(io.StringIO(out.getvalue())))
+
+def test_transfers_with_cents_reconcile_exactly(app, make_user):
+    sender_id, recipient_id = make_user(balance_cents=10001), make_user()
+    add_block(sender_id, 10001)
+    for cents in (1, 99, 1075, 333):
+        transfer(sender_id, recipient_id, cents, fee_cents=cents // 10)
+    withdraw(recipient_id, 7)
+
+    run, rows = report()
+
+    assert (run.users_checked, run.discrepancies, rows) == (2, 0, [])
+
+def test_a_single_cent_of_drift_is_reported(app, make_user):
+    user_id = make_user(balance_cents=1000)
+    add_block(user_id, 1000)
+    db.session.execute(db.update(User).where(User.id == user_id).values(balance_cents=1001))
+    db.session.commit()
+
+    run, rows = report()
+
+    assert run.discrepancies == 1
+    assert (rows[0]["difference_cents"], rows[0]["issue"]) == ("1", "balance_mismatch")
@@ -0,0 +1,77 @@
+import time
+from models import db, User
+from risk import risk_engine, window_totals
+from transfers import transfer, bulk_transfer
+
+def totals(scope, key, window="24h"):
+    state = risk_engine().counters.get((scope, key))
+    return window_totals(state, window, time.time()) if state else (0, 0)
+
+def payees(make_user, count):
+    emails = [f"payee{n}@example.com" for n in range(count)]
+    for email in emails:
+        make_user(email=email)
+    return emails
+
+def test_payroll_goes_through(app, make_user, funded):
+    sender_id = funded(5000000)
+    emails = payees(make_user, 40)
+
+    # 40 rows in one minute and $24,000 in total, past both per-transfer sender_burst and sender_daily_amount
+    report = bulk_transfer(sender_id, [{"email": email, "amount": "600"} for email in emails])
+
+    assert (report["sent"], report["failed"]) == (40, 0)
+    assert db.session.get(User, sender_id).balance_cents == 5000000 - 2400000
+    assert totals("payout_sender", sender_id) == (1, 2400000)
+    assert totals("sender", sender_id) == (0, 0)  # The employer's own transfers keep their limits
+    assert risk_engine().check_transfer(sender_id, 99, ("Qatar", "Qatar"), 100).action == "allow"
+
+def test_batches_count_once_against_payout_limits(app, make_user, funded):
+    app.config["RISK_RULES"] = [{"name": "one_batch", "scope": "payout_sender", "window": "1h", "max_count": 1, "score": 100}]
+    sender_id = funded(100000)
+    emails = payees(make_user, 7)
+
+    first = bulk_transfer(sender_id, [{"email": email, "amount": "10"} for email in emails])
+    second = bulk_transfer(sender_id, [{"email": email, "amount": "10"} for email in emails])
+
+    assert first["sent"] == 7
+    assert second["sent"] == 0 and {row["error"] for row in second["rows"]} == {"Blocked by our risk checks"}
+
+def test_rows_are_screened_against_each_other(app, make_user, funded):
+    app.config["RISK_RULES"] = [{"name": "fan_in", "scope": "recipient", "window": "1h", "max_count": 2, "score": 100}]
+    sender_id = funded(100000)
+    payees(make_user, 2)
+
+    report = bulk_transfer(sender_id, [{"email": email, "amount": "10"} for email in
+                                       ("payee0@example.com", "payee1@example.com", "payee0@example.com", "payee0@example.com")])
+
+    assert [row["status"] for row in report["rows"]] == ["sent", "sent", "sent", "error"]
+
+def test_blocked_bulk_rows_are_not_recorded(app, make_user, funded):
+    sender_id = funded(10000)
+    make_user(email="a@example.com")
+
+    report = bulk_transfer(sender_id, [{"email": "a@example.com", "amount": "60"}, {"email": "a@example.com", "amount": "60"}])
+
+    assert report["sent"] == 0  # Both pass the risk checks, together they exceed the balance
+    assert totals("payout_sender", sender_id) == (0, 0)
+
+def test_rebuild_replays_what_the_live_path_records(app, make_user, funded):
+    sender_id, recipient_id = funded(100000), make_user(email="a@example.com")
+    risk_engine()  # Built before the transfers, as in a running app
+    transfer(sender_id, recipient_id, 2500, fee_cents=125)
+    risk_engine().record_transfer(sender_id, recipient_id, ("Qatar", "Qatar"), 2500)  # What send_money records
+    bulk_transfer(sender_id, [{"email": "a@example.com", "amount": "10"}, {"email": "a@example.com", "amount": "20.50"}])
+    live = [totals(scope, key) for scope, key in (("sender", sender_id), ("payout_sender", sender_id), ("recipient", recipient_id))]
+
+    risk_engine().rebuild()
+
+    assert [totals(scope, key) for scope, key in (("sender", sender_id), ("payout_sender", sender_id), ("recipient", recipient_id))] \
+        == live == [(1, 2500), (1, 3050), (3, 5550)]
+
+def test_engine_is_rebuilt_on_first_use(app, make_user, funded):
+    sender_id, recipient_id = funded(10000), make_user()
+    transfer(sender_id, recipient_id, 1000)
+    app.extensions.pop("risk", None)
+
+    assert totals("sender", sender_id) == (1, 1000)
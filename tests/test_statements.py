@@ -0,0 +1,43 @@
+from datetime import datetime, timedelta
+from models import db, User, Deposit, add_block, chain_total
+from statements import statement_rows
+from transfers import transfer, withdraw
+from conftest import login
+
+def deposit(user_id, cents, paid_at):
+    """ A paid deposit, credited the way the webhook credits it """
+    db.session.add(Deposit(user_id=user_id, amount_cents=cents, status="paid", paid_at=paid_at))
+    db.session.execute(db.update(User).where(User.id == user_id).values(balance_cents=User.balance_cents + cents))
+    add_block(user_id, cents)
+
+def test_running_balance_includes_deposits_and_withdrawals(app, make_user):
+    user_id, friend_id = make_user(), make_user()
+    deposit(user_id, 10000, datetime.utcnow() - timedelta(minutes=1))
+    transfer(user_id, friend_id, 2500, fee_cents=100)
+    withdraw(user_id, 1500)
+
+    rows = list(statement_rows(user_id))
+
+    assert [(row["id"], row["direction"], row["amount"], row["balance"]) for row in rows] == [
+        ("d-1", "deposit", 100.0, 100.0), (1, "sent", -25.0, 75.0), ("w-1", "withdrawal", -15.0, 60.0)]
+    assert db.session.get(User, user_id).balance_cents == chain_total(user_id) == 6000
+
+def test_opening_balance_counts_earlier_deposits_and_withdrawals(app, make_user):
+    user_id = make_user()
+    deposit(user_id, 5000, datetime.utcnow() - timedelta(days=40))
+    withdraw(user_id, 1000)
+
+    rows = list(statement_rows(user_id, start=datetime.utcnow() - timedelta(days=1)))
+
+    assert [(row["direction"], row["balance"]) for row in rows] == [("withdrawal", 40.0)]
+
+def test_withdraw_route_debits_balance_and_ledger(client, make_user):
+    user_id = make_user()
+    deposit(user_id, 5000, datetime.utcnow())
+    login(client, user_id)
+
+    client.post("/withdraw_money", data={"amount": "12.34"})
+    client.post("/withdraw_money", data={"amount": "100"})  # More than the balance, refused
+
+    db.session.expire_all()
+    assert db.session.get(User, user_id).balance_cents == chain_total(user_id) == 3766
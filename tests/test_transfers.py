@@ -0,0 +1,88 @@
+from datetime import datetime
+import pytest
+from models import db, User, Transaction, MoneyRequest, add_block, chain_total
+from transfers import TransferError, transfer, bulk_transfer
+
+def test_transfer_moves_balances_fee_and_ledger(app, make_user, funded, balance):
+    sender_id, recipient_id = funded(10000), make_user()
+
+    transaction = transfer(sender_id, recipient_id, 2500, fee_cents=100)
+
+    assert (transaction.amount, transaction.fee) == (24.0, 1.0)
+    assert balance(sender_id) == chain_total(sender_id) == 7500
+    assert balance(recipient_id) == chain_total(recipient_id) == 2400
+
+def test_insufficient_balance_changes_nothing(app, make_user, funded, balance):
+    sender_id, recipient_id = funded(1000), make_user()
+
+    with pytest.raises(TransferError, match="Insufficient balance"):
+        transfer(sender_id, recipient_id, 1001)
+
+    assert balance(sender_id) == chain_total(sender_id) == 1000
+    assert balance(recipient_id) == 0 and Transaction.query.count() == 0
+
+def test_ledger_shortfall_rolls_the_transfer_back(app, make_user, balance):
+    app.config["LEDGER_MODE"] = "unit"
+    sender_id, recipient_id = make_user(balance_cents=1000), make_user()
+    add_block(sender_id, 200)  # The ledger holds less than the balance
+
+    with pytest.raises(TransferError, match="Ledger"):
+        transfer(sender_id, recipient_id, 500)
+
+    assert balance(sender_id) == 1000 and balance(recipient_id) == 0
+    assert chain_total(sender_id) == 200 and chain_total(recipient_id) == 0
+    assert Transaction.query.count() == 0
+
+def test_money_request_is_paid_once(app, make_user, funded, balance):
+    sender_id, recipient_id = funded(1000), make_user()
+    request = MoneyRequest(sender_email=db.session.get(User, recipient_id).email, recipient_id=sender_id, amount=3.0)
+    db.session.add(request)
+    db.session.commit()
+
+    transfer(sender_id, recipient_id, 300, money_request_id=request.id)
+    with pytest.raises(TransferError, match="already handled"):
+        transfer(sender_id, recipient_id, 300, money_request_id=request.id)
+
+    assert balance(sender_id) == 700 and balance(recipient_id) == 300
+
+def test_bulk_transfer_pays_every_valid_row(app, make_user, funded, balance):
+    sender_id = funded(100000)
+    first, second = make_user(email="a@example.com"), make_user(email="b@example.com")
+
+    report = bulk_transfer(sender_id, [{"email": "a@example.com", "amount": "10.50"}, {"email": "b@example.com", "amount": "20"},
+                                       {"email": "nobody@example.com", "amount": "5"}, {"email": "a@example.com", "amount": "-1"}])
+
+    assert (report["sent"], report["failed"]) == (2, 2)
+    sent = [row for row in report["rows"] if row["status"] == "sent"]
+    assert sorted(Transaction.query.with_entities(Transaction.id)) == sorted((row["transaction_id"],) for row in sent)
+    fees = round(report["total_fees"] * 100)
+    assert balance(sender_id) == chain_total(sender_id) == 100000 - 3050
+    assert balance(first) + balance(second) == chain_total(first) + chain_total(second) == 3050 - fees
+
+def test_bulk_ledger_shortfall_sends_nothing(app, make_user, balance):
+    app.config["LEDGER_MODE"] = "unit"
+    sender_id = make_user(balance_cents=100000)
+    add_block(sender_id, 1000)
+    recipient_id = make_user(email="a@example.com")
+
+    with pytest.raises(TransferError, match="Ledger"):
+        bulk_transfer(sender_id, [{"email": "a@example.com", "amount": "50"}])
+
+    assert balance(sender_id) == 100000 and balance(recipient_id) == 0
+    assert chain_total(sender_id) == 1000 and Transaction.query.count() == 0
+
+def test_bulk_report_ids_are_the_rows_it_inserted(app, make_user, monkeypatch, funded):
+    sender_id = funded(100000)
+    recipient_id = make_user(email="a@example.com")
+    now = datetime(2026, 10, 1, 12, 0, 0)
+    monkeypatch.setattr("transfers.datetime", type("Frozen", (datetime,), {"utcnow": staticmethod(lambda: now)}))
+    earlier = Transaction(sender_id=sender_id, recipient_id=recipient_id, amount=1.0, timestamp=now)  # Same sender, same instant
+    db.session.add(earlier)
+    db.session.commit()
+
+    report = bulk_transfer(sender_id, [{"email": "a@example.com", "amount": "5"}, {"email": "a@example.com", "amount": "7"}])
+
+    ids = [row["transaction_id"] for row in report["rows"]]
+    assert earlier.id not in ids and len(set(ids)) == 2
+    assert [round(db.session.get(Transaction, transaction_id).amount + db.session.get(Transaction, transaction_id).fee, 2)
+            for transaction_id in ids] == [5.0, 7.0]
@@ -0,0 +1,59 @@
+import io
+import pytest
+from models import db, User, link_hash, chain_total, upgrade_schema
+from audit import check_chain
+from reconcile import reconcile
+from transfers import TransferError, transfer, withdraw
+
+# The user and block tables as the original app created them: float balances, one "Added 1 USD" block per dollar
+LEGACY_TABLES = [
+    '''CREATE TABLE "user" (id INTEGER NOT NULL, username VARCHAR(100) NOT NULL, email VARCHAR(100) NOT NULL,
+       password VARCHAR(255) NOT NULL, balance FLOAT, language VARCHAR(10), country VARCHAR(100) NOT NULL,
+       PRIMARY KEY (id), UNIQUE (email))''',
+    '''CREATE TABLE block (id INTEGER NOT NULL, "index" INTEGER NOT NULL, timestamp DATETIME, data TEXT NOT NULL,
+       previous_hash VARCHAR(64) NOT NULL, user_id INTEGER NOT NULL, PRIMARY KEY (id), FOREIGN KEY(user_id) REFERENCES user (id))''',
+]
+
+def legacy_database(users):
+    """ Replaces the user and block tables with legacy ones holding (balance in USD, unit blocks) per user """
+    with db.engine.begin() as conn:
+        conn.exec_driver_sql("DROP TABLE block")
+        conn.exec_driver_sql('DROP TABLE "user"')
+        for table in LEGACY_TABLES:
+            conn.exec_driver_sql(table)
+        for user_id, (balance, blocks) in enumerate(users, start=1):
+            conn.exec_driver_sql('INSERT INTO "user" (id, username, email, password, balance, country) VALUES (?, ?, ?, ?, ?, ?)',
+                                 (user_id, f"user{user_id}", f"user{user_id}@example.com", "x", balance, "Qatar"))
+            previous = "0"
+            for index in range(1, blocks + 1):
+                stored = link_hash(index, "Added 1 USD", previous)
+                conn.exec_driver_sql('INSERT INTO block ("index", data, previous_hash, user_id) VALUES (?, ?, ?, ?)',
+                                     (index, "Added 1 USD", stored, user_id))
+                previous = link_hash(index, "Added 1 USD", stored)
+
+def test_upgrade_opens_ledgers_at_the_balance(app):
+    # Like the shipped instance/users.db: balances credited without blocks, and a ledger holding more than its balance
+    legacy_database([(1000.0, 200), (900.0, 0), (12.5, 20)])
+
+    upgrade_schema()
+
+    assert [chain_total(user_id) for user_id in (1, 2, 3)] == [100000, 90000, 1250]
+    assert all(check_chain(user_id, full=True)["ok"] for user_id in (1, 2, 3))
+    transfer(1, 2, 30000)
+    transfer(2, 3, 95000)
+    withdraw(1, 30000)
+    withdraw(3, 96250)
+    assert [db.session.get(User, user_id).balance_cents for user_id in (1, 2, 3)] == [40000, 25000, 0]
+    assert reconcile(io.StringIO(), full=True).discrepancies == 0
+
+def test_upgrade_runs_the_opening_once(app):
+    legacy_database([(5.0, 0), (0.0, 0)])
+    upgrade_schema()
+    db.session.execute(db.update(User).where(User.id == 1).values(balance_cents=600))  # Drift after the upgrade
+    db.session.commit()
+
+    upgrade_schema()
+
+    assert chain_total(1) == 500
+    with pytest.raises(TransferError, match="Ledger"):
+        transfer(1, 2, 600)
@@ -0,0 +1,94 @@
+import hashlib
+import hmac
+import json
+import time
+from models import db, Deposit, StripeEvent, chain_total
+
+SECRET = "whsec_test"
+
+def signed(payload, secret=SECRET):
+    """ A body and Stripe-Signature header the way Stripe signs webhook deliveries """
+    body = json.dumps(payload)
+    timestamp = int(time.time())
+    signature = hmac.new(secret.encode(), f"{timestamp}.{body}".encode(), hashlib.sha256).hexdigest()
+    return body, {"Stripe-Signature": f"t={timestamp},v1={signature}", "Content-Type": "application/json"}
+
+def completed(event_id="evt_1", session_id="cs_1", **checkout):
+    return {"id": event_id, "object": "event", "type": "checkout.session.completed",
+            "data": {"object": dict({"id": session_id, "object": "checkout.session", "payment_status": "paid"}, **checkout)}}
+
+def open_deposit(user_id, cents=500000, session_id="cs_1"):
+    deposit = Deposit(user_id=user_id, amount_cents=cents, status="open", stripe_session_id=session_id)
+    db.session.add(deposit)
+    db.session.commit()
+    return deposit.id
+
+def test_signed_event_credits_once(client, make_user, balance):
+    user_id = make_user()
+    deposit_id = open_deposit(user_id)
+    body, headers = signed(completed())
+
+    first = client.post("/stripe/webhook", data=body, headers=headers)
+    retry = client.post("/stripe/webhook", data=body, headers=headers)
+
+    assert first.status_code == 200 and first.json == {"received": True, "duplicate": False}
+    assert retry.status_code == 200 and retry.json["duplicate"] is True
+    assert balance(user_id) == 500000
+    assert chain_total(user_id) == 500000
+    assert db.session.get(Deposit, deposit_id).status == "paid"
+
+def test_new_event_for_a_paid_deposit_does_not_credit_again(client, make_user, balance):
+    user_id = make_user()
+    open_deposit(user_id)
+    for event_id in ("evt_1", "evt_2"):
+        body, headers = signed(completed(event_id))
+        assert client.post("/stripe/webhook", data=body, headers=headers).status_code == 200
+    assert balance(user_id) == 500000
+
+def test_refused_without_a_configured_secret(app, client, make_user, balance):
+    app.config["STRIPE_WEBHOOK_SECRET"] = ""
+    user_id = make_user()
+    open_deposit(user_id)
+
+    response = client.post("/stripe/webhook", data=json.dumps(completed()), headers={"Content-Type": "application/json"})
+
+    assert response.status_code == 403
+    assert balance(user_id) == 0
+
+def test_unsigned_and_forged_events_are_rejected(client, make_user, balance):
+    user_id = make_user()
+    open_deposit(user_id)
+    body, headers = signed(completed(), secret="whsec_other")
+
+    assert client.post("/stripe/webhook", data=json.dumps(completed()), headers={"Content-Type": "application/json"}).status_code == 400
+    assert client.post("/stripe/webhook", data=body, headers=headers).status_code == 400
+    assert balance(user_id) == 0
+    assert StripeEvent.query.count() == 0
+
+def test_malformed_event_is_a_400(client):
+    for payload in ({"id": "evt_1", "type": "checkout.session.completed"},
+                    {"id": "evt_1", "type": "checkout.session.completed", "data": {}},
+                    {"id": "evt_1", "type": "checkout.session.completed", "data": {"object": "cs_1"}}):
+        body, headers = signed(payload)
+        assert client.post("/stripe/webhook", data=body, headers=headers).status_code == 400
+    assert StripeEvent.query.count() == 0
+
+def test_only_paid_sessions_credit(client, make_user, balance):
+    user_id = make_user()
+    open_deposit(user_id)
+    unpaid = completed("evt_1", payment_status="unpaid")
+    missing = completed("evt_2")
+    del missing["data"]["object"]["payment_status"]
+
+    for payload in (unpaid, missing):
+        body, headers = signed(payload)
+        assert client.post("/stripe/webhook", data=body, headers=headers).status_code == 200
+    assert balance(user_id) == 0
+
+def test_redirects_never_credit(client, make_user, balance):
+    from conftest import login
+    user_id = make_user()
+    login(client, user_id)
+
+    assert client.get("/payment_success?amount=5000").status_code == 404
+    assert balance(user_id) == 0
@@ -0,0 +1,238 @@
+import csv
+import io
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from sqlalchemy.exc import SQLAlchemyError
+from models import db, User, Transaction, MoneyRequest, Withdrawal, add_block, add_blocks, remove_block, record_contact, record_contacts
+from quotes import quote_engine
+
+MAX_BATCH = 5000  # Payments accepted in one bulk payout
+
+class TransferError(Exception):
+    """ A transfer that was refused; nothing it started has been committed """
+
+def to_cents(amount):
+    """ Parses an amount in dollars (form text, float or Decimal) into whole cents """
+    try:
+        cents = (Decimal(str(amount)) * 100).quantize(Decimal("1"))
+    except (InvalidOperation, ValueError):
+        raise TransferError("Invalid amount")
+    if not cents.is_finite() or cents <= 0:
+        raise TransferError("Amount must be positive")
+    return int(cents)
+
+def debit(user_id, cents):
+    """ Takes cents from a balance only if it covers them, in one UPDATE. Returns False when it does not. """
+    result = db.session.execute(
+        db.update(User)
+        .where(User.id == user_id, User.balance_cents >= cents)
+        .values(balance_cents=User.balance_cents - cents)
+    )
+    return result.rowcount == 1
+
+def credit(user_id, cents):
+    """ Adds cents to a balance without reading it first """
+    result = db.session.execute(
+        db.update(User).where(User.id == user_id).values(balance_cents=User.balance_cents + cents)
+    )
+    return result.rowcount == 1
+
+def transfer(sender_id, recipient_id, amount_cents, fee_cents=0, money_request_id=None):
+    """ Moves amount_cents from sender to recipient, less fee_cents, as a single database transaction.
+    Balances, ledger blocks, the Transaction row, contacts and an accepted MoneyRequest are
+    committed together, or nothing is. Raises TransferError when the transfer is refused. """
+    if amount_cents <= 0 or not 0 <= fee_cents < amount_cents:
+        raise TransferError("Invalid amount")
+
+    try:
+        # Writes come first so SQLite takes its write lock before anything below is read
+        if money_request_id is not None:
+            accepted = db.session.execute(
+                db.update(MoneyRequest)
+                .where(MoneyRequest.id == money_request_id, MoneyRequest.status == "Pending")
+                .values(status="Accepted")
+            )
+            if accepted.rowcount != 1:
+                raise TransferError("Request already handled")
+
+        if not debit(sender_id, amount_cents):
+            raise TransferError("Insufficient balance")
+        if not credit(recipient_id, amount_cents - fee_cents):
+            raise TransferError("Recipient not found")
+
+        # The ledger mirrors the balance moves to the cent
+        if not remove_block(sender_id, amount_cents, commit=False):
+            raise TransferError("Ledger does not cover the debit")
+        add_block(recipient_id, amount_cents - fee_cents, commit=False)
+
+        transaction = Transaction(
+            sender_id=sender_id,
+            recipient_id=recipient_id,
+            amount=(amount_cents - fee_cents) / 100,
+            fee=fee_cents / 100
+        )
+        db.session.add(transaction)
+        record_contact(sender_id, recipient_id)
+        db.session.commit()
+        return transaction
+    except TransferError:
+        db.session.rollback()
+        raise
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        print(f"⚠️ Transfer failed: {e}")
+        raise TransferError("Transfer failed, please try again")
+
+def withdraw(user_id, amount_cents):
+    """ Takes amount_cents out of a wallet. The balance, the ledger debit and the Withdrawal row are
+    committed together, or nothing is. Raises TransferError when the withdrawal is refused. """
+    try:
+        if not debit(user_id, amount_cents):
+            raise TransferError("Insufficient balance")
+        if not remove_block(user_id, amount_cents, commit=False):
+            raise TransferError("Ledger does not cover the debit")
+        db.session.add(Withdrawal(user_id=user_id, amount_cents=amount_cents))
+        db.session.commit()
+    except TransferError:
+        db.session.rollback()
+        raise
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        print(f"⚠️ Withdrawal failed: {e}")
+        raise TransferError("Withdrawal failed, please try again")
+
+def parse_payouts(text):
+    """ Reads payout rows from CSV text whose header has email and amount columns """
+    reader = csv.DictReader(io.StringIO(text))
+    columns = {name.strip().lower() for name in reader.fieldnames or [] if name}
+    if not {"email", "amount"} <= columns:
+        raise TransferError("CSV needs email and amount columns")
+    return [{key.strip().lower(): (value or "").strip() for key, value in row.items() if key} for row in reader]
+
+def payout_report(rows):
+    """ Public per-row report for bulk_transfer, amounts in dollars """
+    sent = [row for row in rows if row["status"] == "sent"]
+    report_rows = []
+    for row in rows:
+        entry = {"row": row["row"], "email": row["email"], "status": row["status"]}
+        if "amount_cents" in row:
+            entry["amount"] = row["amount_cents"] / 100
+        if "fee_cents" in row:
+            entry["fee"] = row["fee_cents"] / 100
+        for key in ("currency", "receive_amount", "transaction_id", "error"):
+            if key in row:
+                entry[key] = row[key]
+        report_rows.append(entry)
+    return {
+        "sent": len(sent),
+        "failed": len(rows) - len(sent),
+        "total_amount": sum(row["amount_cents"] for row in sent) / 100,
+        "total_fees": sum(row["fee_cents"] for row in sent) / 100,
+        "rows": report_rows
+    }
+
+def bulk_transfer(sender_id, payouts):
+    """ Pays many recipients from one sender in a single database transaction, fees priced in one batch quote.
+    Rows with a bad amount or unknown email are skipped. If the remaining rows together exceed the
+    sender's balance nothing is sent. Returns the payout_report for every row. """
+    if len(payouts) > MAX_BATCH:
+        raise TransferError(f"At most {MAX_BATCH} payments per batch")
+
+    rows = []
+    for number, payout in enumerate(payouts, start=1):
+        row = {"row": number, "email": str(payout.get("email") or "").strip(), "status": "pending"}
+        try:
+            row["amount_cents"] = to_cents(payout.get("amount"))
+        except TransferError as e:
+            row.update(status="error", error=str(e))
+        rows.append(row)
+
+    # Every recipient is resolved by a single query
+    emails = {row["email"] for row in rows if row["status"] == "pending"}
+    recipients = {
+        email: (user_id, country)
+        for email, user_id, country in db.session.query(User.email, User.id, User.country).filter(User.email.in_(emails))
+    } if emails else {}
+
+    valid = []
+    for row in rows:
+        if row["status"] != "pending":
+            continue
+        recipient_id, country = recipients.get(row["email"], (None, None))
+        if recipient_id is None:
+            row.update(status="error", error="Recipient not found")
+        elif recipient_id == sender_id:
+            row.update(status="error", error="Cannot pay yourself")
+        else:
+            row["recipient_id"], row["country"] = recipient_id, country
+            valid.append(row)
+
+    if not valid:
+        return payout_report(rows)
+
+    sender_country = db.session.query(User.country).filter(User.id == sender_id).scalar()
+    quotes = quote_engine().quote_batch(
+        [row["amount_cents"] for row in valid], [(sender_country, row["country"]) for row in valid]
+    )
+    for row, quote in zip(valid, quotes):
+        if quote.net_cents <= 0:
+            row.update(status="error", error="Amount does not cover the fee")
+            continue
+        row.update(fee_cents=quote.fee_cents, currency=quote.currency, receive_amount=float(quote.receive_amount))
+    valid = [row for row in valid if row["status"] == "pending"]
+    if not valid:
+        return payout_report(rows)
+
+    from risk import screen_payouts, record_payouts  # Imports this module
+    screen_payouts(sender_id, sender_country, valid)
+    valid = [row for row in valid if row["status"] == "pending"]
+    if not valid:
+        return payout_report(rows)
+
+    credits = defaultdict(int)
+    for row in valid:
+        credits[row["recipient_id"]] += row["amount_cents"] - row["fee_cents"]
+
+    try:
+        if not debit(sender_id, sum(row["amount_cents"] for row in valid)):
+            db.session.rollback()
+            for row in valid:
+                row.update(status="error", error="Insufficient balance for batch")
+            return payout_report(rows)
+
+        users = User.__table__
+        db.session.execute(
+            users.update().where(users.c.id == db.bindparam("b_id"))
+            .values(balance_cents=users.c.balance_cents + db.bindparam("b_cents")),
+            [{"b_id": user_id, "b_cents": cents} for user_id, cents in credits.items()]
+        )
+
+        if not remove_block(sender_id, sum(row["amount_cents"] for row in valid), commit=False):
+            raise TransferError("Ledger does not cover the debit")
+        add_blocks(credits)
+
+        now = datetime.utcnow()
+        # RETURNING hands back each row's id in parameter order, whatever else shares the timestamp
+        transaction_ids = db.session.scalars(db.insert(Transaction).returning(Transaction.id, sort_by_parameter_order=True), [{
+            "sender_id": sender_id,
+            "recipient_id": row["recipient_id"],
+            "amount": (row["amount_cents"] - row["fee_cents"]) / 100,
+            "fee": row["fee_cents"] / 100,
+            "timestamp": now,
+            "bulk": True
+        } for row in valid]).all()
+        record_contacts(sender_id, credits)
+        db.session.commit()
+    except TransferError:
+        db.session.rollback()
+        raise
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        print(f"⚠️ Bulk payout failed: {e}")
+        raise TransferError("Batch failed, nothing was sent")
+
+    for row, transaction_id in zip(valid, transaction_ids):
+        row.update(status="sent", transaction_id=transaction_id)
+    record_payouts(sender_id, sender_country, valid)
+    return payout_report(rows)
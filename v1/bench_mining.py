@@ -0,0 +1,25 @@
+import argparse
+import os
+import time
+from mining import mine
+
+def run(difficulty, rounds, workers):
+    hashes, elapsed = 0, 0.0
+    for previous_proof in range(1, rounds + 1):
+        started = time.perf_counter()
+        _, count = mine(previous_proof, difficulty, workers)
+        elapsed += time.perf_counter() - started
+        hashes += count
+    return hashes, elapsed
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Proof-of-work throughput by worker count")
+    parser.add_argument('--difficulty', type=int, default=5)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--workers', type=int, nargs='+', default=sorted({1, 2, 4, os.cpu_count()}))
+    args = parser.parse_args()
+
+    print(f"{'workers':>8} {'hashes/s':>12} {'s/block':>8}")
+    for workers in args.workers:
+        hashes, elapsed = run(args.difficulty, args.rounds, workers)
+        print(f"{workers:>8} {hashes / elapsed:>12,.0f} {elapsed / args.rounds:>8.3f}")
@@ -0,0 +1,53 @@
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from storage import ChainLog
+
+def build(path, blocks):
+    log = ChainLog(path, fsync=False)
+    previous_hash = '0'
+    for index in range(len(log) + 1, blocks + 1):
+        log.append({
+            'index': index,
+            'timestamp': time.time(),
+            'transactions': [{'sender': 'employer', 'receiver': f'worker{index % 500}', 'amount': '250'}],
+            'proof': index * 7,
+            'previous_hash': previous_hash
+        })
+        previous_hash = f'{index:064x}'
+    log.close()
+
+def measure(path):
+    """ Opens the log in a fresh process so RSS reflects only the restart """
+    code = (
+        "import resource, sys, time; from storage import ChainLog\n"
+        "started = time.perf_counter(); log = ChainLog(sys.argv[1]); last = log[-1]\n"
+        "print(time.perf_counter() - started, len(log), resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)"
+    )
+    output = subprocess.check_output([sys.executable, '-c', code, path], cwd=os.path.dirname(os.path.abspath(__file__)))
+    seconds, blocks, rss_kb = output.split()
+    return float(seconds), int(blocks), int(rss_kb)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Restart time and resident memory of a ChainLog")
+    parser.add_argument('--blocks', type=int, default=1_000_000)
+    parser.add_argument('--dir', default=tempfile.gettempdir())
+    args = parser.parse_args()
+
+    path = os.path.join(args.dir, f'bench_chain_{args.blocks}.log')
+    started = time.perf_counter()
+    build(path, args.blocks)
+    print(f"built {args.blocks:,} blocks ({os.path.getsize(path) / 2**20:.1f} MiB) in {time.perf_counter() - started:.1f}s")
+
+    seconds, blocks, rss_kb = measure(path)
+    print(f"restart with snapshot:    {seconds * 1000:8.1f} ms, {rss_kb / 1024:6.1f} MiB max RSS")
+
+    os.remove(path + '.snapshot')
+    seconds, blocks, rss_kb = measure(path)
+    print(f"restart by full replay:   {seconds * 1000:8.1f} ms, {rss_kb / 1024:6.1f} MiB max RSS")
+
+    baseline = int(subprocess.check_output([sys.executable, '-c', "import resource; print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)"]))
+    print(f"interpreter baseline:              {baseline / 1024:6.1f} MiB max RSS")
@@ -0,0 +1,67 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+os.environ['PAYO_MINING_DIFFICULTY'] = '1'  # Cheap proofs so long chains build quickly
+os.environ['PAYO_CHAIN_LOG'] = os.path.join(tempfile.mkdtemp(), 'seed.log')
+from main import Blockchain  # noqa: E402
+from storage import ChainLog  # noqa: E402
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def build(path, blocks):
+    chain = Blockchain(ChainLog(path, fsync=False))
+    while len(chain.chain) < blocks:
+        chain.add_transaction('employer', f'worker{len(chain.chain) % 500}', '250')
+        previous_block = chain.last_block
+        chain.create_block(chain.proof_of_work(previous_block['proof'], difficulty=1), chain.hash(previous_block))
+    chain.store.close()
+
+def start_node(port, chain_log, peers=()):
+    env = dict(os.environ, PORT=str(port), PAYO_CHAIN_LOG=chain_log, PAYO_PEERS=','.join(peers))
+    code = "from main import app; import os; app.run(port=int(os.environ['PORT']), threaded=True)"
+    process = subprocess.Popen([sys.executable, '-c', code], cwd=HERE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/chain_height', timeout=1)
+            return process
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'node on port {port} did not start')
+
+def sync(port):
+    started = time.perf_counter()
+    with urllib.request.urlopen(f'http://127.0.0.1:{port}/sync', data=b'', timeout=600) as response:
+        result = json.loads(response.read())
+    return time.perf_counter() - started, result['results'][0]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Sync time and bytes moved between two local nodes")
+    parser.add_argument('--blocks', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--tail', type=int, default=10, help="Blocks added to the source before the delta sync")
+    parser.add_argument('--port', type=int, default=5101)
+    args = parser.parse_args()
+
+    print(f"{'blocks':>8} {'phase':>8} {'received':>9} {'KiB':>10} {'seconds':>8}")
+    for blocks in args.blocks:
+        workdir = tempfile.mkdtemp()
+        source_log, target_log = os.path.join(workdir, 'a.log'), os.path.join(workdir, 'b.log')
+        build(source_log, blocks)
+        source = start_node(args.port, source_log)
+        target = start_node(args.port + 1, target_log, [f'http://127.0.0.1:{args.port}'])
+        try:
+            seconds, result = sync(args.port + 1)
+            print(f"{blocks:>8} {'full':>8} {result['blocks']:>9} {result['bytes'] / 1024:>10.1f} {seconds:>8.2f}")
+            for _ in range(args.tail):
+                urllib.request.urlopen(urllib.request.Request(f'http://127.0.0.1:{args.port}/mine_block', headers={'Accept': 'application/json'}))
+                time.sleep(0.05)
+            seconds, result = sync(args.port + 1)
+            print(f"{blocks:>8} {'delta':>8} {result['blocks']:>9} {result['bytes'] / 1024:>10.1f} {seconds:>8.2f}")
+        finally:
+            source.terminate()
+            target.terminate()
@@ -1,57 +1,175 @@
-from flask import Flask, request, jsonify, render_template, redirect, url_for
+from flask import Flask, Response, request, jsonify, render_template, redirect, url_for, stream_with_context
 import hashlib
+import threading
 import time
 import json
+import os
+import uuid
+from merkle import merkle_proof, merkle_root
+from mining import mine, valid_proof
+from storage import ChainLog
+from sync import Peer, sync_with_peer
 
 app = Flask(__name__)
+app.config['MINING_DIFFICULTY'] = int(os.environ.get('PAYO_MINING_DIFFICULTY', 4))  # Leading zeros required in the proof hash
+app.config['MINING_WORKERS'] = None  # Processes searching for a proof, None uses every CPU
+app.config['MINING_JOB_TTL'] = 3600  # Seconds a finished job stays visible at /mine_block/<job_id>
+app.config['MINING_JOBS_KEPT'] = 100  # Finished jobs kept at most, oldest dropped first
+app.config['CHAIN_LOG'] = os.environ.get('PAYO_CHAIN_LOG', os.path.join(app.instance_path, 'chain.log'))
+app.config['PEERS'] = set(filter(None, os.environ.get('PAYO_PEERS', '').split(',')))  # Other nodes' base URLs
+app.config['CHAIN_STREAM_BATCH'] = 100  # Blocks per chunk written by /get_chain
 
 # Blockchain class
 class Blockchain:
-    def __init__(self):
-        self.chain = []
-        self.transactions = []
-        self.create_block(proof=1, previous_hash='0')
+    def __init__(self, store=None):
+        # With a ChainLog the chain survives restarts, otherwise it lives in plain lists
+        self.store = store
+        self.chain = store if store is not None else []
+        self.transactions = store.pending() if store is not None else []
+        if not len(self.chain):
+            self.create_block(proof=1, previous_hash='0')
 
     def create_block(self, proof, previous_hash):
         block = {
             'index': len(self.chain) + 1,
             'timestamp': time.time(),
             'transactions': self.transactions,
+            'merkle_root': merkle_root(self.transactions),
             'proof': proof,
             'previous_hash': previous_hash
         }
+        block['hash'] = self.hash(block)  # Computed once and stored with the block
         self.transactions = []
         self.chain.append(block)
+        if self.store is not None:
+            self.store.clear_pending()
         return block
 
     def add_transaction(self, sender, receiver, amount):
-        self.transactions.append({
+        transaction = {
             'sender': sender,
             'receiver': receiver,
             'amount': amount
-        })
+        }
+        self.transactions.append(transaction)
+        if self.store is not None:
+            self.store.add_pending(transaction)
         return self.last_block['index'] + 1
 
-    def proof_of_work(self, previous_proof):
-        new_proof = 1
-        check_proof = False
-        while not check_proof:
-            hash_operation = hashlib.sha256(str(new_proof**2 - previous_proof**2).encode()).hexdigest()
-            if hash_operation[:4] == '0000':
-                check_proof = True
-            else:
-                new_proof += 1
-        return new_proof
+    def add_blocks(self, blocks):
+        """ Appends blocks already validated against our tip, e.g. received from a peer """
+        for block in blocks:
+            self.chain.append(block)
+        self._drop_confirmed(blocks)
+
+    def replace_from(self, length, blocks):
+        """ Swaps everything after the first length blocks for a longer fork.
+        Transactions only in the discarded blocks go back to the pending pool. """
+        orphaned = [tx for block in self.chain[length:] for tx in block['transactions']]
+        if self.store is not None:
+            self.store.truncate(length)
+        else:
+            del self.chain[length:]
+        self.add_blocks(blocks)
+
+        confirmed = {json.dumps(tx, sort_keys=True) for block in blocks for tx in block['transactions']}
+        for transaction in orphaned:
+            if json.dumps(transaction, sort_keys=True) not in confirmed:
+                self.add_transaction(transaction['sender'], transaction['receiver'], transaction['amount'])
+
+    def _drop_confirmed(self, blocks):
+        confirmed = {json.dumps(tx, sort_keys=True) for block in blocks for tx in block['transactions']}
+        remaining = [tx for tx in self.transactions if json.dumps(tx, sort_keys=True) not in confirmed]
+        if len(remaining) != len(self.transactions):
+            self.transactions = []
+            if self.store is not None:
+                self.store.clear_pending()
+            for transaction in remaining:
+                self.add_transaction(transaction['sender'], transaction['receiver'], transaction['amount'])
+
+    def proof_of_work(self, previous_proof, difficulty=4, workers=1):
+        proof, _ = mine(previous_proof, difficulty, workers)
+        return proof
 
     def hash(self, block):
-        return hashlib.sha256(json.dumps(block, sort_keys=True).encode()).hexdigest()
+        if 'hash' in block:
+            return block['hash']
+        return self.compute_hash(block)
+
+    def compute_hash(self, block):
+        content = {key: value for key, value in block.items() if key != 'hash'}
+        return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+    def valid_chain(self, blocks, previous_block=None, difficulty=4):
+        """ Re-hashes each block once and checks its links to the block before it """
+        for block in blocks:
+            block_hash = self.compute_hash(block)
+            if block.get('hash', block_hash) != block_hash:
+                return False
+            if block.get('merkle_root', merkle_root(block['transactions'])) != merkle_root(block['transactions']):
+                return False
+            if previous_block is not None:
+                if block['index'] != previous_block['index'] + 1:
+                    return False
+                if block['previous_hash'] != self.hash(previous_block):
+                    return False
+                if not valid_proof(block['proof'], previous_block['proof'], difficulty):
+                    return False
+            previous_block = dict(block, hash=block_hash)
+        return True
+
+    def block_json(self, position):
+        """ A block as JSON text, served straight from the log when there is one """
+        if self.store is not None:
+            return self.store.raw(position)
+        return json.dumps(self.chain[position], sort_keys=True)
 
     @property
     def last_block(self):
         return self.chain[-1]
 
 # Instantiate blockchain
-blockchain = Blockchain()
+os.makedirs(app.instance_path, exist_ok=True)
+blockchain = Blockchain(ChainLog(app.config['CHAIN_LOG']))
+
+# Background mining jobs, one running at a time since each extends the current tip
+mining_jobs = {}
+mining_lock = threading.Lock()
+chain_lock = threading.Lock()  # Held while the tip changes, by a mined block or a peer sync
+
+def run_mining_job(job):
+    try:
+        block, hashes = None, 0
+        while block is None:
+            previous_block = blockchain.last_block
+            proof, tried = mine(previous_block['proof'], app.config['MINING_DIFFICULTY'], app.config['MINING_WORKERS'])
+            hashes += tried
+            with chain_lock:
+                if blockchain.hash(blockchain.last_block) == blockchain.hash(previous_block):
+                    block = blockchain.create_block(proof, blockchain.hash(previous_block))
+                # Otherwise a sync moved the tip while we mined, so mine again on the new one
+        job.update(status='done', block=block, hashes=hashes, finished=time.time())
+    except Exception as e:
+        job.update(status='failed', error=str(e), finished=time.time())
+
+def prune_mining_jobs(now):
+    """ Drops finished jobs past MINING_JOB_TTL, and the oldest beyond MINING_JOBS_KEPT. Call with mining_lock held. """
+    finished = sorted((job for job in mining_jobs.values() if job['status'] != 'running'), key=lambda job: job['finished'])
+    expired = [job for job in finished if now - job['finished'] > app.config['MINING_JOB_TTL']]
+    surplus = finished[:max(len(finished) - app.config['MINING_JOBS_KEPT'], 0)]
+    for job in expired + surplus:
+        mining_jobs.pop(job['id'], None)
+
+def start_mining_job():
+    with mining_lock:
+        prune_mining_jobs(time.time())
+        for job in mining_jobs.values():
+            if job['status'] == 'running':
+                return job
+        job = {'id': uuid.uuid4().hex, 'status': 'running', 'started': time.time()}
+        mining_jobs[job['id']] = job
+        threading.Thread(target=run_mining_job, args=(job,), daemon=True).start()
+        return job
 
 @app.route('/')
 def home():
@@ -59,12 +177,18 @@ def home():
 
 @app.route('/mine_block', methods=['GET'])
 def mine_block():
-    previous_block = blockchain.last_block
-    previous_proof = previous_block['proof']
-    proof = blockchain.proof_of_work(previous_proof)
-    previous_hash = blockchain.hash(previous_block)
-    block = blockchain.create_block(proof, previous_hash)
-    return redirect(url_for('home'))
+    job = start_mining_job()
+    if request.accept_mimetypes.best_match(['text/html', 'application/json']) != 'application/json':
+        return redirect(url_for('home'))
+    status_url = url_for('mining_status', job_id=job['id'])
+    return jsonify({'job_id': job['id'], 'status': job['status'], 'status_url': status_url}), 202, {'Location': status_url}
+
+@app.route('/mine_block/<job_id>', methods=['GET'])
+def mining_status(job_id):
+    job = mining_jobs.get(job_id)
+    if not job:
+        return jsonify({'message': 'Unknown mining job'}), 404
+    return jsonify(job), 200
 
 @app.route('/add_transaction', methods=['POST'])
 def add_transaction():
@@ -77,8 +201,80 @@ def add_transaction():
 
 @app.route('/get_chain', methods=['GET'])
 def get_chain():
-    response = {'chain': blockchain.chain, 'length': len(blockchain.chain)}
+    """ Streams blocks start..end (1-based, inclusive), at most limit (1 or more) of them.
+    "next" in the response is the start of the following page, or null at the tip. """
+    length = len(blockchain.chain)
+    start = max(request.args.get('start', default=1, type=int), 1)
+    end = min(request.args.get('end', default=length, type=int), length)
+    limit = request.args.get('limit', type=int)
+    if limit is not None and limit < 1:
+        return jsonify({'message': 'limit must be at least 1'}), 400
+    if limit is not None:
+        end = min(end, start + limit - 1)
+    next_start = end + 1 if start <= end < length else None  # An empty page never points back at itself
+    batch = app.config['CHAIN_STREAM_BATCH']
+
+    def generate():
+        yield f'{{"length": {length}, "start": {start}, "end": {end}, "chain": ['
+        for batch_start in range(start - 1, end, batch):
+            chunk = ','.join(blockchain.block_json(position) for position in range(batch_start, min(batch_start + batch, end)))
+            yield chunk if batch_start == start - 1 else ',' + chunk
+        yield f'], "next": {json.dumps(next_start)}}}'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+@app.route('/merkle_proof/<int:index>/<int:position>', methods=['GET'])
+def get_merkle_proof(index, position):
+    """ Inclusion proof for the transaction at position in block index, check it with merkle.verify_proof """
+    if not 1 <= index <= len(blockchain.chain):
+        return jsonify({'message': 'Block not found'}), 404
+    block = blockchain.chain[index - 1]
+    transactions = block['transactions']
+    if not 0 <= position < len(transactions):
+        return jsonify({'message': 'Transaction not found'}), 404
+    response = {
+        'block_index': index,
+        'block_hash': blockchain.hash(block),
+        'transaction': transactions[position],
+        'merkle_root': block.get('merkle_root', merkle_root(transactions)),
+        'position': position,
+        'count': len(transactions),  # verify_proof takes both, the root commits to the count
+        'proof': merkle_proof(transactions, position)
+    }
     return jsonify(response), 200
 
+@app.route('/chain_height', methods=['GET'])
+def chain_height():
+    return jsonify({'length': len(blockchain.chain), 'tip_hash': blockchain.hash(blockchain.last_block)}), 200
+
+@app.route('/chain_hashes', methods=['GET'])
+def chain_hashes():
+    """ Block hashes for start..end (1-based, inclusive, at most 4096), used to find fork points """
+    start = max(request.args.get('start', default=1, type=int), 1)
+    end = min(request.args.get('end', default=len(blockchain.chain), type=int), len(blockchain.chain), start + 4095)
+    hashes = [blockchain.hash(blockchain.chain[position - 1]) for position in range(start, end + 1)]
+    return jsonify({'start': start, 'hashes': hashes}), 200
+
+@app.route('/nodes/register', methods=['POST'])
+def register_nodes():
+    data = request.get_json(silent=True) or request.form
+    nodes = data.get('nodes')
+    if not nodes:
+        return jsonify({'message': 'Missing nodes'}), 400
+    app.config['PEERS'].update([nodes] if isinstance(nodes, str) else nodes)
+    return jsonify({'peers': sorted(app.config['PEERS'])}), 201
+
+@app.route('/sync', methods=['GET', 'POST'])
+def sync():
+    """ Catches up with every registered peer, keeping the longest valid chain """
+    results = []
+    with chain_lock:
+        for url in sorted(app.config['PEERS']):
+            try:
+                results.append(sync_with_peer(blockchain, Peer(url), app.config['MINING_DIFFICULTY']))
+            except OSError as e:
+                results.append({'peer': url, 'status': 'unreachable', 'error': str(e)})
+    return jsonify({'length': len(blockchain.chain), 'results': results}), 200
+
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=True, port=int(os.environ.get('PORT', 5000)))
\ No newline at end of file
@@ -0,0 +1,60 @@
+import hashlib
+import json
+
+# Leaves, inner nodes and the root are hashed with different prefixes so a node can never pass as a transaction
+LEAF_PREFIX = b'\x00'
+NODE_PREFIX = b'\x01'
+ROOT_PREFIX = b'\x02'
+
+def leaf_hash(transaction):
+    return hashlib.sha256(LEAF_PREFIX + json.dumps(transaction, sort_keys=True).encode()).hexdigest()
+
+def node_hash(left, right):
+    return hashlib.sha256(NODE_PREFIX + bytes.fromhex(left) + bytes.fromhex(right)).hexdigest()
+
+def _commit(count, top):
+    """ The root binds the leaf count, so no other number of transactions can reach it """
+    return hashlib.sha256(ROOT_PREFIX + count.to_bytes(8, 'big') + bytes.fromhex(top)).hexdigest()
+
+def _levels(transactions):
+    """ Every level of the tree from the leaves up. An odd last node is carried up unpaired rather than
+    hashed with a copy of itself, which would give [a, b, c] and [a, b, c, c] the same root. """
+    level = [leaf_hash(transaction) for transaction in transactions]
+    levels = [level]
+    while len(level) > 1:
+        level = [node_hash(level[i], level[i + 1]) if i + 1 < len(level) else level[i] for i in range(0, len(level), 2)]
+        levels.append(level)
+    return levels
+
+def merkle_root(transactions):
+    if not transactions:
+        return _commit(0, hashlib.sha256(b'').hexdigest())
+    return _commit(len(transactions), _levels(transactions)[-1][0])
+
+def merkle_proof(transactions, position):
+    """ Sibling hashes from the leaf at position up to the root, O(log n) entries; levels where the node
+    is carried up unpaired have none """
+    proof = []
+    for level in _levels(transactions)[:-1]:
+        sibling = position ^ 1
+        if sibling < len(level):
+            proof.append(level[sibling])
+        position //= 2
+    return proof
+
+def verify_proof(transaction, position, count, proof, root):
+    """ True when the proof links the transaction at position, in a block of count transactions, to the given
+    Merkle root. Which side each sibling is on follows from position and count, never from the proof. """
+    if not 0 <= position < count:
+        return False
+    current, siblings = leaf_hash(transaction), iter(proof)
+    width = count
+    while width > 1:
+        if position % 2 or position + 1 < width:
+            sibling = next(siblings, None)
+            if sibling is None:
+                return False
+            current = node_hash(sibling, current) if position % 2 else node_hash(current, sibling)
+        position //= 2
+        width = (width + 1) // 2
+    return next(siblings, None) is None and _commit(count, current) == root
@@ -0,0 +1,56 @@
+import hashlib
+import multiprocessing
+import os
+
+BATCH_SIZE = 5000  # Nonces a worker tries before checking whether another worker already won
+
+def hash_proof(proof, previous_proof):
+    return hashlib.sha256(str(proof**2 - previous_proof**2).encode()).hexdigest()
+
+def valid_proof(proof, previous_proof, difficulty=4):
+    return hash_proof(proof, previous_proof)[:difficulty] == '0' * difficulty
+
+def _search(worker, workers, previous_proof, difficulty, found, results):
+    """ Scans interleaved batches of the nonce space until any worker finds a proof """
+    prefix = '0' * difficulty
+    start = 1 + worker * BATCH_SIZE
+    hashes = 0
+    while not found.is_set():
+        for proof in range(start, start + BATCH_SIZE):
+            if hashlib.sha256(str(proof**2 - previous_proof**2).encode()).hexdigest()[:difficulty] == prefix:
+                found.set()
+                results.put((proof, hashes + proof - start + 1))
+                return
+        hashes += BATCH_SIZE
+        start += workers * BATCH_SIZE
+    results.put((None, hashes))
+
+def mine(previous_proof, difficulty=4, workers=None):
+    """ Finds a proof using one process per worker. Returns (proof, hashes tried). """
+    workers = workers or os.cpu_count()
+    if workers == 1:
+        proof = 1
+        while not valid_proof(proof, previous_proof, difficulty):
+            proof += 1
+        return proof, proof
+
+    found = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=_search, args=(worker, workers, previous_proof, difficulty, found, results), daemon=True)
+        for worker in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    proofs, hashes = [], 0
+    for _ in processes:  # Every worker reports exactly once, winner or not
+        proof, count = results.get()
+        hashes += count
+        if proof is not None:
+            proofs.append(proof)
+
+    for process in processes:
+        process.join()
+
+    return min(proofs), hashes
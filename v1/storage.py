@@ -0,0 +1,162 @@
+import array
+import json
+import mmap
+import os
+import struct
+import threading
+
+SNAPSHOT_EVERY = 10000  # Blocks between offset-index snapshots
+HEADER = struct.Struct('<QQ')  # Block count, log bytes covered by the snapshot
+
+class ChainLog:
+    """ Append-only block log: one JSON line per block, read back through mmap.
+    Only the byte offset of each block is held in memory, blocks are decoded on access. """
+
+    def __init__(self, path, snapshot_every=SNAPSHOT_EVERY, fsync=True):
+        self.path = path
+        self.snapshot_path = path + '.snapshot'
+        self.pending_path = path + '.pending'
+        self.snapshot_every = snapshot_every
+        self.fsync = fsync
+        self.offsets = array.array('Q')
+        self._lock = threading.Lock()
+        self._map = None
+        self._last = None
+
+        open(self.path, 'ab').close()
+        self._reader = open(self.path, 'rb')
+        self._end = self._replay()
+        self._writer = open(self.path, 'ab')
+
+    def _load_snapshot(self, size):
+        """ Restores the offset index from the last snapshot, returns the log position it covers """
+        try:
+            with open(self.snapshot_path, 'rb') as f:
+                count, end = HEADER.unpack(f.read(HEADER.size))
+                if end > size:
+                    return 0  # Log was truncated behind the snapshot's back
+                self.offsets.fromfile(f, count)
+                return end
+        except (OSError, EOFError, struct.error):
+            self.offsets = array.array('Q')
+            return 0
+
+    def _replay(self):
+        """ Indexes blocks written after the snapshot and drops a torn final line """
+        size = os.path.getsize(self.path)
+        position = self._load_snapshot(size)
+        self._remap()
+
+        while position < size:
+            newline = self._map.find(b'\n', position)
+            if newline == -1:
+                break
+            self.offsets.append(position)
+            position = newline + 1
+
+        if position < size:
+            os.truncate(self.path, position)
+            self._remap()
+        return position
+
+    def _remap(self):
+        if self._map is not None:
+            self._map.close()
+        size = os.fstat(self._reader.fileno()).st_size
+        self._map = mmap.mmap(self._reader.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+
+    def _read(self, i):
+        start = self.offsets[i]
+        end = self.offsets[i + 1] if i + 1 < len(self.offsets) else self._end
+        with self._lock:
+            if self._map is None or end > len(self._map):
+                self._remap()
+            return self._map[start:end - 1]
+
+    def raw(self, i):
+        """ A block's JSON text exactly as stored, without decoding it """
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('block index out of range')
+        return self._read(i).decode()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('block index out of range')
+        if i == len(self) - 1 and self._last is not None:
+            return self._last
+        return json.loads(self._read(i))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def append(self, block):
+        line = json.dumps(block, sort_keys=True, separators=(',', ':')).encode() + b'\n'
+        with self._lock:
+            self._writer.write(line)
+            self._writer.flush()
+            if self.fsync:
+                os.fsync(self._writer.fileno())
+            self.offsets.append(self._end)
+            self._end += len(line)
+            self._last = block
+        if len(self.offsets) % self.snapshot_every == 0:
+            self.snapshot()
+
+    def truncate(self, length):
+        """ Drops every block after the first length, used when a longer fork replaces our tail """
+        with self._lock:
+            if length >= len(self.offsets):
+                return
+            self._end = self.offsets[length]
+            del self.offsets[length:]
+            self._writer.flush()
+            os.truncate(self.path, self._end)
+            self._last = None
+            self._remap()
+        self.snapshot()  # The old snapshot may cover blocks that no longer exist
+
+    def snapshot(self):
+        """ Atomically writes the offset index so the next start only replays newer blocks """
+        with self._lock:
+            count, end = len(self.offsets), self._end
+            offsets = self.offsets[:count]
+        tmp_path = self.snapshot_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(HEADER.pack(count, end))
+            offsets.tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+
+    def pending(self):
+        """ Transactions added since the last block """
+        if not os.path.exists(self.pending_path):
+            return []
+        with open(self.pending_path) as f:
+            return [json.loads(line) for line in f if line.endswith('\n')]
+
+    def add_pending(self, transaction):
+        with open(self.pending_path, 'a') as f:
+            f.write(json.dumps(transaction) + '\n')
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+
+    def clear_pending(self):
+        open(self.pending_path, 'w').close()
+
+    def close(self):
+        self._writer.close()
+        if self._map is not None:
+            self._map.close()
+        self._reader.close()
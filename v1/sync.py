@@ -0,0 +1,78 @@
+import json
+import urllib.parse
+import urllib.request
+
+SYNC_BATCH = 500  # Blocks fetched per /get_chain request
+HASH_WINDOW = 64  # First window of hashes compared when looking for the fork point
+
+class Peer:
+    """ Minimal JSON client for another node that counts the bytes it downloads """
+
+    def __init__(self, url, timeout=30):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.bytes_received = 0
+
+    def get(self, path, **params):
+        query = '?' + urllib.parse.urlencode(params) if params else ''
+        with urllib.request.urlopen(self.url + path + query, timeout=self.timeout) as response:
+            body = response.read()
+        self.bytes_received += len(body)
+        return json.loads(body)
+
+    def height(self):
+        return self.get('/chain_height')
+
+    def hashes(self, start, end):
+        return self.get('/chain_hashes', start=start, end=end)['hashes']
+
+    def blocks(self, start, end):
+        return self.get('/get_chain', start=start, end=end)['chain']
+
+def common_length(blockchain, peer, length):
+    """ Number of leading blocks both chains share, searching back from length in growing windows.
+    Hash links make the shared part a prefix, so the highest matching position is the fork point. """
+    window = HASH_WINDOW
+    top = length
+    while top > 0:
+        bottom = max(1, top - window + 1)
+        theirs = peer.hashes(bottom, top)
+        for position in range(top, bottom - 1, -1):
+            if theirs[position - bottom] == blockchain.hash(blockchain.chain[position - 1]):
+                return position
+        top = bottom - 1
+        window *= 2
+    return 0
+
+def sync_with_peer(blockchain, peer, difficulty=4, batch=SYNC_BATCH):
+    """ Pulls the blocks a longer peer chain has and ours lacks.
+    Returns a summary with the outcome, blocks received and bytes downloaded. """
+    result = {'peer': peer.url, 'status': 'up_to_date', 'blocks': 0}
+    theirs = peer.height()
+    ours = len(blockchain.chain)
+
+    if theirs['length'] > ours:
+        shared = common_length(blockchain, peer, ours)
+        previous_block = blockchain.chain[shared - 1] if shared else None
+        extending = shared == ours
+        received = []
+
+        for start in range(shared + 1, theirs['length'] + 1, batch):
+            blocks = peer.blocks(start, min(start + batch - 1, theirs['length']))
+            if not blocks or not blockchain.valid_chain(blocks, previous_block, difficulty):
+                result['status'] = 'invalid'
+                break
+            if extending:
+                blockchain.add_blocks(blocks)  # Valid so far, no need to hold it in memory
+            else:
+                received.extend(blocks)
+            previous_block = blocks[-1]
+            result['blocks'] += len(blocks)
+
+        if result['status'] != 'invalid':
+            if not extending:
+                blockchain.replace_from(shared, received)
+            result['status'] = 'extended' if extending else 'replaced'
+
+    result['bytes'] = peer.bytes_received
+    return result